@@ -1,9 +1,20 @@
+import math
+import operator
 from abc import ABCMeta, abstractmethod
-from typing import Any, Callable, Iterable, Optional, Union
+from typing import Any, Callable, Hashable, Iterable, Optional, Union
 
 import numpy as np
 import pandas as pd
 
+try:
+    import numexpr
+except ImportError:
+    numexpr = None
+
+# Smallest DataFrame evaluated with numexpr by compiled operations, below which its overhead outweighs its speedup
+_NUMEXPR_MIN_ROWS = 10_000
+_NUMEXPR_DTYPES = {np.dtype(t) for t in (bool, np.int32, np.int64, np.float32, np.float64)}
+
 
 class ColOp(metaclass=ABCMeta):
     """Abstract base class for column operations on pandas DataFrames.
@@ -16,6 +27,10 @@ class ColOp(metaclass=ABCMeta):
     ``|`` (bitwise or), ``&`` (bitwise and), ``~`` (bitwise not), ``==`` (equal to), ``!=`` (not equal to),
     ``<`` (less than), ``<=`` (less than or equal to), ``>`` (greater than), ``>=`` (greater than or equal to),
     ``+`` (addition), ``-`` (subtraction), ``*`` (multiplication), ``/`` (division), ``^`` (power)
+
+    Built-in operations are evaluated with a cache of the results of their sub-operations, keyed by their structure,
+    so that sub-operations appearing more than once, such as ``Col('x') * 2`` in
+    ``(Col('x') * 2 > 3) | (Col('x') * 2 < -3)``, are evaluated only once per DataFrame.
     """
 
     @abstractmethod
@@ -34,6 +49,44 @@ class ColOp(metaclass=ABCMeta):
         """
         pass
 
+    def evaluate(self, df: pd.DataFrame, cache: Optional[dict] = None) -> Union[pd.Series, Any]:
+        """Evaluate the operation on the DataFrame, reusing the results of identical operations in a cache.
+
+        Parameters
+        ----------
+        df : pd.DataFrame
+            Input DataFrame on which to apply the operation.
+        cache : dict, optional
+            Results of operations already evaluated, keyed by DataFrame and operation structure, to which this
+            operation's result (and those of its sub-operations) is added. Sharing a cache between the evaluations of
+            several operations on a DataFrame evaluates the sub-operations they have in common only once.
+
+        Returns
+        -------
+        Union[pd.Series, Any]
+            The resulting pandas Series or scalar value produced by this operation.
+        """
+        if cache is None:
+            cache = {}
+        custom = _is_custom(self)
+        key = (id(df), ColOp._key(self) if custom else self._key())
+        if key in cache:
+            return cache[key][1]
+        result = self(df) if custom else self._evaluate(df, cache)
+        cache[key] = (df, result)  # Holding the DataFrame keeps its id from being reused during the evaluation
+        return result
+
+    def _key(self) -> Hashable:
+        """Get a hashable key identifying the operation by its structure: built-in operations have equal keys if
+        they're of the same type with the same operands, and will produce the same result. Other operations are
+        only identified with themselves.
+        """
+        return ColOp, id(self)
+
+    def _evaluate(self, df: pd.DataFrame, cache: dict) -> Union[pd.Series, Any]:
+        """Evaluate the operation, evaluating its sub-operations with ``evaluate`` and the given cache."""
+        return self(df)
+
     def __or__(self, right: "ColOp") -> "ColOp":
         return _OrOp(self, right)
 
@@ -76,6 +129,50 @@ class ColOp(metaclass=ABCMeta):
     def __pow__(self, right: "ColOp") -> "ColOp":
         return _PowOp(self, right)
 
+    def compile(self, min_rows: int = _NUMEXPR_MIN_ROWS) -> "ColOp":
+        """Compile the arithmetic, comparison and boolean parts of this operation to numexpr expressions.
+
+        Each largest subexpression made of columns, numeric literals, and ``+ - * / ** < <= > >= == != & | ~`` is
+        evaluated as a single numexpr expression, in one multi-threaded pass over the data without the temporary
+        Series of each intermediate step. Other operations, such as ``map`` and ``apply``, are evaluated as usual,
+        and their results fed into the enclosing expression. Subexpressions over columns of dtypes numexpr doesn't
+        support (such as strings, dates, or nullable extension dtypes), and DataFrames of fewer than ``min_rows``
+        rows, are also evaluated as usual, as is everything if numexpr isn't installed.
+
+        Parameters
+        ----------
+        min_rows : int, optional
+            Smallest number of rows for which to use numexpr.
+
+        Returns
+        -------
+        ColOp
+            A new ColOp giving the same values and dtypes as this one (as a Series with the DataFrame's index and no
+            name, where compiled), except for powers, other than squares, square roots and reciprocals, which may
+            differ in the last digits.
+        """
+        return _CompiledOp(self, min_rows)
+
+    def short_circuit(self) -> "ColOp":
+        """Evaluate the right operand of each ``&`` and ``|`` in this operation only on the rows still undecided.
+
+        Rows where the left operand of ``&`` is False (or of ``|`` is True) keep that value, and the right operand is
+        evaluated on the DataFrame's remaining rows only, its results being scattered back. This can save most of
+        the work of an expensive right operand, such as a ``map``, behind a selective left one. Whether subsetting
+        is worth it is decided per evaluation from the fraction of undecided rows and a rough estimate of the cost per
+        row of the right operand; it's only done where the left operand gives a boolean Series.
+
+        The right operands must be evaluated row by row, as with ``map`` or comparisons, since an operation whose
+        values depend on other rows (e.g. ``apply(lambda s: s.rank())``) will give different values on a subset.
+
+        Returns
+        -------
+        ColOp
+            A new ColOp giving the same values as this one (as a Series with the DataFrame's index and no name,
+            where short-circuited).
+        """
+        return _ShortCircuitOp(self)
+
     def apply(self, f: Callable[[pd.Series], pd.Series]) -> "ColOp":
         """Apply a transformation function to the result of this operation.
 
@@ -135,8 +232,7 @@ class ColOp(metaclass=ABCMeta):
             A new ColOp that yields a boolean Series.
         """
         if isinstance(values, ColOp):
-            combined_vals = self.to_list() + values.to_list()
-            return combined_vals.map(lambda x: x[0] in x[1])
+            return _IsInColOp(self, values)
         else:
             return self.apply(lambda s: s.isin(values))
 
@@ -153,7 +249,7 @@ class ColOp(metaclass=ABCMeta):
         ColOp
             A new ColOp that yields a boolean Series.
         """
-        return self.map(lambda x: value in x)
+        return _StrPredicateOp(self, "contains", value)
 
     def startswith(self, value: str) -> "ColOp":
         """Test whether each element of the Series starts with the specified substring.
@@ -168,8 +264,7 @@ class ColOp(metaclass=ABCMeta):
         ColOp
             A new ColOp that yields a boolean Series.
         """
-        value = str(value)
-        return self.map(lambda x: str(x).startswith(value))
+        return _StrPredicateOp(self, "startswith", str(value))
 
     def endswith(self, value: str) -> "ColOp":
         """Test whether each element of the Series starts with the specified substring.
@@ -184,8 +279,7 @@ class ColOp(metaclass=ABCMeta):
         ColOp
             A new ColOp that yields a boolean Series.
         """
-        value = str(value)
-        return self.map(lambda x: str(x).endswith(value))
+        return _StrPredicateOp(self, "endswith", str(value))
 
     def startswith_one_of(self, value: Iterable[str]) -> "ColOp":
         """Test whether each element of the Series starts with the specified substring.
@@ -200,11 +294,7 @@ class ColOp(metaclass=ABCMeta):
         ColOp
             A new ColOp that yields a boolean Series.
         """
-        if isinstance(value, str) or not isinstance(value, Iterable):
-            value = [str(value)]
-        else:
-            value = [str(v) for v in value]
-        return self.map(lambda x: any(str(x).startswith(s) for s in value))
+        return _StrPredicateOp(self, "startswith", _str_tuple(value))
 
     def endswith_one_of(self, value: str) -> "ColOp":
         """Test whether each element of the Series starts with the specified substring.
@@ -219,11 +309,7 @@ class ColOp(metaclass=ABCMeta):
         ColOp
             A new ColOp that yields a boolean Series.
         """
-        if isinstance(value, str) or not isinstance(value, Iterable):
-            value = [str(value)]
-        else:
-            value = [str(v) for v in value]
-        return self.map(lambda x: any(str(x).endswith(s) for s in value))
+        return _StrPredicateOp(self, "endswith", _str_tuple(value))
 
     def notna(self) -> "ColOp":
         """Test for non-missing values in the Series.
@@ -281,7 +367,47 @@ class ColOp(metaclass=ABCMeta):
         return self.map(lambda x: [x])
 
 
-class Index(ColOp):
+def _is_custom(op: ColOp) -> bool:
+    """Whether an operation is evaluated by a ``__call__`` other than that of the built-in operations."""
+    return type(op).__call__ is not _Op.__call__
+
+
+def _literal_key(value: Any) -> Hashable:
+    """Key a literal operand by its type and value (or identity, if unhashable), such that literals with equal keys
+    give equal results: the elements of tuples are keyed likewise, and floats by their sign too (as ``0.0 == -0.0``).
+    """
+    if isinstance(value, tuple):
+        return type(value), tuple(_literal_key(item) for item in value)
+    try:
+        hash(value)
+    except TypeError:
+        return type(value), id(value)
+    if isinstance(value, (float, np.floating)):
+        return type(value), value, math.copysign(1.0, value)
+    return type(value), value
+
+
+class _Op(ColOp):
+    """Base class of the built-in operations, which are evaluated with a cache of their sub-operations' results."""
+    _structure = None
+
+    def __call__(self, df: pd.DataFrame) -> Union[pd.Series, Any]:
+        # Not through evaluate, which calls the __call__ of subclasses that override it (and may call this one)
+        return self._evaluate(df, {})
+
+    def _key(self) -> Hashable:
+        if self._structure is None:
+            self._structure = (type(self),) + tuple(
+                (ColOp._key(operand) if _is_custom(operand) else operand._key()) if isinstance(operand, ColOp)
+                else _literal_key(operand)
+                for operand in self._operands())
+        return self._structure
+
+    def _operands(self) -> tuple:
+        return ()
+
+
+class Index(_Op):
     """Represent the index of a pandas DataFrame.
 
     Parameters
@@ -294,11 +420,11 @@ class Index(ColOp):
     >>> idx(df)
     DatetimeIndex([...])
     """
-    def __call__(self, df: pd.DataFrame) -> pd.Index:
+    def _evaluate(self, df: pd.DataFrame, cache: dict) -> pd.Index:
         return df.index
 
 
-class Col(ColOp):
+class Col(_Op):
     """Represent a named column in a DataFrame.
 
     Parameters
@@ -316,7 +442,10 @@ class Col(ColOp):
     def __init__(self, name: Optional[str]):
         self._name = name
 
-    def __call__(self, df: pd.DataFrame) -> pd.Series:
+    def _operands(self) -> tuple:
+        return self._name,
+
+    def _evaluate(self, df: pd.DataFrame, cache: dict) -> pd.Series:
         if self._name is None:
             return df.iloc[:]
         else:
@@ -339,21 +468,24 @@ class Values(Col):
     def __init__(self):
         super().__init__(None)
 
-    def __call__(self, s: pd.Series) -> pd.Series:
+    def _evaluate(self, s: pd.Series, cache: dict) -> pd.Series:
         if isinstance(s, pd.DataFrame):
             raise TypeError("Values can only be called on a Series")
         return s.iloc[:]
 
 
-class _LiteralOp(ColOp):
+class _LiteralOp(_Op):
     def __init__(self, value: Any) -> None:
         self._value = value
 
-    def __call__(self, df: pd.DataFrame) -> Any:
+    def _operands(self) -> tuple:
+        return self._value,
+
+    def _evaluate(self, df: pd.DataFrame, cache: dict) -> Any:
         return self._value
 
 
-class _ComparisonOp(ColOp):
+class _ComparisonOp(_Op):
     def __init__(self, col: ColOp, value: Union[ColOp, Any]) -> None:
         self._col = col
         if isinstance(value, ColOp):
@@ -361,33 +493,36 @@ class _ComparisonOp(ColOp):
         else:
             self._value = _LiteralOp(value)
 
+    def _operands(self) -> tuple:
+        return self._col, self._value
+
 
 class _EqOp(_ComparisonOp):
-    def __call__(self, df: pd.DataFrame) -> pd.Series:
-        return self._col(df) == self._value(df)
+    def _evaluate(self, df: pd.DataFrame, cache: dict) -> pd.Series:
+        return self._col.evaluate(df, cache) == self._value.evaluate(df, cache)
 
 
 class _LtOp(_ComparisonOp):
-    def __call__(self, df: pd.DataFrame) -> pd.Series:
-        return self._col(df) < self._value(df)
+    def _evaluate(self, df: pd.DataFrame, cache: dict) -> pd.Series:
+        return self._col.evaluate(df, cache) < self._value.evaluate(df, cache)
 
 
 class _LeOp(_ComparisonOp):
-    def __call__(self, df: pd.DataFrame) -> pd.Series:
-        return self._col(df) <= self._value(df)
+    def _evaluate(self, df: pd.DataFrame, cache: dict) -> pd.Series:
+        return self._col.evaluate(df, cache) <= self._value.evaluate(df, cache)
 
 
 class _GtOp(_ComparisonOp):
-    def __call__(self, df: pd.DataFrame) -> pd.Series:
-        return self._col(df) > self._value(df)
+    def _evaluate(self, df: pd.DataFrame, cache: dict) -> pd.Series:
+        return self._col.evaluate(df, cache) > self._value.evaluate(df, cache)
 
 
 class _GeOp(_ComparisonOp):
-    def __call__(self, df: pd.DataFrame) -> pd.Series:
-        return self._col(df) >= self._value(df)
+    def _evaluate(self, df: pd.DataFrame, cache: dict) -> pd.Series:
+        return self._col.evaluate(df, cache) >= self._value.evaluate(df, cache)
 
 
-class _BinaryOp(ColOp):
+class _BinaryOp(_Op):
     def __init__(self, left: Union[ColOp, Any], right: Union[ColOp, Any]) -> None:
         if isinstance(left, ColOp):
             self._left = left
@@ -398,63 +533,431 @@ class _BinaryOp(ColOp):
         else:
             self._right = _LiteralOp(right)
 
+    def _operands(self) -> tuple:
+        return self._left, self._right
+
 
 class _OrOp(_BinaryOp):
-    def __call__(self, df: pd.DataFrame) -> pd.Series:
-        return self._left(df) | self._right(df)
+    def _evaluate(self, df: pd.DataFrame, cache: dict) -> pd.Series:
+        left = self._left.evaluate(df, cache)
+        if isinstance(cache, _ShortCircuitCache):
+            result = _short_circuit(left, self._right, True, df, cache)
+            if result is not None:
+                return result
+        return left | self._right.evaluate(df, cache)
 
 
 class _AndOp(_BinaryOp):
-    def __call__(self, df: pd.DataFrame) -> pd.Series:
-        return self._left(df) & self._right(df)
+    def _evaluate(self, df: pd.DataFrame, cache: dict) -> pd.Series:
+        left = self._left.evaluate(df, cache)
+        if isinstance(cache, _ShortCircuitCache):
+            result = _short_circuit(left, self._right, False, df, cache)
+            if result is not None:
+                return result
+        return left & self._right.evaluate(df, cache)
 
 
 class _AddOp(_BinaryOp):
-    def __call__(self, df: pd.DataFrame) -> pd.Series:
-        return self._left(df) + self._right(df)
+    def _evaluate(self, df: pd.DataFrame, cache: dict) -> pd.Series:
+        return self._left.evaluate(df, cache) + self._right.evaluate(df, cache)
 
 
 class _SubtractOp(_BinaryOp):
-    def __call__(self, df: pd.DataFrame) -> pd.Series:
-        return self._left(df) - self._right(df)
+    def _evaluate(self, df: pd.DataFrame, cache: dict) -> pd.Series:
+        return self._left.evaluate(df, cache) - self._right.evaluate(df, cache)
 
 
 class _MultiplyOp(_BinaryOp):
-    def __call__(self, df: pd.DataFrame) -> pd.Series:
-        return self._left(df) * self._right(df)
+    def _evaluate(self, df: pd.DataFrame, cache: dict) -> pd.Series:
+        return self._left.evaluate(df, cache) * self._right.evaluate(df, cache)
 
 
 class _DivideOp(_BinaryOp):
-    def __call__(self, df: pd.DataFrame) -> pd.Series:
-        return self._left(df) / self._right(df)
+    def _evaluate(self, df: pd.DataFrame, cache: dict) -> pd.Series:
+        return self._left.evaluate(df, cache) / self._right.evaluate(df, cache)
 
 
 class _PowOp(_BinaryOp):
-    def __call__(self, df: pd.DataFrame) -> pd.Series:
-        return self._left(df) ** self._right(df)
+    def _evaluate(self, df: pd.DataFrame, cache: dict) -> pd.Series:
+        return self._left.evaluate(df, cache) ** self._right.evaluate(df, cache)
 
 
-class _NotOp(ColOp):
+class _NotOp(_Op):
     def __init__(self, col: ColOp) -> None:
         self._col = col
 
-    def __call__(self, df: pd.DataFrame) -> pd.Series:
-        return ~self._col(df)
+    def _operands(self) -> tuple:
+        return self._col,
 
+    def _evaluate(self, df: pd.DataFrame, cache: dict) -> pd.Series:
+        return ~self._col.evaluate(df, cache)
 
-class _ColApplyOp(ColOp):
+
+class _ColApplyOp(_Op):
     def __init__(self, col: ColOp, f: Callable[[pd.Series], pd.Series]) -> None:
         self._col = col
         self._fun = f
 
-    def __call__(self, df: pd.DataFrame) -> pd.Series:
-        return self._fun(self._col(df))
+    def _operands(self) -> tuple:
+        return self._col, self._fun
+
+    def _evaluate(self, df: pd.DataFrame, cache: dict) -> pd.Series:
+        return self._fun(self._col.evaluate(df, cache))
 
 
-class _ColMapOp(ColOp):
+class _ColMapOp(_Op):
     def __init__(self, col: ColOp, f: Callable[[Any], Any]) -> None:
         self._col = col
         self._fun = f
 
-    def __call__(self, df: pd.DataFrame) -> pd.Series:
-        return self._col(df).map(self._fun)
+    def _operands(self) -> tuple:
+        return self._col, self._fun
+
+    def _evaluate(self, df: pd.DataFrame, cache: dict) -> pd.Series:
+        return self._col.evaluate(df, cache).map(self._fun)
+
+
+def _str_tuple(value: Union[str, Iterable[str]]) -> tuple[str, ...]:
+    if isinstance(value, str) or not isinstance(value, Iterable):
+        return str(value),
+    return tuple(str(v) for v in value)
+
+
+def _is_string_series(s: Any) -> bool:
+    """Whether every non-missing element of a Series is a ``str``, so that its ``.str`` methods apply."""
+    if not isinstance(s, pd.Series):
+        return False
+    if isinstance(s.dtype, pd.StringDtype):
+        return True
+    return s.dtype == object and pd.api.types.infer_dtype(s, skipna=True) == "string"
+
+
+class _StrPredicateOp(_Op):
+    """A ``str`` method (or ``in`` test) applied to each element, vectorized for string-typed Series.
+
+    Elements are tested with ``str(x).startswith(value)`` (likewise ``endswith``) or ``value in x``. When the Series
+    holds strings, the non-missing elements are tested at once with its ``.str`` methods, passing a tuple of prefixes
+    or suffixes for the ``_one_of`` variants, and only the missing elements are tested one by one.
+    """
+
+    def __init__(self, col: ColOp, method: str, value: Any) -> None:
+        self._col = col
+        self._method = method
+        self._value = value
+
+    def _operands(self) -> tuple:
+        return self._col, self._method, self._value
+
+    def _test(self, x: Any) -> bool:
+        if self._method == "contains":
+            return self._value in x
+        return getattr(str(x), self._method)(self._value)
+
+    def _evaluate(self, df: pd.DataFrame, cache: dict) -> pd.Series:
+        s = self._col.evaluate(df, cache)
+        if (self._method == "contains" and not isinstance(self._value, str)) or not _is_string_series(s):
+            return s.map(self._test)
+        if self._method == "contains":
+            result = s.str.contains(self._value, regex=False, na=False)
+        else:
+            result = getattr(s.str, self._method)(self._value, na=False)
+        result = result.astype(bool)
+        missing = s.isna()
+        if missing.any():
+            result[missing] = s[missing].map(self._test).astype(bool)
+        return result
+
+
+def _is_numeric(dtype: Any) -> bool:
+    return isinstance(dtype, np.dtype) and dtype.kind in "biufc"
+
+
+class _IsInColOp(_Op):
+    """Test ``x in y`` for each pair of elements of two Series, vectorized where possible.
+
+    If the right-hand Series has a numeric dtype, including a nullable one, ``x in y`` is read as ``x == y`` (rather
+    than raising a ``TypeError``) and compared at once, with missing values comparing unequal; if its elements are
+    one-dimensional numeric arrays, they are concatenated and compared with the repeated left-hand elements.
+    Otherwise, e.g. for elements that are lists, each pair is tested with ``in`` directly, without the intermediate
+    lists of ``to_list``.
+    """
+
+    def __init__(self, col: ColOp, values: ColOp) -> None:
+        self._col = col
+        self._values = values
+        self._rowwise = (col.to_list() + values.to_list()).map(lambda x: x[0] in x[1])
+
+    def _operands(self) -> tuple:
+        return self._col, self._values
+
+    def _evaluate(self, df: pd.DataFrame, cache: dict) -> pd.Series:
+        left = self._col.evaluate(df, cache)
+        right = self._values.evaluate(df, cache)
+        if not (isinstance(left, pd.Series) and isinstance(right, pd.Series) and left.index.equals(right.index)):
+            return self._rowwise.evaluate(df, cache)
+        if pd.api.types.is_numeric_dtype(right.dtype):
+            result = (left == right).to_numpy(dtype=bool, na_value=False)
+        else:
+            result = self._contained_in_arrays(left, right)
+            if result is None:
+                result = np.fromiter(map(operator.contains, right, left), dtype=bool, count=len(left))
+        return pd.Series(result, index=left.index, name=left.name if left.name == right.name else None)
+
+    @staticmethod
+    def _contained_in_arrays(left: pd.Series, right: pd.Series) -> Optional[np.ndarray]:
+        if not (len(right) and _is_numeric(left.dtype) and right.dtype == object
+                and all(type(y) is np.ndarray and y.ndim == 1 for y in right)):
+            return None
+        elements = np.concatenate(right.to_list())
+        if not _is_numeric(elements.dtype):
+            return None
+        rows = np.repeat(np.arange(len(right)), [len(y) for y in right])
+        result = np.zeros(len(left), dtype=bool)
+        result[rows[elements == left.to_numpy()[rows]]] = True
+        return result
+
+
+class _CompiledOp(_Op):
+    def __init__(self, col: ColOp, min_rows: int) -> None:
+        self._col = col
+        self._min_rows = min_rows
+
+    def _operands(self) -> tuple:
+        return self._col, self._min_rows
+
+    def _evaluate(self, df: pd.DataFrame, cache: dict) -> Union[pd.Series, Any]:
+        if numexpr is None or len(df) < self._min_rows:
+            return self._col.evaluate(df, cache)
+        return _NumexprEvaluator(df, cache).evaluate(self._col)
+
+
+class _ShortCircuitCache(dict):
+    """A cache of results for an evaluation in which ``&`` and ``|`` are short-circuited."""
+
+
+class _ShortCircuitOp(_Op):
+    def __init__(self, col: ColOp) -> None:
+        self._col = col
+
+    def _operands(self) -> tuple:
+        return self._col,
+
+    def _evaluate(self, df: pd.DataFrame, cache: dict) -> Union[pd.Series, Any]:
+        if isinstance(cache, _ShortCircuitCache):
+            return self._col.evaluate(df, cache)
+        short_circuit_cache = _ShortCircuitCache(cache)
+        result = self._col.evaluate(df, short_circuit_cache)
+        cache.update(short_circuit_cache)
+        return result
+
+
+# Estimated costs per row of evaluating operations, relative to a vectorized pass over a column (the default),
+# weighed against the cost of taking a subset of the rows of each column of the DataFrame to short-circuit
+_ROW_COSTS = {_ColMapOp: 50, _IsInColOp: 20, _StrPredicateOp: 5, _ColApplyOp: 5}
+_CUSTOM_ROW_COST = 50
+_MASK_ROW_COST = 0.5
+
+
+def _row_cost(op: ColOp, df: pd.DataFrame, cache: dict) -> float:
+    """Estimate the cost per row of evaluating an operation, not counting sub-operations already in the cache."""
+    custom = _is_custom(op)
+    if (id(df), ColOp._key(op) if custom else op._key()) in cache:
+        return 0
+    if custom:
+        return _CUSTOM_ROW_COST
+    return _ROW_COSTS.get(type(op), 1) + sum(
+        _row_cost(operand, df, cache) for operand in op._operands() if isinstance(operand, ColOp))
+
+
+def _short_circuit(left: Any, right: ColOp, decided: bool, df: pd.DataFrame, cache: dict) -> Optional[pd.Series]:
+    """Combine a boolean Series with the results of an operation evaluated only on the rows where the Series isn't
+    ``decided``, or return None if the Series can't be combined this way or it isn't estimated to be worth it.
+    """
+    if not (isinstance(left, pd.Series) and left.dtype == bool and left.index.equals(df.index)):
+        return None
+    values = left.to_numpy()
+    n_undecided = np.count_nonzero(values) if decided is False else len(values) - np.count_nonzero(values)
+    n_columns = df.shape[1] if df.ndim == 2 else 1
+    cost = _row_cost(right, df, cache)
+    if (len(df) - n_undecided) * cost <= len(df) * _MASK_ROW_COST + n_undecided * (n_columns + cost):
+        return None
+    result = values.copy()
+    if n_undecided:
+        undecided = np.flatnonzero(values != decided)
+        right_values = right.evaluate(df.iloc[undecided], cache)
+        if not (isinstance(right_values, pd.Series) and right_values.dtype == bool
+                and len(right_values) == len(undecided)):
+            return None
+        result[undecided] = right_values.to_numpy()
+    return pd.Series(result, index=left.index)
+
+
+# Operations that can be lowered to numexpr, with their symbols and corresponding functions
+_NUMEXPR_ARITHMETIC = {_AddOp: ("+", operator.add), _SubtractOp: ("-", operator.sub),
+                       _MultiplyOp: ("*", operator.mul), _DivideOp: ("/", operator.truediv),
+                       _PowOp: ("**", operator.pow)}
+_NUMEXPR_COMPARISONS = {_EqOp: "==", _LtOp: "<", _LeOp: "<=", _GtOp: ">", _GeOp: ">="}
+_NUMEXPR_LOGICAL = {_AndOp: "&", _OrOp: "|"}
+# Exponents that NumPy computes powers with exactly, as numexpr does for constant exponents
+_EXACT_POWERS = {-1, 0, 0.5, 1, 2}
+
+
+class _NumexprEvaluator:
+    """Evaluate an operation on a DataFrame, evaluating its largest subexpressions that numexpr supports as numexpr
+    expressions, and the rest with the interpreter, using the compiled results of their subexpressions.
+
+    Compiled results may differ from interpreted ones in name (and in details such as the handling of overflow), so
+    they're cached under their own keys, and the rest is evaluated with a copy of the cache in which the compiled
+    results take the place of the interpreted ones.
+    """
+    def __init__(self, df: pd.DataFrame, cache: dict) -> None:
+        self._df = df
+        self._cache = cache
+        self._local_cache = type(cache)(cache)
+
+    def _compiled_key(self, op: ColOp) -> tuple:
+        return id(self._df), (_CompiledOp, ColOp._key(op) if _is_custom(op) else op._key())
+
+    def evaluate(self, op: ColOp) -> Union[pd.Series, Any]:
+        key = (id(self._df), ColOp._key(op) if _is_custom(op) else op._key())
+        if key in self._local_cache:
+            return self._local_cache[key][1]
+        compiled_key = self._compiled_key(op)
+        if compiled_key in self._cache:
+            result = self._cache[compiled_key][1]
+        else:
+            variables, names = {}, {}
+            lowered = self._lower(op, variables, names)
+            if lowered is not None and any(np.ndim(v) > 0 for v in variables.values()):
+                result = pd.Series(numexpr.evaluate(lowered[0], local_dict=variables), index=self._df.index)
+            else:
+                if not _is_custom(op):
+                    for operand in op._operands():
+                        if isinstance(operand, ColOp):
+                            self.evaluate(operand)  # Compiles any subexpressions, caching their results for op
+                result = op.evaluate(self._df, self._local_cache)
+            self._cache[compiled_key] = (self._df, result)
+        self._local_cache[key] = (self._df, result)
+        return result
+
+    def _lower(self, op: ColOp, variables: dict, names: dict) -> Optional[tuple[str, np.dtype]]:
+        """Get a numexpr expression for an operation, binding the arrays and scalars it uses in ``variables``, along
+        with the dtype of its result, or None if numexpr can't evaluate it.
+        """
+        op_type = type(op)
+        if op_type in _NUMEXPR_ARITHMETIC or op_type in _NUMEXPR_COMPARISONS or op_type in _NUMEXPR_LOGICAL:
+            operands = self._lower_operands(op, variables, names)
+            if operands is None:
+                return None
+            (left, left_dtype), (right, right_dtype) = operands
+            is_bool = (left_dtype.kind == "b", right_dtype.kind == "b")
+            if op_type in _NUMEXPR_LOGICAL:
+                if not all(is_bool):
+                    return None
+                return f"({left} {_NUMEXPR_LOGICAL[op_type]} {right})", np.dtype(bool)
+            if op_type in _NUMEXPR_COMPARISONS:
+                if is_bool[0] != is_bool[1]:
+                    return None
+                dtype = np.result_type(left_dtype, right_dtype)
+                left, right = self._cast(left, left_dtype, dtype), self._cast(right, right_dtype, dtype)
+                return f"({left} {_NUMEXPR_COMPARISONS[op_type]} {right})", np.dtype(bool)
+            symbol, fun = _NUMEXPR_ARITHMETIC[op_type]
+            if any(is_bool):
+                return None
+            with np.errstate(all="ignore"):
+                dtype = fun(np.ones(1, left_dtype), np.ones(1, right_dtype)).dtype
+            if dtype not in _NUMEXPR_DTYPES or (op_type is _PowOp and dtype.kind != "f"):
+                return None  # Integer powers raise errors for negative exponents that numexpr doesn't
+            left, right = self._cast(left, left_dtype, dtype), self._cast(right, right_dtype, dtype)
+            return f"({left} {symbol} {right})", dtype
+        if op_type is _NotOp:
+            operand = self._lower_operand(op._col, variables, names)
+            if operand is None or operand[1].kind != "b":
+                return None
+            return f"(~{operand[0]})", operand[1]
+        return None
+
+    @staticmethod
+    def _cast(expression: str, dtype: np.dtype, result_dtype: np.dtype) -> str:
+        """Cast an operand to the dtype that NumPy computes an operation in, where numexpr's own casting differs, as
+        for ``int64 + float32``, which numexpr evaluates as float32 (and a power of an integer, as a product).
+        """
+        if dtype != result_dtype and result_dtype == np.float64:
+            return f"({expression} * 1.0)"  # Exact, unlike + 0.0 for -0.0
+        return expression
+
+    def _lower_operands(self, op: ColOp, variables: dict, names: dict) -> Optional[list[tuple[str, np.dtype]]]:
+        """Lower the operands of a binary operation, where a Python number operand takes the dtype that pandas (and
+        NumPy) would give it with the other operand, as in ``float32_column == 0.1``, rather than its own.
+        """
+        operands = op._operands()
+        is_number = [type(operand) is _LiteralOp and type(operand._value) in (bool, int, float)
+                     for operand in operands]
+        if all(is_number):
+            return None
+        lowered = [None if number else self._lower_operand(operand, variables, names)
+                   for operand, number in zip(operands, is_number)]
+        if any(lowered[i] is None for i in range(2) if not is_number[i]):
+            return None
+        dtype = next(lowered_operand[1] for lowered_operand in lowered if lowered_operand is not None)
+        for i in range(2):
+            if is_number[i]:
+                value = operands[i]._value
+                # numexpr replaces division by a constant with multiplication by its reciprocal (inexact, and
+                # raising ZeroDivisionError for 0), and powers with products, except for the exponents that NumPy
+                # special-cases too
+                inline = i == 0 or not (type(op) is _DivideOp or (type(op) is _PowOp and value not in _EXACT_POWERS))
+                lowered[i] = self._lower_number(value, dtype, variables, names, inline)
+                if lowered[i] is None:
+                    return None
+        return lowered
+
+    def _lower_number(self, value: Union[bool, int, float], other_dtype: np.dtype, variables: dict, names: dict,
+                      inline: bool = True) -> Optional[tuple[str, np.dtype]]:
+        if type(value) is bool:
+            return repr(value), np.dtype(bool)
+        dtype = np.result_type(other_dtype, value)
+        if dtype not in _NUMEXPR_DTYPES:
+            return None
+        if inline and np.isfinite(value) and abs(value) < 2 ** 31 and (type(value) is int or dtype == np.float64):
+            # Written into the expression, so that numexpr can optimize it (as in x**2 -> x*x): numexpr types int
+            # literals like pandas, but float literals as float64, so others are bound as arrays of the right dtype
+            return repr(value), dtype
+        key = (_LiteralOp, _literal_key(value), dtype)
+        if key not in names:
+            try:
+                with np.errstate(all="ignore"):
+                    array = np.asarray(value, dtype=dtype)
+            except OverflowError:  # Which pandas raises too
+                return None
+            names[key] = f"v{len(names)}"
+            variables[names[key]] = array
+        return names[key], dtype
+
+    def _lower_operand(self, op: ColOp, variables: dict, names: dict) -> Optional[tuple[str, np.dtype]]:
+        lowered = self._lower(op, variables, names)
+        if lowered is not None:
+            return lowered
+        key = ColOp._key(op) if _is_custom(op) else op._key()
+        if key not in names:
+            value = self._bindable(self.evaluate(op))
+            if value is None:
+                return None
+            names[key] = f"v{len(names)}"
+            variables[names[key]] = value
+        return names[key], variables[names[key]].dtype
+
+    def _bindable(self, value: Any) -> Optional[np.ndarray]:
+        """Get a value as an array (or 0-d array, for a scalar) of a dtype that numexpr supports, or None."""
+        if isinstance(value, (pd.Series, pd.Index)):
+            if isinstance(value, pd.Series) and not (value.index is self._df.index or
+                                                     value.index.equals(self._df.index)):
+                return None  # Would be aligned by pandas
+            value = value.to_numpy() if value.dtype in _NUMEXPR_DTYPES else None
+        elif isinstance(value, (bool, int, float, np.bool_, np.integer, np.floating)):
+            value = np.asarray(value)
+        if not isinstance(value, np.ndarray) or value.dtype not in _NUMEXPR_DTYPES:
+            return None
+        if value.ndim > 1 or (value.ndim == 1 and len(value) != len(self._df)):
+            return None
+        return value
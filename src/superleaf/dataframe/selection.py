@@ -9,9 +9,10 @@ from superleaf.collections.ordered_set import OrderedSet
 
 def _pass_filter(df: pd.DataFrame | pd.Series, *filters, **col_filters) -> np.ndarray:
     row_bools = np.ones(len(df)).astype(bool)
+    cache = {}  # Results of column operations, shared so that subexpressions common to several filters run once
     for filt in filters:
         if isinstance(filt, ColOp):
-            row_bools = row_bools & filt(df)
+            row_bools = row_bools & filt.evaluate(df, cache)
         elif callable(filt):
             if isinstance(df, pd.DataFrame):
                 row_bools = row_bools & df.apply(filt, axis=1)
@@ -36,9 +37,9 @@ def _pass_filter(df: pd.DataFrame | pd.Series, *filters, **col_filters) -> np.nd
         else:
             col_getter = Col(col)
         if isinstance(filt, ColOp) or not callable(filt):
-            row_bools = row_bools & (col_getter == filt)(df)
+            row_bools = row_bools & (col_getter == filt).evaluate(df, cache)
         elif callable(filt):
-            row_bools = row_bools & col_getter.map(filt)(df)
+            row_bools = row_bools & col_getter.map(filt).evaluate(df, cache)
         else:
             raise TypeError(
                 "Keyword filters must be values, column operators, or callables to apply to each value in the column"
@@ -12,8 +12,10 @@ T = TypeVar("T")
 U = TypeVar("U")
 
 
-def mapped(f: Callable[[T], U], seq: Iterable[T], parallel=False, workers=None) -> List[U]:
-    if parmap is not None and (parallel or (workers is not None and (workers < 0 or workers > 1))):
+def mapped(f: Callable[[T], U], seq: Iterable[T], parallel=False, workers=None, pool=None) -> List[U]:
+    if pool is not None:
+        return pool.map(f, seq)
+    elif parmap is not None and (parallel or (workers is not None and (workers < 0 or workers > 1))):
         if workers is None:
             workers = -1
         return parmap(f, seq, n_workers=workers)
@@ -21,8 +23,10 @@ def mapped(f: Callable[[T], U], seq: Iterable[T], parallel=False, workers=None)
         return _mapped_s(f, seq)
 
 
-def flat_map(f: Callable, seq: Iterable, depth=None, drop_null=True, parallel=False, workers=None) -> list:
-    if parmap is not None and (parallel or (workers is not None and (workers < 0 or workers > 1))):
+def flat_map(f: Callable, seq: Iterable, depth=None, drop_null=True, parallel=False, workers=None, pool=None) -> list:
+    if pool is not None:
+        return flatten(pool.map(f, seq), depth=depth, drop_null=drop_null)
+    elif parmap is not None and (parallel or (workers is not None and (workers < 0 or workers > 1))):
         if workers is None:
             workers = -1
         return flatten(parmap(f, seq, n_workers=workers), depth=depth, drop_null=drop_null)
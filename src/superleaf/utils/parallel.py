@@ -1,23 +1,65 @@
 import argparse
+import asyncio
+import atexit
+import hashlib
+import importlib
+import inspect
+import itertools
+import json
 import math
+import operator
 import os
+import pickle
+import signal
 import time
+import traceback
 from abc import ABC, abstractmethod
-from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
-from multiprocessing import cpu_count, Manager, current_process, shared_memory
+from collections.abc import Mapping, Sequence
+from contextlib import nullcontext
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, ProcessPoolExecutor, as_completed, wait
+from concurrent.futures import InvalidStateError
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, replace
+import multiprocessing
+import queue
+from multiprocessing import cpu_count, current_process, shared_memory
 from multiprocessing.managers import SharedMemoryManager
-from threading import Thread, Event
-from typing import Optional
+from functools import partial
+from threading import Thread, Event, Lock, RLock, current_thread, main_thread
+from typing import Optional, Union
 
+import multiprocess
 from multiprocess import Pool
 import numpy as np
 import pandas as pd
 import pyarrow as pa
+import pyarrow.compute as pc
 from pyarrow import ipc
+import pyarrow.parquet as pq
 from tqdm import tqdm
 
 from .hashing import get_hash_string
 
+# Minimum size in bytes of arrays and DataFrames placed in shared memory by map calls with share=True
+_DEFAULT_SHARE_THRESHOLD = 1 << 20
+
+# Shared memory segments created by containers (without a manager) are named {prefix}{pid}_{token}, so that segments
+# left behind by processes that have died can be found
+_SEGMENT_PREFIX = "superleaf_"
+_SHM_DIR = "/dev/shm"
+
+# Resource limits and allowances used to size pools with n_workers="auto"
+_CGROUP_ROOT = "/sys/fs/cgroup"
+_WORKER_BASE_MEMORY = 100 << 20  # Memory allowed for each worker process, besides that used by its tasks
+_MEMORY_HEADROOM = 0.8  # Fraction of the available memory that workers' tasks may use
+_MIN_WORK_PER_WORKER = 0.1  # Seconds of work to give each worker process, to be worth starting it
+_MAX_THREADS_PER_CPU = 16
+
+# Environment variables capping the threads of BLAS and OpenMP libraries loaded after they are set
+_NATIVE_THREAD_VARS = ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS", "BLIS_NUM_THREADS",
+                       "VECLIB_MAXIMUM_THREADS", "NUMEXPR_NUM_THREADS")
+
 
 def _chunkify(lst, n_chunks, enumerated=True):
     """Split list lst into n_chunks roughly equal chunks."""
@@ -27,74 +69,569 @@ def _chunkify(lst, n_chunks, enumerated=True):
     return [lst[i:i+chunk_size] for i in range(0, len(lst), chunk_size)]
 
 
-def _progress_updater(counter, total, pbar, stop_event, poll_interval=0.1):
-    """Periodically poll the shared counter and update tqdm progress bar."""
-    last = 0
-    while last < total and not stop_event.is_set():
-        current = counter.value
-        if current > last:
-            pbar.update(current - last)
-            last = current
-        time.sleep(poll_interval)
+def _iter_chunks(iterable, chunk_size, enumerated=True):
+    """Lazily split iterable into lists of up to chunk_size (index, item) pairs."""
+    if enumerated:
+        iterable = enumerate(iterable)
+    iterable = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterable, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _iter_batches(iterable, batch_size):
+    """Lazily split iterable into (start index, batch) pairs, where NumPy and pandas inputs are split into slices and
+    other iterables into lists.
+    """
+    if isinstance(iterable, (pd.Series, pd.DataFrame)):
+        for start in range(0, len(iterable), batch_size):
+            yield start, iterable.iloc[start:start + batch_size]
+    elif isinstance(iterable, np.ndarray):
+        for start in range(0, len(iterable), batch_size):
+            yield start, iterable[start:start + batch_size]
+    else:
+        for chunk in _iter_chunks(iterable, batch_size):
+            yield chunk[0][0], [item for _, item in chunk]
+
+
+def _resolve_batch_size(batch_size, total, n_workers) -> int:
+    """Get the batch size for a batched map, defaulting to four batches per worker."""
+    if batch_size is not None:
+        return batch_size
+    if total is None:
+        raise ValueError("batch_size is required for batched maps over iterables without a length")
+    return max(1, math.ceil(total / (4 * n_workers)))
 
 
-def _run_thread_pool(func, iterable, star=False, update_func=None, n_workers=4, **pool_params):
-    """Run tasks in a ThreadPoolExecutor with optional update callback."""
-    results = []
-    with ThreadPoolExecutor(max_workers=n_workers, **pool_params) as executor:
-        if star:
-            futures = [executor.submit(func, *item) for item in iterable]
-        else:
-            futures = [executor.submit(func, item) for item in iterable]
+def _flatten_batches(batch_results):
+    """Expand (start index, results) pairs for batches into (index, result) pairs for individual items."""
+    return [(start + i, result) for start, results in batch_results for i, result in enumerate(results)]
+
+
+def _progress_updater(progress_queue, key, total, pbar, stop_event, poll_interval=0.1):
+    """Drain batched progress counts reported by workers and update tqdm progress bar.
+
+    Counts are tagged with the key of the map call that produced them; counts for other calls are discarded.
+    """
+    done = 0
+    while done < total and not stop_event.is_set():
         try:
-            for fut in as_completed(futures):
-                results.append(fut.result())
-                if update_func is not None:
-                    update_func()  # call the update function per task
-        except KeyboardInterrupt:
-            # Cancel pending tasks and shutdown executor
-            for fut in futures:
-                fut.cancel()
-            executor.shutdown(wait=False)
-            raise
-    return results
+            count_key, n = progress_queue.get(timeout=poll_interval)
+        except queue.Empty:
+            continue
+        if count_key == key:
+            pbar.update(n)
+            done += n
+
 
+class _ProgressReporter:
+    """Accumulate completed-task counts in a worker process, sending them to the parent in batches.
 
-def _process_worker(func, enumerated_items, star, counter, lock, nthreads_per_process, verbose=False):
-    """Worker function that creates its own thread pool for a chunk of items.
-       Each completed task increments the shared counter.
+    Counts are put on the queue every ``batch_size`` tasks or ``interval`` seconds, whichever comes first, so the
+    per-task cost is a thread lock and a clock read rather than a round trip to another process.
     """
-    def thread_func(idx_item):
-        idx, item = idx_item
-        if star:
+    def __init__(self, progress_queue, key, batch_size=1000, interval=0.1):
+        self._queue = progress_queue
+        self._key = key
+        self._batch_size = batch_size
+        self._interval = interval
+        self._lock = Lock()
+        self._count = 0
+        self._last_flush = time.monotonic()
+
+    def update(self, n=1):
+        with self._lock:
+            self._count += n
+            now = time.monotonic()
+            if self._count >= self._batch_size or now - self._last_flush >= self._interval:
+                self._flush(now)
+
+    def flush(self):
+        with self._lock:
+            self._flush(time.monotonic())
+
+    def _flush(self, now):
+        if self._count:
+            self._queue.put((self._key, self._count))
+            self._count = 0
+        self._last_flush = now
+
+
+# Per-process worker state, set up by the pool initializer and reused across tasks
+_progress_queue = None
+_start_queue = None
+_native_thread_limits = None
+_thread_executors: dict[int, ThreadPoolExecutor] = {}
+
+
+def _limit_native_threads(n_threads, set_env=True):
+    """Cap the threads used by BLAS and OpenMP libraries in this process, returning the ``threadpoolctl`` limiter
+    (whose ``restore_original_limits`` undoes it), or None if ``threadpoolctl`` isn't installed.
+
+    Without ``threadpoolctl``, only the environment variables read by these libraries are set (if ``set_env``), which
+    has no effect on libraries already loaded.
+    """
+    if set_env:
+        for var in _NATIVE_THREAD_VARS:
+            os.environ[var] = str(n_threads)
+    try:
+        from threadpoolctl import threadpool_limits
+    except ImportError:
+        return None
+    return threadpool_limits(limits=n_threads)
+
+
+def _init_pool_worker(progress_queue, start_queue=None, initializer=None, initargs=(), native_threads=None):
+    """Process pool initializer storing the progress and task start queues, and capping native threads if requested,
+    then calling any user initializer.
+    """
+    global _progress_queue, _start_queue, _native_thread_limits
+    _progress_queue = progress_queue
+    _start_queue = start_queue
+    if native_threads is not None:
+        _native_thread_limits = _limit_native_threads(native_threads)
+    if initializer is not None:
+        initializer(*initargs)
+
+
+def _get_thread_executor(n_threads) -> ThreadPoolExecutor:
+    """Get this process's thread pool of the given size, creating it on first use."""
+    if n_threads not in _thread_executors:
+        _thread_executors[n_threads] = ThreadPoolExecutor(max_workers=n_threads)
+    return _thread_executors[n_threads]
+
+
+@dataclass
+class TaskError:
+    """A failed task in a map run with ``on_error="collect"``, and the error raised by its last attempt."""
+    index: int
+    error_type: str
+    message: str
+    traceback: str
+    attempts: int
+
+    @classmethod
+    def from_exception(cls, index: int, error: BaseException, attempts: int) -> "TaskError":
+        tb = "".join(traceback.format_exception(type(error), error, error.__traceback__))
+        return cls(index, type(error).__name__, str(error), tb, attempts)
+
+    def __str__(self):
+        return f"Item {self.index} failed after {self.attempts} attempt(s): {self.error_type}: {self.message}"
+
+
+def _call_with_timeout(fn, timeout):
+    """Call fn on a new thread, raising TimeoutError if it doesn't return within timeout seconds.
+
+    Threads can't be stopped, so a call that times out is abandoned to finish (or not) in the background.
+    """
+    future = Future()
+
+    def run():
+        future.set_running_or_notify_cancel()
+        try:
+            future.set_result(fn())
+        except BaseException as e:
+            future.set_exception(e)
+
+    Thread(target=run, daemon=True).start()
+    try:
+        return future.result(timeout)
+    except FuturesTimeoutError:
+        if future.done():
+            raise  # Raised by fn itself
+        raise TimeoutError(f"Task timed out after {timeout} seconds") from None
+
+
+@dataclass
+class _TaskPolicy:
+    """How workers handle tasks that raise an exception.
+
+    A failing task is retried up to ``retries`` times, after waiting ``retry_delay`` seconds, doubling for each further
+    retry. Once out of retries, the exception is raised if ``on_error`` is "raise", and otherwise returned in place of
+    the result as a ``TaskError``. A ``timeout`` here is applied in the worker by abandoning the call (see
+    ``_TimeoutSupervisor`` for process workers, which are killed instead). If ``start_key`` is set, the start of every
+    attempt is reported on the task start queue, tagged with it.
+    """
+    on_error: str = "raise"
+    retries: int = 0
+    retry_delay: float = 0.1
+    timeout: Optional[float] = None
+    start_key: Optional[int] = None
+    prior_attempts: int = 0
+
+    def __post_init__(self):
+        if self.on_error not in ("raise", "collect", "skip"):
+            raise ValueError("on_error must be one of 'raise', 'collect' or 'skip'")
+
+    def call(self, fn, idx):
+        """Call fn() for the task at idx, returning its result, or a TaskError if it fails and isn't raised."""
+        attempt = 0
+        while True:
+            attempt += 1
+            if self.start_key is not None and _start_queue is not None:
+                _start_queue.put((self.start_key, idx, os.getpid()))
+            try:
+                return fn() if self.timeout is None else _call_with_timeout(fn, self.timeout)
+            except Exception as e:
+                if attempt > self.retries:
+                    if self.on_error == "raise":
+                        raise
+                    return TaskError.from_exception(idx, e, self.prior_attempts + attempt)
+            time.sleep(self.retry_delay * 2 ** (attempt - 1))
+
+
+def _make_policy(on_error="raise", retries=0, retry_delay=0.1, timeout=None) -> Optional[_TaskPolicy]:
+    """Get the task policy for a map call, or None if failures are simply raised."""
+    if on_error == "raise" and not retries and timeout is None:
+        return None
+    return _TaskPolicy(on_error, retries, retry_delay, timeout)
+
+
+def _handle_errors(results, on_error):
+    """Apply on_error to (index, result) pairs, returning the pairs to keep, and the TaskErrors if "collect" (or else
+    None).
+    """
+    if on_error == "raise":
+        return results, None
+    if on_error == "skip":
+        return [(idx, result) for idx, result in results if not isinstance(result, TaskError)], None
+    errors = [result for _, result in results if isinstance(result, TaskError)]
+    return [(idx, None if isinstance(result, TaskError) else result) for idx, result in results], errors
+
+
+def _process_worker(func, enumerated_items, star, nthreads_per_process, verbose=False, progress_key=None, out=None,
+                    batched=False, policy=None):
+    """Worker function that runs a chunk of items on the process's thread pool.
+       If a ``progress_key`` is given, completed tasks are reported to the parent on the progress queue.
+       If an ``out`` array (or ``SharedMemoryArray``) is given, each result is written to it at the item's index, and
+       None is returned in its place.
+       If ``batched``, the items are (start index, batch) pairs, ``func`` is called once per batch (with one list per
+       argument if ``star``), and must return one result per item of the batch.
+       If a ``_TaskPolicy`` is given, failing tasks are retried, and returned as ``TaskError``s, as it specifies.
+    """
+    if progress_key is not None and _progress_queue is not None:
+        reporter = _ProgressReporter(_progress_queue, progress_key)
+    else:
+        reporter = None
+    out_container = None
+    if isinstance(out, SharedMemoryArray):
+        out_container, out = out, out.load()
+
+    def call(item):
+        if batched and star:
+            result = func(*[list(arg) for arg in zip(*item)])
+        elif star:
             result = func(*item)
         else:
             result = func(item)
-        with lock:
-            counter.value += 1
+        if batched and len(result) != len(item):
+            raise ValueError(f"Batched function returned {len(result)} results for a batch of {len(item)} items")
+        return result
+
+    def thread_func(idx_item):
+        idx, item = idx_item
+        result = call(item) if policy is None else policy.call(partial(call, item), idx)
+        if isinstance(result, TaskError):
+            # Failed rows of out are left as they are
+            if batched:
+                result = [replace(result, index=idx + i) for i in range(len(item))]
+        elif batched:
+            if out is not None:
+                out[idx:idx + len(item)] = result
+                result = [None] * len(item)
+        elif out is not None:
+            out[idx] = result
+            result = None
+        if reporter is not None:
+            reporter.update(len(item) if batched else 1)
         return idx, result
 
     if verbose:
         print(f"Starting {current_process()} process worker with {nthreads_per_process} threads.")
-    with ThreadPoolExecutor(max_workers=nthreads_per_process) as thread_executor:
-        return list(thread_executor.map(thread_func, enumerated_items))
+    try:
+        if nthreads_per_process == 1:
+            return [thread_func(idx_item) for idx_item in enumerated_items]
+        return list(_get_thread_executor(nthreads_per_process).map(thread_func, enumerated_items))
+    finally:
+        if reporter is not None:
+            reporter.flush()
+        if out_container is not None:
+            out = None  # Release the view on the shared memory before closing it
+            out_container.close()
+
+
+def _map_serial(func, items, star, total=None, pbar_desc=None, out=None, batched=False, policy=None):
+    """Run func over items (or (start index, batch) pairs, if batched) in this thread, yielding (index, result)
+    pairs.
+    """
+    if not batched:
+        items = enumerate(items)
+    with tqdm(total=total, desc=pbar_desc) as pbar:
+        for idx_item in items:
+            results = _process_worker(func, [idx_item], star, 1, out=out, batched=batched, policy=policy)
+            if batched:
+                results = _flatten_batches(results)
+            pbar.update(len(results))
+            yield from results
+
+
+def _timed_process_worker(*args, **kwargs):
+    """Run _process_worker, also returning the time taken in seconds."""
+    start = time.perf_counter()
+    results = _process_worker(*args, **kwargs)
+    return time.perf_counter() - start, results
+
+
+class _AdaptiveChunker:
+    """Iterate over chunks of (index, item) pairs, sized from the measured per-item latency of completed chunks.
+
+    Chunks start with single items, then grow so each takes about ``target_time`` seconds, which amortizes the
+    submission overhead of cheap tasks while keeping chunks short enough to balance the load across workers. When the
+    total is known, chunks are capped so that there are at least ``4 * n_workers`` of them.
+    """
+    def __init__(self, iterable, n_workers, total=None, target_time=0.1, smoothing=0.5, enumerated=True):
+        self._items = enumerate(iterable) if enumerated else iter(iterable)
+        self._target_time = target_time
+        self._smoothing = smoothing
+        self._per_item = None
+        if total is not None:
+            self._max_chunksize = max(1, math.ceil(total / (4 * n_workers)))
+        else:
+            self._max_chunksize = None
 
+    @property
+    def chunksize(self) -> int:
+        if self._per_item is None:
+            return 1
+        chunksize = max(1, int(self._target_time / max(self._per_item, 1e-9)))
+        if self._max_chunksize is not None:
+            chunksize = min(chunksize, self._max_chunksize)
+        return chunksize
+
+    def record(self, n_items, elapsed):
+        per_item = elapsed / max(n_items, 1)
+        if self._per_item is None:
+            self._per_item = per_item
+        else:
+            self._per_item = self._smoothing * per_item + (1 - self._smoothing) * self._per_item
 
-def parmap(func, iterable, star=False, mode="process", n_workers=None, nthreads_per_process=None, pbar_desc=None,
-           verbose=False, max_tasks_per_child=None, **pool_params):
+    def unpack(self, timed_results):
+        elapsed, results = timed_results
+        self.record(len(results), elapsed)
+        return results
+
+    def __iter__(self):
+        while True:
+            chunk = list(itertools.islice(self._items, self.chunksize))
+            if not chunk:
+                return
+            yield chunk
+
+
+def _submit_async(pool, fn, *args, **kwargs) -> Future:
+    """Submit fn to a multiprocess Pool, returning a concurrent.futures.Future for the result."""
+    future = Future()
+    future.set_running_or_notify_cancel()
+    pool.apply_async(fn, args, kwargs, callback=future.set_result, error_callback=future.set_exception)
+    return future
+
+
+def _iter_windowed(submit, chunks, max_in_flight, ordered=True, update_func=None, unpack=None):
+    """Submit chunks lazily, with at most max_in_flight chunks pending or buffered, yielding (index, result) pairs.
+
+    ``submit`` takes a chunk of (index, item) pairs and returns a future resolving to a list of (index, result) pairs,
+    or to a value from which ``unpack`` extracts that list. When ``ordered``, completed chunks are held in a buffer
+    until all preceding chunks have been yielded.
     """
-    Apply ``func`` to every item in ``iterable``.
+    pending = {}
+    buffered = {}
+    next_chunk = 0
+    n_submitted = 0
+    chunks = iter(chunks)
+    exhausted = False
+    try:
+        while True:
+            while not exhausted and len(pending) + len(buffered) < max_in_flight:
+                chunk = next(chunks, None)
+                if chunk is None:
+                    exhausted = True
+                else:
+                    pending[submit(chunk)] = n_submitted
+                    n_submitted += 1
+            if not pending:
+                return
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                chunk_num = pending.pop(fut)
+                chunk_results = fut.result()
+                if unpack is not None:
+                    chunk_results = unpack(chunk_results)
+                if update_func is not None:
+                    update_func(len(chunk_results))
+                if ordered:
+                    buffered[chunk_num] = chunk_results
+                else:
+                    yield from chunk_results
+            while next_chunk in buffered:
+                yield from buffered.pop(next_chunk)
+                next_chunk += 1
+    finally:
+        for fut in pending:
+            fut.cancel()
+
+
+def _read_cgroup_file(*names) -> Optional[str]:
+    """Read the first of the named files under the cgroup root that exists."""
+    for name in names:
+        try:
+            with open(os.path.join(_CGROUP_ROOT, name)) as f:
+                return f.read().strip()
+        except OSError:
+            continue
+    return None
 
-    mode:
-      - "thread": use ThreadPoolExecutor with n_workers.
-      - "process": use ProcessPoolExecutor; each process runs a ThreadPoolExecutor of size nthreads_per_process.
 
-    A tqdm progress bar shows overall progress.
+def _available_cpus() -> int:
+    """Number of CPUs this process may use, given its CPU affinity and any cgroup (container) CPU quota."""
+    try:
+        n_cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        n_cpus = cpu_count()
+    quota = period = None
+    cpu_max = _read_cgroup_file("cpu.max")  # cgroup v2: "<quota> <period>", or "max <period>" if unlimited
+    if cpu_max is not None:
+        quota, period = cpu_max.split()[:2]
+    else:
+        quota = _read_cgroup_file("cpu/cpu.cfs_quota_us", "cpu,cpuacct/cpu.cfs_quota_us")  # -1 if unlimited
+        period = _read_cgroup_file("cpu/cpu.cfs_period_us", "cpu,cpuacct/cpu.cfs_period_us")
+    if quota not in (None, "max", "-1") and period:
+        n_cpus = min(n_cpus, max(1, math.ceil(int(quota) / int(period))))
+    return n_cpus
+
+
+def _available_memory() -> Optional[int]:
+    """Bytes of memory available to this process: the lesser of the system's available memory and the headroom
+    under any cgroup memory limit, or None if neither can be read.
     """
-    if n_workers is None or n_workers == 0:
+    available = []
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    available.append(int(line.split()[1]) * 1024)
+    except OSError:
+        pass
+    limit = _read_cgroup_file("memory.max", "memory/memory.limit_in_bytes")
+    usage = _read_cgroup_file("memory.current", "memory/memory.usage_in_bytes")
+    # cgroup v1 reports no limit as a huge number
+    if limit not in (None, "max") and usage is not None and int(limit) < 1 << 60:
+        available.append(max(int(limit) - int(usage), 0))
+    return min(available) if available else None
+
+
+def _current_rss() -> Optional[int]:
+    """Resident memory of this process in bytes, or None if it can't be read."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+@dataclass
+class _TaskSample:
+    """Costs of tasks measured by ``_sample_tasks``."""
+    latency: float  # Mean seconds per task
+    cpu_fraction: float  # Fraction of the time spent running on the CPU, rather than waiting
+    memory: Optional[int]  # Peak growth of resident memory in bytes, if known
+
+
+def _sample_tasks(func, iterable, star, max_tasks=3, max_time=1.0,
+                  poll_interval=0.005) -> tuple[Optional[_TaskSample], list]:
+    """Run up to the first ``max_tasks`` items of iterable (stopping once ``max_time`` seconds have been spent) in
+    this thread to measure their costs, while a second thread polls resident memory. Returns the measured costs (or
+    None if there are no items, or a task raises an exception) and the (index, result) pairs of the items run
+    successfully, so that they needn't be run again.
+    """
+    baseline = _current_rss()
+    peak = baseline
+    stop_event = Event()
+
+    def poll_memory():
+        nonlocal peak
+        while not stop_event.wait(poll_interval):
+            peak = max(peak, _current_rss())
+
+    if baseline is not None:
+        poller = Thread(target=poll_memory, daemon=True)
+        poller.start()
+    wall_time = cpu_time = 0.0
+    results = []
+    try:
+        for idx, item in enumerate(itertools.islice(iterable, max_tasks)):
+            start_wall, start_cpu = time.perf_counter(), time.thread_time()
+            result = func(*item) if star else func(item)
+            wall_time += time.perf_counter() - start_wall
+            cpu_time += time.thread_time() - start_cpu
+            results.append((idx, result))
+            if wall_time >= max_time:
+                break
+    except Exception:
+        return None, results
+    finally:
+        stop_event.set()
+    if not results:
+        return None, results
+    memory = None
+    if baseline is not None:
+        poller.join()
+        memory = max(peak, _current_rss()) - baseline
+    return _TaskSample(wall_time / len(results), min(cpu_time / max(wall_time, 1e-9), 1.0), memory), results
+
+
+def _auto_workers(mode, nthreads_per_process=None, sample=None, total=None) -> tuple[int, int]:
+    """Choose worker and thread counts for n_workers="auto", from the CPUs and memory available and, if given, a
+    ``_TaskSample`` of task costs.
+
+    Tasks spending a fraction ``f`` of their time on the CPU can keep a CPU busy with ``1 / f`` threads, so I/O-bound
+    tasks get that many threads per CPU (in "thread" mode), or per process (if ``nthreads_per_process`` isn't given),
+    while CPU-bound (GIL-bound) tasks get one thread each. The number of workers is then capped so that the peak
+    memory of their concurrent tasks, plus a fixed allowance per process, fits in the available memory, and in
+    process modes, so that each process gets enough of the ``total`` work to be worth starting.
+    """
+    n_cpus = _available_cpus()
+    threads_per_cpu = 1
+    if sample is not None and sample.cpu_fraction < 0.5:
+        threads_per_cpu = min(round(1 / max(sample.cpu_fraction, 1e-3)), _MAX_THREADS_PER_CPU)
+    if mode == "thread":
+        n_workers, nthreads_per_process = n_cpus * threads_per_cpu, 1
+    else:
+        n_workers = n_cpus
+        if nthreads_per_process is None:
+            nthreads_per_process = threads_per_cpu
+
+    memory = _available_memory()
+    if sample is not None and sample.memory is not None and memory is not None:
+        budget = _MEMORY_HEADROOM * memory
+        if mode == "thread":
+            n_workers = min(n_workers, int(budget / max(sample.memory, 1)))
+        else:
+            n_workers = min(n_workers, int(budget / (sample.memory * nthreads_per_process + _WORKER_BASE_MEMORY)))
+    if sample is not None and total is not None and mode != "thread":
+        n_workers = min(n_workers, int(total * sample.latency / _MIN_WORK_PER_WORKER))
+    return max(n_workers, 1), nthreads_per_process
+
+
+def _resolve_workers(mode, n_workers, nthreads_per_process, verbose=False):
+    """Normalize worker and thread counts, switching to notebook mode where needed."""
+    if n_workers == "auto":
+        n_workers, nthreads_per_process = _auto_workers(mode, nthreads_per_process)
+    elif n_workers is None or n_workers == 0:
         n_workers = 1
     elif n_workers < 0:
-        n_workers = cpu_count() + 1 + n_workers
+        n_workers = _available_cpus() + 1 + n_workers
 
     if nthreads_per_process is None or nthreads_per_process == 0:
         nthreads_per_process = 1
@@ -111,82 +648,1238 @@ def parmap(func, iterable, star=False, mode="process", n_workers=None, nthreads_
     if verbose:
         print(f"Using {n_workers} workers and {nthreads_per_process} threads per process.")
 
-    if not hasattr(iterable, '__len__'):
-        iterable = list(iterable)
-    total = len(iterable)
-    if total == 0:
-        return []
-    results = []
+    return mode, n_workers, nthreads_per_process
 
-    if n_workers == 1:
-        if star:
-            results = [func(*args) for args in tqdm(iterable, desc=pbar_desc, total=total)]
+
+def _canonical(value):
+    """Convert sets (at any depth in lists, tuples and dicts) to tuples of their elements' canonical pickled forms in
+    sorted order, since the iteration order of sets of strings and bytes varies between interpreter runs.
+    """
+    if isinstance(value, (set, frozenset)):
+        return type(value).__name__, tuple(sorted(_canonical_pickle(item) for item in value))
+    if type(value) in (list, tuple):
+        return type(value)(_canonical(item) for item in value)
+    if type(value) is dict:
+        return dict, tuple((_canonical(k), _canonical(v)) for k, v in value.items())
+    return value
+
+
+def _canonical_pickle(value) -> bytes:
+    try:
+        return pickle.dumps(_canonical(value), protocol=pickle.HIGHEST_PROTOCOL)
+    except Exception as e:
+        raise ValueError(f"Can't pickle {value!r} to identify its checkpoint; pass a checkpoint_key to identify it "
+                         "instead") from e
+
+
+def _checkpoint_key(func, iterable, batched=False, key=None) -> str:
+    """Key identifying a map of func over iterable across runs, from a hash of their pickled forms, or of ``key``.
+
+    Objects must be pickled the same way in every run to be found again: functions are pickled by reference (so
+    lambdas and local functions can't be), and sets within lists, tuples and dicts are sorted, but sets within other
+    objects are not. A ValueError is raised for anything that can't be pickled, and a ``key`` must be given instead.
+    NumPy and pandas inputs to batched maps are hashed whole.
+    """
+    if key is not None:
+        return get_hash_string([str(key)])
+    if batched and isinstance(iterable, (np.ndarray, pd.Series, pd.DataFrame)):
+        iterable = [iterable]
+    items_hasher = hashlib.sha1()
+    for item in iterable:
+        items_hasher.update(_canonical_pickle(item))
+    return get_hash_string([hashlib.sha1(_canonical_pickle(func)).hexdigest(), items_hasher.hexdigest()])
+
+
+class _Checkpoint:
+    """Store of the completed results of a map call, from which a rerun of the same call resumes.
+
+    Results are pickled to files under ``checkpoint_dir/<key>``, where the key is a hash of ``func`` and the items,
+    or of an explicit ``key`` (see ``_checkpoint_key``), so that only a rerun of the same call finds them. New
+    results are buffered, and written to a new file every ``interval`` seconds and when the call ends or fails; each
+    file is written under a temporary name and then renamed, so that a crash mid-write can't leave a partial file to
+    be loaded. Failed tasks are not stored, so they are rerun.
+
+    Without a ``checkpoint_dir``, results are only kept in memory, to merge results computed outside the map (by
+    ``add``) with those of the pending items.
+    """
+    def __init__(self, checkpoint_dir, func, iterable, batched=False, interval=5.0, key=None):
+        self.path = None
+        self._completed = {}
+        if checkpoint_dir is not None:
+            self.path = os.path.join(checkpoint_dir, _checkpoint_key(func, iterable, batched, key))
+            os.makedirs(self.path, exist_ok=True)
+            for name in os.listdir(self.path):
+                if name.endswith('.pkl'):
+                    with open(os.path.join(self.path, name), 'rb') as f:
+                        self._completed.update(pickle.load(f))
+        self.pending = [idx for idx in range(len(iterable)) if idx not in self._completed]
+        self._interval = interval
+        self._buffer = {}
+        self._last_write = time.monotonic()
+
+    def pending_items(self, iterable, batched=False):
+        """Get the items of iterable not yet completed."""
+        if batched and isinstance(iterable, (pd.Series, pd.DataFrame)):
+            return iterable.iloc[self.pending]
+        if batched and isinstance(iterable, np.ndarray):
+            return iterable[self.pending]
+        pending = set(self.pending)
+        return [item for idx, item in enumerate(iterable) if idx in pending]
+
+    def add(self, results) -> None:
+        """Store (index, result) pairs for the pending items, indexed by position among them, that were completed
+        outside the map, removing them from the pending items.
+        """
+        results = [(self.pending[i], result) for i, result in results]
+        self._completed.update(results)
+        if self.path is not None:
+            self._buffer.update(results)
+        done = {idx for idx, _ in results}
+        self.pending = [idx for idx in self.pending if idx not in done]
+
+    def record(self, results):
+        """Store (index, result) pairs for the pending items, indexed by position among them, yielding them with
+        their indices in the full input.
+        """
+        for i, result in results:
+            idx = self.pending[i]
+            if self.path is not None and not isinstance(result, TaskError):
+                self._buffer[idx] = result
+                if time.monotonic() - self._last_write >= self._interval:
+                    self.flush()
+            yield idx, result
+
+    def flush(self) -> None:
+        """Write the buffered results to a new file."""
+        if self._buffer:
+            path = os.path.join(self.path, f"{time.time_ns()}-{os.getpid()}.pkl")
+            with open(path + '.tmp', 'wb') as f:
+                pickle.dump(self._buffer, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(path + '.tmp', path)
+            self._buffer = {}
+        self._last_write = time.monotonic()
+
+    def merge(self, results) -> list:
+        """Add the (index, result) pairs completed by earlier runs to those of this run."""
+        return list(self._completed.items()) + list(results)
+
+
+class _ResultBuffer:
+    """Array into which workers write their results directly, for map calls with ``out`` or ``result_shape``.
+
+    In "thread" mode, workers write into ``out`` (or a new array) itself. Otherwise, unless ``out`` is already a
+    ``SharedMemoryArray``, workers write into a temporary ``SharedMemoryArray``, whose contents are copied into
+    ``out`` (or a new array) by ``result``, and which is removed by ``close``.
+    """
+    def __init__(self, total, mode, out=None, result_shape=None, result_dtype=None):
+        if out is not None:
+            if len(out.shape) == 0 or out.shape[0] != total:
+                raise ValueError(f"out must have a first dimension of length {total}, got shape {out.shape}")
+            shape, dtype = out.shape, out.dtype
         else:
-            results = [func(arg) for arg in tqdm(iterable, desc=pbar_desc, total=total)]
-    else:
+            if isinstance(result_shape, int):
+                result_shape = (result_shape,)
+            shape, dtype = (total,) + tuple(result_shape), np.dtype(result_dtype or float)
+        self._out = out
+        self._shared = None
+        if isinstance(out, SharedMemoryArray):
+            self.target = out.load() if mode == "thread" else out
+        elif mode == "thread":
+            self.target = out if out is not None else np.empty(shape, dtype=dtype)
+        else:
+            self._shared = SharedMemoryArray.create_empty(shape, dtype)
+            self.target = self._shared
+
+    def result(self) -> np.ndarray:
+        if isinstance(self._out, SharedMemoryArray):
+            return self._out.load()
+        elif self._shared is None:
+            return self.target
+        view = self._shared.load()
+        if self._out is not None:
+            np.copyto(self._out, view)
+            return self._out
+        return view.copy()
+
+    def close(self) -> None:
+        if self._shared is not None:
+            self._shared.close().unlink()
+            self._shared = None
+
+
+def _kill_process(pid) -> None:
+    try:
+        os.kill(pid, getattr(signal, 'SIGKILL', signal.SIGTERM))
+    except ProcessLookupError:
+        pass
+
+
+@dataclass(eq=False)
+class _SupervisedTask:
+    proxy: Future
+    submit: partial
+    idx: int
+    batch_size: Optional[int]
+    attempts: int = 0
+    future: Optional[Future] = None
+    pid: Optional[int] = None
+    started: Optional[float] = None
+    broken: bool = False
+
+
+class _TimeoutSupervisor:
+    """Run single-task chunks on a process or notebook ``ParallelPool``, killing any worker whose task runs for longer
+    than ``policy.timeout`` seconds.
+
+    Workers report the start of each attempt on the pool's task start queue, and a monitor thread checks the running
+    tasks against the time limit. Killing a worker breaks a ``ProcessPoolExecutor``, so it is replaced, and its other
+    tasks are resubmitted; a ``multiprocess`` Pool replaces the worker itself. A timed-out task is retried while
+    ``policy.retries`` allows, then fails with a TimeoutError, handled according to ``policy.on_error``, as are tasks
+    lost to a worker crashing.
+    """
+    def __init__(self, pool, policy, poll_interval=0.02):
+        self._pool = pool
+        self._timeout = policy.timeout
+        self._policy = replace(policy, timeout=None, start_key=next(pool._progress_keys))
+        self._poll_interval = poll_interval
+        self._lock = RLock()  # Reentrant, as done callbacks may run immediately within _dispatch
+        self._tasks = {}
+        self._stop_event = Event()
+        self._monitor_thread = Thread(target=self._monitor, daemon=True)
+
+    def __enter__(self) -> "_TimeoutSupervisor":
+        self._monitor_thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._stop_event.set()
+        self._monitor_thread.join()
+        with self._lock:
+            for task in self._tasks.values():
+                if task.future is not None:
+                    task.future.cancel()
+            self._tasks.clear()
+
+    def submit(self, func, chunk, star, out=None, batched=False, stats=None) -> Future:
+        """Submit a chunk of a single (index, item) pair, returning a future for its list of results."""
+        (idx, item), = chunk
+        submit = partial(self._pool._submit_chunk, _process_worker, func, chunk, star, out=out, batched=batched,
+                         stats=stats)
+        task = _SupervisedTask(Future(), submit, idx, len(item) if batched else None)
+        task.proxy.set_running_or_notify_cancel()
+        with self._lock:
+            self._tasks[idx] = task
+            self._dispatch(task)
+        return task.proxy
+
+    def _dispatch(self, task: _SupervisedTask) -> None:
+        task.pid = task.started = None
+        task.broken = False
+        policy = replace(self._policy, retries=self._policy.retries - task.attempts, prior_attempts=task.attempts)
+        try:
+            task.future = task.submit(policy=policy)
+        except BrokenProcessPool:
+            task.future, task.broken = None, True  # Resubmitted once the executor is replaced
+            return
+        task.future.add_done_callback(partial(self._on_done, task))
+
+    def _on_done(self, task: _SupervisedTask, future: Future) -> None:
+        with self._lock:
+            if future is not task.future or task.proxy.done() or future.cancelled():
+                return  # Superseded by a resubmission, or already timed out
+            error = future.exception()
+            if isinstance(error, BrokenProcessPool):
+                task.broken = True  # Resubmitted or failed by the monitor
+                return
+            del self._tasks[task.idx]
+        if error is None:
+            task.proxy.set_result(future.result())
+        else:
+            task.proxy.set_exception(error)
+
+    def _monitor(self) -> None:
+        while not self._stop_event.is_set():
+            try:
+                key, idx, pid = self._pool._start_queue.get(timeout=self._poll_interval)
+            except queue.Empty:
+                pass
+            else:
+                with self._lock:
+                    task = self._tasks.get(idx) if key == self._policy.start_key else None
+                    if task is not None:
+                        task.pid, task.started = pid, time.monotonic()
+            self._check()
+
+    def _check(self) -> None:
+        now = time.monotonic()
+        with self._lock:
+            expired = [task for task in self._tasks.values()
+                       if task.started is not None and now - task.started > self._timeout]
+            crashed = [task for task in self._tasks.values() if task.broken]
+            if not expired and not crashed:
+                return
+            for task in expired:
+                _kill_process(task.pid)
+            if self._pool.mode == "process":
+                # Every task on the executor is lost along with the killed worker
+                self._pool._restart_executor()
+                for task in list(self._tasks.values()):
+                    if task not in expired and task not in crashed:
+                        self._dispatch(task)
+            else:
+                self._pool._lost_tasks = True
+            for task in expired:
+                self._retry_or_fail(task, TimeoutError(f"Task timed out after {self._timeout} seconds"))
+            for task in crashed:
+                if expired:
+                    self._dispatch(task)  # Lost due to the killing of a timed-out task's worker
+                else:
+                    self._retry_or_fail(task, BrokenProcessPool("A worker process terminated abruptly"))
+
+    def _retry_or_fail(self, task: _SupervisedTask, error: BaseException) -> None:
+        task.attempts += 1
+        if task.attempts <= self._policy.retries:
+            self._dispatch(task)
+            return
+        del self._tasks[task.idx]
+        if self._policy.on_error == "raise":
+            task.proxy.set_exception(error)
+            return
+        task_error = TaskError.from_exception(task.idx, error, task.attempts)
+        if task.batch_size is not None:
+            task_error = [replace(task_error, index=task.idx + i) for i in range(task.batch_size)]
+        task.proxy.set_result([(task.idx, task_error)])
+
+
+def _dumps(serializer: str, obj) -> bytes:
+    if serializer == "dill":
+        import dill
+        return dill.dumps(obj)
+    return pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def _loads(serializer: str, data: bytes):
+    if serializer == "dill":
+        import dill
+        return dill.loads(data)
+    return pickle.loads(data)
+
+
+def _run_instrumented(payload, serializer=None):
+    """Run ``fn(*args)`` from a ``(fn, args)`` payload, pickled with ``serializer`` if given, returning its result
+    (pickled likewise) along with the timings of the call, for ``ParallelStats``.
+    """
+    start = time.perf_counter()
+    fn, args = payload if serializer is None else _loads(serializer, payload)
+    args_seconds = time.perf_counter() - start
+    started = time.time()
+    result = fn(*args)
+    finished = time.time()
+    record = {'pid': os.getpid(), 'thread': current_thread().ident, 'thread_name': current_thread().name,
+              'started': started, 'finished': finished, 'args_seconds': args_seconds}
+    if serializer is not None:
+        start = time.perf_counter()
+        result = _dumps(serializer, result)
+        record['result_bytes'], record['result_seconds'] = len(result), time.perf_counter() - start
+    return result, record
+
+
+@dataclass
+class ChunkStats:
+    """Timings of one chunk of a parallel map, as times since the epoch in seconds, and the sizes of its pickled
+    arguments and results (zero in "thread" mode, where nothing is pickled).
+    """
+    worker: str
+    pid: int
+    thread: int
+    n_items: int
+    submitted: float
+    started: float
+    finished: float
+    received: float
+    args_bytes: int = 0
+    args_seconds: float = 0.0  # Pickling the arguments in the parent, and unpickling them in the worker
+    result_bytes: int = 0
+    result_seconds: float = 0.0  # Pickling the results in the worker, and unpickling them in the parent
+
+    @property
+    def compute_seconds(self) -> float:
+        return self.finished - self.started
+
+    @property
+    def queue_seconds(self) -> float:
+        """Time spent waiting for a free worker and in transit to it."""
+        return max(self.started - self.submitted - self.args_seconds, 0.0)
+
+    @property
+    def return_seconds(self) -> float:
+        """Time spent in transit back from the worker, and waiting to be collected."""
+        return max(self.received - self.finished - self.result_seconds, 0.0)
+
+
+class ParallelStats:
+    """Throughput and overhead statistics of parallel maps, collected by passing ``stats=`` to ``parmap`` or
+    ``ParallelPool.map``.
+
+    Each chunk of items sent to a worker is recorded as a ``ChunkStats``, from which this gives the number of items
+    and chunks run by each worker and its busy and idle time, the bytes and time spent pickling arguments and results,
+    the time chunks wait to be picked up by a worker, the skew in chunk durations and in when workers finish, and the
+    throughput over time. ``summary`` describes these, and ``to_chrome_trace`` exports a timeline of the chunks that
+    can be viewed in ``chrome://tracing`` or Perfetto. Statistics of several maps passed the same object accumulate.
+
+    To time pickling, arguments and results are pickled separately from the pool's own pickling of its calls, which
+    adds a copy of each.
+    """
+    def __init__(self):
+        self.chunks: list[ChunkStats] = []
+        self.mode: Optional[str] = None
+        self.n_workers: Optional[int] = None
+        self.start: Optional[float] = None
+        self.end: Optional[float] = None
+        self._lock = Lock()
+
+    def _begin(self, mode: str, n_workers: int) -> None:
+        self.mode, self.n_workers = mode, n_workers
+        if self.start is None:
+            self.start = time.time()
+
+    def _finish(self) -> None:
+        self.end = time.time()
+
+    def _add(self, chunk: ChunkStats) -> None:
+        with self._lock:
+            self.chunks.append(chunk)
+
+    def _submit(self, submit, n_items: int, fn, *args) -> Future:
+        """Submit ``fn(*args)`` through ``submit``, returning a future for its result, which records its timings."""
+        serializer = {"process": "pickle", "notebook": "dill"}.get(self.mode)
+        submitted = time.time()
+        args_bytes, args_seconds = 0, 0.0
+        payload = (fn, args)
+        if serializer is not None:
+            start = time.perf_counter()
+            payload = _dumps(serializer, payload)
+            args_bytes, args_seconds = len(payload), time.perf_counter() - start
+        inner = submit(_run_instrumented, payload, serializer)
+        outer = Future()
+        outer.add_done_callback(lambda f: inner.cancel() if f.cancelled() else None)
+
+        def on_done(future: Future) -> None:
+            if future.cancelled():
+                outer.cancel()
+                return
+            try:
+                if future.exception() is not None:
+                    outer.set_exception(future.exception())
+                    return
+                result, record = future.result()
+                result_seconds = record.get('result_seconds', 0.0)
+                if serializer is not None:
+                    start = time.perf_counter()
+                    result = _loads(serializer, result)
+                    result_seconds += time.perf_counter() - start
+                worker = record['thread_name'] if self.mode == "thread" else f"process {record['pid']}"
+                self._add(ChunkStats(
+                    worker, record['pid'], record['thread'], n_items, submitted, record['started'],
+                    record['finished'], time.time(), args_bytes, args_seconds + record['args_seconds'],
+                    record.get('result_bytes', 0), result_seconds))
+                outer.set_result(result)
+            except InvalidStateError:
+                pass  # Cancelled meanwhile
+
+        inner.add_done_callback(on_done)
+        return outer
+
+    @property
+    def wall_seconds(self) -> float:
+        if self.start is None:
+            return 0.0
+        return (self.end or time.time()) - self.start
+
+    @property
+    def n_items(self) -> int:
+        return sum(chunk.n_items for chunk in self.chunks)
+
+    @property
+    def items_per_second(self) -> float:
+        return self.n_items / max(self.wall_seconds, 1e-9)
+
+    @property
+    def workers(self) -> dict[str, dict]:
+        """Items and chunks run, and seconds busy and idle, by worker, for the workers that ran any chunks."""
+        workers = {}
+        for chunk in sorted(self.chunks, key=lambda c: c.started):
+            worker = workers.setdefault(chunk.worker, {'items': 0, 'chunks': 0, 'busy': 0.0, 'last_finished': 0.0})
+            worker['items'] += chunk.n_items
+            worker['chunks'] += 1
+            worker['busy'] += chunk.compute_seconds
+            worker['last_finished'] = max(worker['last_finished'], chunk.finished)
+        for worker in workers.values():
+            worker['idle'] = max(self.wall_seconds - worker['busy'], 0.0)
+        return workers
+
+    def throughput(self, n_bins: int = 10) -> list[tuple[float, float]]:
+        """Items processed per second over the course of the map, in ``n_bins`` intervals, as pairs of the end of
+        each interval (in seconds since the start) and the rate in it. The items of each chunk are counted as
+        processed evenly over the time it was computed.
+        """
+        if not self.chunks or self.wall_seconds <= 0:
+            return []
+        width = self.wall_seconds / n_bins
+        counts = np.zeros(n_bins)
+        edges = self.start + width * np.arange(n_bins + 1)
+        for chunk in self.chunks:
+            duration = max(chunk.compute_seconds, 1e-9)
+            overlap = np.clip(np.minimum(edges[1:], chunk.finished) - np.maximum(edges[:-1], chunk.started), 0, None)
+            counts += chunk.n_items * overlap / duration
+        return [((i + 1) * width, float(count / width)) for i, count in enumerate(counts)]
+
+    def to_dict(self) -> dict:
+        """The statistics, and the timings of each chunk, as a JSON-serializable dict."""
+        chunks = self.chunks
+        durations = sorted(chunk.compute_seconds for chunk in chunks)
+        finishes = [worker['last_finished'] for worker in self.workers.values()]
+        return {
+            'mode': self.mode,
+            'n_workers': self.n_workers,
+            'n_items': self.n_items,
+            'wall_seconds': self.wall_seconds,
+            'items_per_second': self.items_per_second,
+            'utilization': sum(durations) / max(self.wall_seconds * (self.n_workers or 1), 1e-9),
+            'workers': self.workers,
+            'chunk_seconds': {'min': durations[0], 'median': durations[len(durations) // 2],
+                              'max': durations[-1]} if durations else {},
+            'finish_spread_seconds': max(finishes) - min(finishes) if finishes else 0.0,
+            'queue_seconds': {'mean': sum(c.queue_seconds for c in chunks) / len(chunks),
+                              'max': max(c.queue_seconds for c in chunks)} if chunks else {},
+            'args': {'bytes': sum(c.args_bytes for c in chunks), 'seconds': sum(c.args_seconds for c in chunks)},
+            'results': {'bytes': sum(c.result_bytes for c in chunks),
+                        'seconds': sum(c.result_seconds for c in chunks)},
+            'throughput': self.throughput(),
+            'chunks': [{**vars(chunk)} for chunk in chunks],
+        }
+
+    def summary(self) -> str:
+        stats = self.to_dict()
+        workers = f"{stats['n_workers']} {stats['mode']} worker" + ("s" if stats['n_workers'] != 1 else "")
+        lines = [f"{stats['n_items']} items in {stats['wall_seconds']:.3f} s "
+                 f"({stats['items_per_second']:.1f} items/s) with {workers}, {100 * stats['utilization']:.1f}% busy"]
+        if self.chunks:
+            chunk_seconds = stats['chunk_seconds']
+            skew = chunk_seconds['max'] / max(chunk_seconds['median'], 1e-9)
+            lines.append(
+                f"chunks: {len(self.chunks)}, {chunk_seconds['median']:.3f} s median, "
+                f"{chunk_seconds['max']:.3f} s max ({skew:.1f}x skew); "
+                f"workers finished within {stats['finish_spread_seconds']:.3f} s of each other")
+            lines.append(f"queue wait: {1e3 * stats['queue_seconds']['mean']:.1f} ms mean, "
+                         f"{1e3 * stats['queue_seconds']['max']:.1f} ms max")
+            args, results = stats['args'], stats['results']
+            lines.append(f"pickling: arguments {args['bytes'] / 1e6:.2f} MB in {args['seconds']:.3f} s, "
+                         f"results {results['bytes'] / 1e6:.2f} MB in {results['seconds']:.3f} s")
+            lines.append("items/s over time: " + ", ".join(f"{rate:.0f}" for _, rate in stats['throughput']))
+            lines.append(f"{'worker':<30} {'items':>8} {'chunks':>7} {'busy (s)':>9} {'idle (s)':>9}")
+            for name, worker in stats['workers'].items():
+                lines.append(f"{name:<30} {worker['items']:>8} {worker['chunks']:>7} {worker['busy']:>9.3f} "
+                             f"{worker['idle']:>9.3f}")
+        return "\n".join(lines)
+
+    def __repr__(self):
+        return f"{type(self).__name__}(n_items={self.n_items}, n_chunks={len(self.chunks)})"
+
+    def to_chrome_trace(self, path: Optional[str] = None) -> dict:
+        """Get a timeline of the chunks in the Chrome trace event format, with a slice for the computation of each
+        chunk on its worker's track and one for each chunk in flight on this process's track, and write it as JSON
+        to ``path`` if given.
+        """
+        start = self.start if self.start is not None else min((c.submitted for c in self.chunks), default=0.0)
+        events = []
+        for pid in sorted({chunk.pid for chunk in self.chunks} | {os.getpid()}):
+            name = "parent" if pid == os.getpid() else f"worker process {pid}"
+            events.append({'name': 'process_name', 'ph': 'M', 'pid': pid, 'args': {'name': name}})
+        for i, chunk in enumerate(self.chunks):
+            args = {'items': chunk.n_items, 'args_bytes': chunk.args_bytes, 'result_bytes': chunk.result_bytes,
+                    'queue_ms': 1e3 * chunk.queue_seconds}
+            events.append({'name': f"chunk {i}", 'cat': 'compute', 'ph': 'X', 'pid': chunk.pid, 'tid': chunk.thread,
+                           'ts': 1e6 * (chunk.started - start), 'dur': 1e6 * chunk.compute_seconds, 'args': args})
+            events.append({'name': f"chunk {i}", 'cat': 'in flight', 'ph': 'b', 'id': i, 'pid': os.getpid(),
+                           'ts': 1e6 * (chunk.submitted - start)})
+            events.append({'name': f"chunk {i}", 'cat': 'in flight', 'ph': 'e', 'id': i, 'pid': os.getpid(),
+                           'ts': 1e6 * (chunk.received - start)})
+        trace = {'traceEvents': events, 'displayTimeUnit': 'ms'}
+        if path is not None:
+            with open(path, 'w') as f:
+                json.dump(trace, f)
+        return trace
+
+
+def _resolve_stats(stats) -> tuple[Optional[ParallelStats], bool]:
+    """Get the ParallelStats to collect for a map's stats argument, and whether to print its summary."""
+    if stats is True:
+        return ParallelStats(), True
+    return stats or None, False
+
+
+class ParallelPool:
+    """
+    A reusable pool of workers for repeated parallel maps.
+
+    Each ``parmap`` call starts (and stops) its own workers; a ``ParallelPool`` keeps its worker processes, and the
+    per-process thread pools used when ``nthreads_per_process > 1``, alive across calls, so that process startup,
+    module imports, and any state loaded by ``initializer`` are paid for once. Use it as a context manager, or call
+    ``shutdown`` when done.
+
+    mode:
+      - "thread": use ThreadPoolExecutor with n_workers.
+      - "process": use ProcessPoolExecutor; each process runs a ThreadPoolExecutor of size nthreads_per_process.
+      - "notebook": use a ``multiprocess`` Pool, which can run functions defined interactively.
+
+    ``initializer(*initargs)`` is called once in each worker process when it starts.
+
+    ``n_workers="auto"`` uses one worker per CPU available to this process, given its CPU affinity and any container
+    CPU quota (``parmap`` also sizes the pool from the measured costs of the first few tasks). ``native_threads`` caps
+    the threads used by BLAS and OpenMP libraries (as in NumPy linear algebra) within each worker process, or within
+    this process in "thread" mode, to avoid oversubscribing the CPUs with threads nested in each worker; "auto" divides
+    the CPUs evenly between the workers' threads. This needs ``threadpoolctl`` to apply to libraries already loaded.
+    """
+    def __init__(self, n_workers=None, mode="process", nthreads_per_process=None, initializer=None, initargs=(),
+                 max_tasks_per_child=None, verbose=False, native_threads=None, **pool_params):
+        mode, n_workers, nthreads_per_process = _resolve_workers(mode, n_workers, nthreads_per_process, verbose)
+        self.mode = mode
+        self.n_workers = n_workers
+        self.nthreads_per_process = nthreads_per_process
+        self.verbose = verbose
+        self._progress_keys = itertools.count()
+        self._progress_queue = None
+        self._start_queue = None
+        self._lost_tasks = False
+        self._native_thread_limits = None
+        if native_threads == "auto":
+            native_threads = max(1, _available_cpus() // (n_workers * nthreads_per_process))
+
         if mode == "thread":
-            with tqdm(total=total, desc=pbar_desc) as pbar:
-                def update():
-                    pbar.update(1)
-                try:
-                    results = _run_thread_pool(func, iterable, star=star, update_func=update, n_workers=n_workers,
-                                            **pool_params)
-                except KeyboardInterrupt:
-                    print("KeyboardInterrupt detected in thread mode; exiting gracefully.")
-                    raise
+            if native_threads is not None:
+                self._native_thread_limits = _limit_native_threads(native_threads, set_env=False)
+            if initializer is not None:
+                pool_params['initializer'] = initializer
+                pool_params['initargs'] = initargs
+            self._executor = ThreadPoolExecutor(max_workers=n_workers, **pool_params)
         elif mode == "process":
-            manager = Manager()
-            counter = manager.Value('i', 0)
-            lock = manager.Lock()
-            chunks = _chunkify(iterable, n_workers)
-            stop_event = Event()
-
-            with tqdm(total=total, desc=pbar_desc) as pbar:
-                updater = Thread(target=_progress_updater, args=(counter, total, pbar, stop_event))
-                updater.daemon = True  # Ensure it doesn't block process exit.
-                updater.start()
-                if max_tasks_per_child is not None:
-                    pool_params['max_tasks_per_child'] = max_tasks_per_child
-                try:
-                    with ProcessPoolExecutor(max_workers=n_workers, **pool_params) as proc_executor:
-                        futures = [
-                            proc_executor.submit(
-                                _process_worker, func, chunk, star, counter, lock, nthreads_per_process, verbose)
-                            for chunk in chunks
-                        ]
-                        for future in as_completed(futures):
-                            results.extend(future.result())
-                    # Results may not be in original order, sort them using the indices with which they were returned
-                    results.sort(key=lambda x: x[0])  # Sort by the original index
-                    _, results = zip(*results)  # Unzip the results to get the values only
-                except KeyboardInterrupt:
-                    print("KeyboardInterrupt detected in process mode; cancelling tasks...")
-                    stop_event.set()  # Signal the updater thread to stop.
-                    # Attempt to cancel pending futures.
-                    for future in futures:
-                        future.cancel()
-                    # Shutdown the executor without waiting.
-                    proc_executor.shutdown(wait=False)
-                    raise
-                finally:
-                    stop_event.set()  # Ensure the updater thread exits.
-                    updater.join(timeout=1)  # Wait briefly for it to finish.
+            # Workers report progress in batches, and the start of tasks with a timeout, through plain queues,
+            # inherited via the pool initializer
+            mp_context = pool_params.get('mp_context', multiprocessing)
+            self._progress_queue = mp_context.Queue()
+            self._start_queue = mp_context.Queue()
+            if max_tasks_per_child is not None:
+                pool_params['max_tasks_per_child'] = max_tasks_per_child
+            self._new_executor = partial(
+                ProcessPoolExecutor, max_workers=n_workers, initializer=_init_pool_worker,
+                initargs=(self._progress_queue, self._start_queue, initializer, initargs, native_threads),
+                **pool_params)
+            self._executor = self._new_executor()
         elif mode == "notebook":
+            self._progress_queue = multiprocess.Queue()
+            self._start_queue = multiprocess.Queue()
             if max_tasks_per_child is not None and 'maxtasksperchild' not in pool_params:
                 pool_params['maxtasksperchild'] = max_tasks_per_child
-            with Pool(n_workers, **pool_params) as p:
-                results = p.map(func, iterable, chunksize=32)
-            if verbose:
-                print('done.')
+            self._executor = Pool(
+                n_workers, initializer=_init_pool_worker,
+                initargs=(self._progress_queue, self._start_queue, initializer, initargs, native_threads),
+                **pool_params)
+        else:
+            raise ValueError("mode must be one of 'thread', 'process' or 'notebook'")
+
+    def __enter__(self) -> "ParallelPool":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # Don't wait on outstanding tasks if exiting due to an error or interruption
+        self.shutdown(wait=exc_type is None, cancel_futures=exc_type is not None)
+
+    def shutdown(self, wait=True, cancel_futures=False) -> None:
+        """Stop the workers, optionally waiting for running tasks and cancelling pending ones."""
+        if self._native_thread_limits is not None:
+            self._native_thread_limits.restore_original_limits()
+            self._native_thread_limits = None
+        if self.mode == "notebook":
+            # A Pool waits forever on the results of tasks whose worker was killed, so it must be terminated
+            if wait and not cancel_futures and not self._lost_tasks:
+                self._executor.close()
+            else:
+                self._executor.terminate()
+            self._executor.join()
+        else:
+            self._executor.shutdown(wait=wait, cancel_futures=cancel_futures)
+
+    def submit(self, func, *args, **kwargs) -> Future:
+        """Schedule ``func(*args, **kwargs)`` on a worker, returning a future for its result."""
+        if self.mode == "notebook":
+            return _submit_async(self._executor, func, *args, **kwargs)
+        return self._executor.submit(func, *args, **kwargs)
+
+    def _restart_executor(self) -> None:
+        """Replace a process executor broken by the loss of a worker, killing any of its remaining workers."""
+        old_executor, self._executor = self._executor, self._new_executor()
+        processes = list((getattr(old_executor, '_processes', None) or {}).values())
+        old_executor.shutdown(wait=False, cancel_futures=True)
+        for process in processes:
+            process.kill()
+
+    def _submit_chunk(self, worker, func, chunk, star, progress_key=None, out=None, batched=False,
+                      policy=None, stats=None) -> Future:
+        nthreads = 1 if self.mode == "thread" else self.nthreads_per_process
+        args = (func, chunk, star, nthreads, self.verbose, progress_key, out, batched, policy)
+        if stats is not None:
+            n_items = sum(len(batch) for _, batch in chunk) if batched else len(chunk)
+            return stats._submit(self.submit, n_items, worker, *args)
+        return self.submit(worker, *args)
+
+    def _imap_indexed(self, func, items, star, ordered, chunksize, max_in_flight, total=None, pbar_desc=None,
+                      out=None, batched=False, batch_size=None, policy=None, stats=None):
+        """Run func over items in lazily submitted chunks, yielding (index, result) pairs.
+
+        Workers pull chunks from the executor's shared call queue as they become free, so with small chunks no worker
+        sits idle while another works through a long one. ``chunksize="auto"`` sizes chunks from measured latency.
+        If ``batched``, items are (start index, batch) pairs, chunks are made of batches, and results are flattened.
+        With a ``policy`` timeout in process or notebook mode, items (or batches) are sent one per chunk, under a
+        ``_TimeoutSupervisor``.
+        """
+        supervised = policy is not None and policy.timeout is not None and self.mode != "thread"
+        if supervised:
+            chunksize = 1
+        if chunksize == "auto":
+            n_units = math.ceil(total / batch_size) if batched and total is not None else total
+            chunks = _AdaptiveChunker(items, self.n_workers, total=n_units, enumerated=not batched)
+            worker, unpack = _timed_process_worker, chunks.unpack
         else:
-            raise ValueError("mode must be either 'thread' or 'process'")
+            chunks = _iter_chunks(items, chunksize, enumerated=not batched)
+            worker, unpack = _process_worker, None
+        if batched:
+            unpack = _flatten_batches if unpack is None else (lambda r, unpack=unpack: _flatten_batches(unpack(r)))
+
+        with _TimeoutSupervisor(self, policy) if supervised else nullcontext() as supervisor:
+            def submit(chunk):
+                if supervisor is not None:
+                    return supervisor.submit(func, chunk, star, out=out, batched=batched, stats=stats)
+                return self._submit_chunk(worker, func, chunk, star, out=out, batched=batched, policy=policy,
+                                          stats=stats)
+
+            with tqdm(total=total, desc=pbar_desc) as pbar:
+                yield from _iter_windowed(
+                    submit, chunks, max_in_flight, ordered=ordered, update_func=pbar.update, unpack=unpack)
+
+    def _map_static(self, func, items, star, total, pbar_desc=None, out=None, batched=False, policy=None,
+                    stats=None) -> list:
+        """Split items into one chunk per worker, reporting per-task progress from within the workers."""
+        progress_key = next(self._progress_keys)
+        stop_event = Event()
+        results = []
+        with tqdm(total=total, desc=pbar_desc) as pbar:
+            updater = Thread(target=_progress_updater,
+                             args=(self._progress_queue, progress_key, total, pbar, stop_event))
+            updater.daemon = True  # Ensure it doesn't block process exit.
+            updater.start()
+            futures = [self._submit_chunk(_process_worker, func, chunk, star, progress_key, out, batched, policy,
+                                          stats)
+                       for chunk in _chunkify(items, self.n_workers, enumerated=not batched)]
+            try:
+                for future in as_completed(futures):
+                    results.extend(future.result())
+            except KeyboardInterrupt:
+                print(f"KeyboardInterrupt detected in {self.mode} mode; cancelling tasks...")
+                for future in futures:
+                    future.cancel()
+                raise
+            finally:
+                stop_event.set()  # Ensure the updater thread exits.
+                updater.join(timeout=1)  # Wait briefly for it to finish.
+            pbar.update(total - pbar.n)  # Account for any counts still in transit
+        return _flatten_batches(results) if batched else results
+
+    def _share_items(self, sharer, items, batched):
+        # Slices of NumPy and pandas inputs are only sent once each, so there's nothing to gain by sharing them
+        if batched and isinstance(items, (np.ndarray, pd.Series, pd.DataFrame)):
+            return items
+        return map(sharer.share_value, items)
+
+    def imap(self, func, iterable, star=False, ordered=True, chunksize=None, max_in_flight=None, pbar_desc=None,
+             share=False, batched=False, batch_size=None, on_error="raise", retries=0, retry_delay=0.1, timeout=None):
+        """Lazily apply ``func`` to every item in ``iterable``, yielding results as they complete.
+
+        See ``iparmap`` for the meaning of the arguments.
+        """
+        policy = _make_policy(on_error, retries, retry_delay, timeout)
+        total = len(iterable) if hasattr(iterable, '__len__') else None
+        batched = batched or batch_size is not None
+        if chunksize is None:
+            chunksize = 1 if self.mode == "thread" or batched else self.nthreads_per_process
+        if max_in_flight is None:
+            max_in_flight = 4 * self.n_workers
+        with _arg_sharer(share, self.mode) as sharer:
+            if sharer is not None:
+                func, iterable = sharer.share_func(func), self._share_items(sharer, iterable, batched)
+            if batched:
+                batch_size = _resolve_batch_size(batch_size, total, self.n_workers)
+                iterable = _iter_batches(iterable, batch_size)
+            for _, result in self._imap_indexed(func, iterable, star, ordered, chunksize, max_in_flight, total=total,
+                                                pbar_desc=pbar_desc, batched=batched, batch_size=batch_size,
+                                                policy=policy):
+                if on_error == "skip" and isinstance(result, TaskError):
+                    continue
+                yield result
+
+    def map(self, func, iterable, star=False, chunksize=None, pbar_desc=None, share=False, out=None,
+            result_shape=None, result_dtype=None, batched=False, batch_size=None, on_error="raise", retries=0,
+            retry_delay=0.1, timeout=None, checkpoint_dir=None, checkpoint_key=None,
+            stats=None) -> Union[list, np.ndarray, tuple]:
+        """Apply ``func`` to every item in ``iterable``, returning the results in order.
+
+        See ``parmap`` for the meaning of the arguments.
+        """
+        if checkpoint_dir is not None and (out is not None or result_shape is not None):
+            raise ValueError("checkpoint_dir can't be used with out or result_shape")
+        if not hasattr(iterable, '__len__'):
+            iterable = list(iterable)
+        batched = batched or batch_size is not None
+        checkpoint = None
+        if checkpoint_dir is not None:
+            checkpoint = _Checkpoint(checkpoint_dir, func, iterable, batched, key=checkpoint_key)
+        return self._map(func, iterable, star=star, chunksize=chunksize, pbar_desc=pbar_desc, share=share, out=out,
+                         result_shape=result_shape, result_dtype=result_dtype, batched=batched, batch_size=batch_size,
+                         on_error=on_error, retries=retries, retry_delay=retry_delay, timeout=timeout,
+                         checkpoint=checkpoint, stats=stats)
+
+    def _map(self, func, iterable, star, chunksize, pbar_desc, share, out, result_shape, result_dtype, batched,
+             batch_size, on_error, retries, retry_delay, timeout, checkpoint, stats) -> Union[list, np.ndarray, tuple]:
+        """Implementation of ``map``, given the ``_Checkpoint`` (if any) of the results already completed."""
+        policy = _make_policy(on_error, retries, retry_delay, timeout)
+        stats, print_stats = _resolve_stats(stats)
+        if stats is not None:
+            stats._begin(self.mode, self.n_workers)
+        if on_error == "skip" and (out is not None or result_shape is not None):
+            raise ValueError("on_error='skip' can't be used with out or result_shape")
+        if checkpoint is not None:
+            iterable = checkpoint.pending_items(iterable, batched)
+        total = len(iterable)
+        buffer = None
+        if out is not None or result_shape is not None:
+            buffer = _ResultBuffer(total, self.mode, out=out, result_shape=result_shape, result_dtype=result_dtype)
+        if chunksize is None and self.mode == "thread":
+            # Submit several items per future, while leaving enough chunks to balance the load
+            chunksize = 1 if batched else max(1, math.ceil(total / (8 * self.n_workers)))
+        elif chunksize is None and timeout is not None:
+            chunksize = 1  # Timeouts are only supervised for lazily submitted chunks
+        elif chunksize is None and checkpoint is not None and checkpoint.path is not None:
+            chunksize = "auto"  # Results must come back in a stream of chunks to be stored incrementally
+        try:
+            if total == 0:
+                results = []
+            else:
+                with _arg_sharer(share, self.mode) as sharer:
+                    if sharer is not None:
+                        func, iterable = sharer.share_func(func), list(self._share_items(sharer, iterable, batched))
+                    if batched:
+                        batch_size = _resolve_batch_size(batch_size, total, self.n_workers)
+                        items = list(_iter_batches(iterable, batch_size))
+                    else:
+                        items = iterable
+                    target = buffer.target if buffer is not None else None
+                    if chunksize is None:
+                        results = self._map_static(func, items, star, total, pbar_desc=pbar_desc, out=target,
+                                                   batched=batched, policy=policy, stats=stats)
+                    else:
+                        results = self._imap_indexed(func, items, star, False, chunksize, 2 * self.n_workers,
+                                                     total=total, pbar_desc=pbar_desc, out=target, batched=batched,
+                                                     batch_size=batch_size, policy=policy, stats=stats)
+                    results = list(results if checkpoint is None else checkpoint.record(results))
+            if checkpoint is not None:
+                results = checkpoint.merge(results)
+            # Results may not be in original order, sort them using the indices with which they were returned
+            results.sort(key=lambda x: x[0])
+            results, errors = _handle_errors(results, on_error)
+            results = buffer.result() if buffer is not None else [result for _, result in results]
+        finally:
+            if buffer is not None:
+                buffer.close()
+            if checkpoint is not None:
+                checkpoint.flush()
+            if stats is not None:
+                stats._finish()
+        if print_stats:
+            print(stats.summary())
+        return results if errors is None else (results, errors)
+
+    def starmap(self, func, iterable, chunksize=None, pbar_desc=None, share=False, out=None, result_shape=None,
+                result_dtype=None, batched=False, batch_size=None, on_error="raise", retries=0, retry_delay=0.1,
+                timeout=None, checkpoint_dir=None, checkpoint_key=None,
+                stats=None) -> Union[list, np.ndarray, tuple]:
+        """Apply ``func(*args)`` for every tuple of args in ``iterable``, returning the results in order."""
+        return self.map(func, iterable, star=True, chunksize=chunksize, pbar_desc=pbar_desc, share=share, out=out,
+                        result_shape=result_shape, result_dtype=result_dtype, batched=batched,
+                        batch_size=batch_size, on_error=on_error, retries=retries, retry_delay=retry_delay,
+                        timeout=timeout, checkpoint_dir=checkpoint_dir, checkpoint_key=checkpoint_key, stats=stats)
+
+
+async def _amap_indexed(func, iterable, star, limit, update_func=None, policy=None) -> list:
+    """Await func on every item, with at most limit calls in progress at once, returning (index, result) pairs.
+
+    Tasks are created as the semaphore allows, so the input is consumed lazily, and the first error cancels the rest.
+    Failing calls are retried, timed out, and returned as ``TaskError``s as the ``_TaskPolicy`` specifies, if given.
+    """
+    semaphore = asyncio.Semaphore(limit)
+    tasks = set()
+    results = []
+    errors = []
+
+    async def call(item):
+        result = func(*item) if star else func(item)
+        if inspect.isawaitable(result):
+            result = await result
+        return result
+
+    async def call_with_policy(idx, item):
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                if policy.timeout is None:
+                    return await call(item)
+                return await asyncio.wait_for(call(item), policy.timeout)
+            except Exception as e:
+                if attempt > policy.retries:
+                    if policy.on_error == "raise":
+                        raise
+                    return TaskError.from_exception(idx, e, attempt)
+            await asyncio.sleep(policy.retry_delay * 2 ** (attempt - 1))
+
+    async def run(idx, item):
+        try:
+            result = await (call(item) if policy is None else call_with_policy(idx, item))
+        finally:
+            semaphore.release()
+        results.append((idx, result))
+        if update_func is not None:
+            update_func(1)
+
+    def on_done(task):
+        tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            errors.append(task.exception())
+
+    try:
+        for idx, item in enumerate(iterable):
+            await semaphore.acquire()
+            if errors:
+                semaphore.release()
+                break
+            task = asyncio.ensure_future(run(idx, item))
+            tasks.add(task)
+            task.add_done_callback(on_done)
+        while tasks and not errors:
+            await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+        if errors:
+            raise errors[0]
+    finally:
+        for task in list(tasks):
+            task.cancel()
+    return results
+
+
+async def aparmap(func, iterable, star=False, n_workers=None, pbar_desc=None, on_error="raise", retries=0,
+                  retry_delay=0.1, timeout=None) -> Union[list, tuple]:
+    """
+    Await ``func`` (a coroutine function) on every item in ``iterable``, running up to ``n_workers`` calls at once.
+
+    This runs on the current event loop, for use within async code; ``parmap(..., mode="async")`` runs the same from
+    synchronous code. Results are returned in the order of ``iterable``, and a tqdm progress bar shows overall
+    progress. ``n_workers`` defaults to 1; a negative value means no limit, and "auto" a limit of 16 calls per CPU
+    available. Errors are handled as for ``parmap``, with calls running over ``timeout`` cancelled.
+    """
+    policy = _make_policy(on_error, retries, retry_delay, timeout)
+    total = len(iterable) if hasattr(iterable, '__len__') else None
+    if n_workers == "auto":
+        n_workers = _available_cpus() * _MAX_THREADS_PER_CPU
+    elif n_workers is None or n_workers == 0:
+        n_workers = 1
+    elif n_workers < 0:
+        n_workers = math.inf
+    with tqdm(total=total, desc=pbar_desc) as pbar:
+        results = await _amap_indexed(func, iterable, star, n_workers, update_func=pbar.update, policy=policy)
+    results.sort(key=lambda x: x[0])
+    results, errors = _handle_errors(results, on_error)
+    results = [result for _, result in results]
+    return results if errors is None else (results, errors)
+
+
+def _run_coroutine(coro):
+    """Run a coroutine to completion from synchronous code.
+
+    If an event loop is already running in this thread (as in a notebook), it can't be blocked on, so the coroutine
+    is run on a new event loop in another thread instead.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, coro).result()
+
+
+def parmap(func, iterable, star=False, mode="process", n_workers=None, nthreads_per_process=None, pbar_desc=None,
+           verbose=False, max_tasks_per_child=None, chunksize=None, pool=None, share=False, out=None,
+           result_shape=None, result_dtype=None, batched=False, batch_size=None, on_error="raise", retries=0,
+           retry_delay=0.1, timeout=None, checkpoint_dir=None, checkpoint_key=None, stats=None, **pool_params):
+    """
+    Apply ``func`` to every item in ``iterable``.
+
+    mode:
+      - "thread": use ThreadPoolExecutor with n_workers.
+      - "process": use ProcessPoolExecutor; each process runs a ThreadPoolExecutor of size nthreads_per_process.
+      - "async": ``func`` is a coroutine function, awaited with up to n_workers calls in progress at once (or without
+        limit if n_workers is negative) on an event loop; see ``aparmap``. The sharing, output array, and batching
+        options below don't apply.
+
+    In "process" mode, the items are by default split into one chunk per worker. Passing an integer ``chunksize``
+    instead schedules many small chunks, which idle workers pull from a shared queue, so that slow items don't leave
+    the other workers waiting at the end of the job; ``chunksize="auto"`` sizes the chunks from measured task latency.
+    Results are returned in the order of ``iterable`` either way.
+
+    If a ``ParallelPool`` is given as ``pool``, its workers are used, and the mode and worker arguments are ignored.
+
+    With ``share=True`` (or a minimum size in bytes), NumPy arrays and DataFrames of at least 1 MB among the items,
+    elements of tuple or list items, or arguments bound to a ``functools.partial`` ``func``, are placed in shared
+    memory (``SharedMemoryArray`` or ``SharedMemoryDataFrame``) instead of being pickled to the worker processes with
+    every chunk. Each worker loads each shared value once, and the shared data is removed when
+    the call returns. Sharing has no effect in "thread" mode.
+
+    If every result is a NumPy array (or scalar) of the same shape, passing ``result_shape`` (and ``result_dtype``,
+    which defaults to float) makes the workers write each result directly into row ``i`` of a shared output array,
+    instead of pickling it back, and an array of shape ``(len(iterable),) + result_shape`` is returned. Alternatively,
+    an ``out`` array (or ``SharedMemoryArray.create_empty`` buffer, written to without any copy) may be provided, and
+    is returned.
+
+    With ``batched=True`` (or a ``batch_size``), ``func`` is called once per batch of ``batch_size`` consecutive items
+    (by default, four batches per worker), and must return a sequence of one result per item, so that per-call
+    overhead is paid per batch and ``func`` can vectorize over the batch. Batches of NumPy arrays and pandas objects
+    are slices of them; other batches are lists, and with ``star``, ``func`` receives one list per argument. Results
+    are returned per item, as without batching, and ``chunksize`` counts batches.
+
+    By default, the first exception raised by ``func`` is raised from ``parmap``. A task that raises is first retried
+    up to ``retries`` times, waiting ``retry_delay`` seconds before the first retry, and twice as long before each
+    retry after that. Tasks running for longer than ``timeout`` seconds fail with a TimeoutError: in "process" and
+    "notebook" mode, the worker running the task is killed and replaced (and items are sent one per chunk, so that no
+    other tasks are lost with it); in "thread" mode, threads can't be killed, so the task is abandoned to finish in the
+    background. With ``on_error="collect"``, tasks that still fail don't stop the others, and ``(results, errors)``
+    is returned, where failed results are None (or rows left unwritten, with ``out``), and ``errors`` is a list of
+    ``TaskError`` records, giving the index of each failed item with the error type, message, and traceback from its
+    last attempt. With ``on_error="skip"``, the results of failed items are left out of the returned list.
+
+    ``n_workers`` may be negative, to count back from the number of CPUs available to this process (given its CPU
+    affinity and any container CPU quota), or "auto", to size the pool from the CPUs and memory available and the
+    costs of the first few items, which are first run in this process to measure them (their results are kept, and
+    only the other items are run by the pool; with batching, ``out``, ``result_shape`` or a ``timeout``, nothing is
+    run in this process, and the pool is sized from the CPUs alone, since a task that hangs there couldn't be timed
+    out). Tasks that spend much of their time waiting, rather than computing, get several threads per CPU (per
+    process in "process" mode, unless ``nthreads_per_process`` is given), while CPU-bound tasks get one worker per
+    CPU; the number of workers is then limited so that the peak memory of concurrent tasks fits in the available
+    memory, and so that each process has enough work to be worth starting. In "async" mode, "auto" allows as many
+    calls at once as the most I/O-bound tasks would get threads in "thread" mode (see ``aparmap``).
+    ``native_threads`` caps the threads of BLAS and OpenMP libraries within each worker (see ``ParallelPool``).
+
+    With a ``checkpoint_dir``, results are saved to files in a subdirectory of it (named by a hash of ``func`` and
+    the items) every few seconds as they complete, and when the call ends or fails. Calling ``parmap`` again with the
+    same function and items then only runs the items without saved results, so that a crashed or interrupted job
+    resumes where it left off. The saved results are kept after the call returns, and should be deleted when no
+    longer needed. This can't be combined with ``out`` or ``result_shape``. To be recognized in a later run, ``func``
+    and the items must pickle the same way in every run: a ValueError is raised if they can't be pickled (as for
+    lambdas and local functions), and objects holding sets of strings other than lists, tuples and dicts pickle
+    differently from run to run. In those cases, pass a ``checkpoint_key`` (any string identifying the call, such as
+    a job name) to name the subdirectory instead; it's then up to the caller to change it when the inputs change.
+
+    With ``stats=True``, a summary of where the time went (per-worker item counts and busy and idle time, pickling
+    bytes and time in each direction, queue wait, chunk skew, and throughput over time) is printed when the call
+    ends; passing a ``ParallelStats`` object instead collects the statistics into it, for inspection or to export as
+    a Chrome trace timeline with ``to_chrome_trace``.
+
+    A tqdm progress bar shows overall progress. See ``iparmap`` for a streaming counterpart.
+    """
+    if pool is not None:
+        return pool.map(func, iterable, star=star, chunksize=chunksize, pbar_desc=pbar_desc, share=share, out=out,
+                        result_shape=result_shape, result_dtype=result_dtype, batched=batched, batch_size=batch_size,
+                        on_error=on_error, retries=retries, retry_delay=retry_delay, timeout=timeout,
+                        checkpoint_dir=checkpoint_dir, checkpoint_key=checkpoint_key, stats=stats)
+
+    if mode == "async":
+        if (share or out is not None or result_shape is not None or batched or batch_size is not None
+                or checkpoint_dir is not None or stats):
+            raise ValueError("share, out, result_shape, batching, checkpoints and stats are not supported in async "
+                             "mode")
+        return _run_coroutine(aparmap(func, iterable, star=star, n_workers=n_workers, pbar_desc=pbar_desc,
+                                      on_error=on_error, retries=retries, retry_delay=retry_delay, timeout=timeout))
+
+    if not hasattr(iterable, '__len__'):
+        iterable = list(iterable)
+    total = len(iterable)
+    results = []
+
+    if checkpoint_dir is not None and (out is not None or result_shape is not None):
+        raise ValueError("checkpoint_dir can't be used with out or result_shape")
+    batched = batched or batch_size is not None
+    checkpoint = None
+    if checkpoint_dir is not None:
+        checkpoint = _Checkpoint(checkpoint_dir, func, iterable, batched, key=checkpoint_key)
+    if n_workers == "auto" and not batched and out is None and result_shape is None and timeout is None:
+        # The results of the sampled items are kept, and merged with those of the other items like saved results
+        if checkpoint is None:
+            checkpoint = _Checkpoint(None, func, iterable)
+        sample, sampled = _sample_tasks(func, checkpoint.pending_items(iterable), star)
+        checkpoint.add(sampled)
+        n_workers, nthreads_per_process = _auto_workers(mode, nthreads_per_process, sample, len(checkpoint.pending))
+    mode, n_workers, nthreads_per_process = _resolve_workers(mode, n_workers, nthreads_per_process, verbose)
+
+    if n_workers == 1:
+        policy = _make_policy(on_error, retries, retry_delay, timeout)
+        stats, print_stats = _resolve_stats(stats)
+        if stats is not None:
+            stats._begin("serial", 1)
+            start = time.time()
+        if on_error == "skip" and (out is not None or result_shape is not None):
+            raise ValueError("on_error='skip' can't be used with out or result_shape")
+        if checkpoint is not None:
+            iterable = checkpoint.pending_items(iterable, batched)
+            total = len(iterable)
+        items = _iter_batches(iterable, _resolve_batch_size(batch_size, total, 1)) if batched else iterable
+        buffer = None
+        if out is not None or result_shape is not None:
+            buffer = _ResultBuffer(total, "thread", out=out, result_shape=result_shape, result_dtype=result_dtype)
+        target = buffer.target if buffer is not None else None
+        results = _map_serial(func, items, star, total=total, pbar_desc=pbar_desc, out=target, batched=batched,
+                              policy=policy)
+        try:
+            if checkpoint is not None:
+                results = sorted(checkpoint.merge(checkpoint.record(results)), key=lambda x: x[0])
+            results, errors = _handle_errors(list(results), on_error)
+        finally:
+            if checkpoint is not None:
+                checkpoint.flush()
+        results = buffer.result() if buffer is not None else [result for _, result in results]
+        if errors is not None:
+            results = (results, errors)
+        if stats is not None:
+            end = time.time()
+            stats._add(ChunkStats("main", os.getpid(), current_thread().ident, total, start, start, end, end))
+            stats._finish()
+            if print_stats:
+                print(stats.summary())
+    elif mode in ("thread", "process", "notebook"):
+        with ParallelPool(n_workers, mode=mode, nthreads_per_process=nthreads_per_process, verbose=verbose,
+                          max_tasks_per_child=max_tasks_per_child, **pool_params) as pool:
+            results = pool._map(func, iterable, star=star, chunksize=chunksize, pbar_desc=pbar_desc, share=share,
+                                out=out, result_shape=result_shape, result_dtype=result_dtype, batched=batched,
+                                batch_size=batch_size, on_error=on_error, retries=retries, retry_delay=retry_delay,
+                                timeout=timeout, checkpoint=checkpoint, stats=stats)
+        if verbose:
+            print('done.')
+    else:
+        raise ValueError("mode must be one of 'thread', 'process', 'notebook' or 'async'")
 
     return results
 
 
+def iparmap(func, iterable, star=False, mode="process", n_workers=None, nthreads_per_process=None, ordered=True,
+            chunksize=None, max_in_flight=None, pbar_desc=None, verbose=False, max_tasks_per_child=None, pool=None,
+            share=False, batched=False, batch_size=None, on_error="raise", retries=0, retry_delay=0.1, timeout=None,
+            **pool_params):
+    """
+    Lazily apply ``func`` to every item in ``iterable``, yielding results as they complete.
+
+    Unlike ``parmap``, the input is consumed incrementally, and at most ``max_in_flight`` chunks of ``chunksize``
+    items are submitted (or, when ``ordered``, held waiting for earlier results) at any time, so memory use does not
+    grow with the size of the input. With ``ordered=False``, results are yielded in completion order.
+
+    ``chunksize`` defaults to 1 in "thread" mode and to ``nthreads_per_process`` otherwise, and may be "auto" to size
+    chunks from measured task latency; ``max_in_flight`` defaults to four chunks per worker. With ``batched``,
+    ``batch_size`` is required if ``iterable`` has no length, and ``chunksize`` defaults to one batch. With
+    ``on_error="collect"``, a ``TaskError`` is yielded in place of the result of each failed item. The other arguments
+    are as for ``parmap``.
+    """
+    error_params = dict(on_error=on_error, retries=retries, retry_delay=retry_delay, timeout=timeout)
+    if pool is not None:
+        yield from pool.imap(func, iterable, star=star, ordered=ordered, chunksize=chunksize,
+                             max_in_flight=max_in_flight, pbar_desc=pbar_desc, share=share, batched=batched,
+                             batch_size=batch_size, **error_params)
+        return
+
+    mode, n_workers, nthreads_per_process = _resolve_workers(mode, n_workers, nthreads_per_process, verbose)
+    if n_workers == 1:
+        policy = _make_policy(**error_params)
+        total = len(iterable) if hasattr(iterable, '__len__') else None
+        batched = batched or batch_size is not None
+        items = _iter_batches(iterable, _resolve_batch_size(batch_size, total, 1)) if batched else iterable
+        for _, result in _map_serial(func, items, star, total=total, pbar_desc=pbar_desc, batched=batched,
+                                     policy=policy):
+            if on_error == "skip" and isinstance(result, TaskError):
+                continue
+            yield result
+        return
+
+    with ParallelPool(n_workers, mode=mode, nthreads_per_process=nthreads_per_process, verbose=verbose,
+                      max_tasks_per_child=max_tasks_per_child, **pool_params) as pool:
+        yield from pool.imap(func, iterable, star=star, ordered=ordered, chunksize=chunksize,
+                             max_in_flight=max_in_flight, pbar_desc=pbar_desc, share=share, batched=batched,
+                             batch_size=batch_size, **error_params)
+
+
+# Container types by name, for recreating containers from their metadata; see register_container
+_CONTAINER_TYPES: dict[str, type] = {}
+
+
+def _container_name(cls: type) -> str:
+    if cls.__module__ == __name__:
+        return cls.__name__
+    return f"{cls.__module__}.{cls.__qualname__}"
+
+
+def register_container(cls: type, name: Optional[str] = None) -> type:
+    """Register a container type, under its name if defined in this module, or else its qualified name, so that it
+    can be recreated from metadata, as by ``SharedDataDict.from_metadata``. Subclasses of ``SharedMemoryContainer``
+    are registered when defined; this can also be used as a decorator to register another class, or an alias.
+    """
+    _CONTAINER_TYPES[name or _container_name(cls)] = cls
+    return cls
+
+
+def _container_type(name: str) -> type:
+    """Get a registered container type, importing the module that defines it if it isn't yet registered."""
+    if name not in _CONTAINER_TYPES:
+        parts = name.split('.')
+        for i in range(len(parts) - 1, 0, -1):
+            try:
+                importlib.import_module('.'.join(parts[:i]))
+                break
+            except ImportError:
+                continue
+    if name not in _CONTAINER_TYPES:
+        raise ValueError(f"Unknown shared memory container type {name!r}; see register_container")
+    return _CONTAINER_TYPES[name]
+
+
+def _create_shared_memory(size: int, smm: Optional[SharedMemoryManager] = None) -> shared_memory.SharedMemory:
+    if smm:
+        return smm.SharedMemory(size=size)
+    return shared_memory.SharedMemory(name=_segment_name(), create=True, size=size)
+
+
+def _segment_name() -> str:
+    return f"{_SEGMENT_PREFIX}{os.getpid()}_{os.urandom(4).hex()}"
+
+
 class SharedMemoryContainer(ABC):
     """Abstract base class for shared memory containers."""
 
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        register_container(cls)
+
     @classmethod
     @abstractmethod
     def create(cls, *args, **kwargs) -> "SharedMemoryContainer":
@@ -226,22 +1919,15 @@ class SharedMemoryArray(SharedMemoryContainer):
 
     @classmethod
     def create(cls, array: np.ndarray, smm: Optional[SharedMemoryManager] = None) -> "SharedMemoryArray":
-        if smm:
-            shared_mem = smm.SharedMemory(size=array.nbytes)
-        else:
-            shared_mem = shared_memory.SharedMemory(create=True, size=array.nbytes)
+        shared_mem = _create_shared_memory(array.nbytes, smm)
         shared_array = np.ndarray(array.shape, dtype=array.dtype, buffer=shared_mem.buf)
         np.copyto(shared_array, array)
         return cls(shared_mem, array.shape, array.dtype)
 
     @classmethod
     def create_empty(cls, shape: tuple, dtype, smm: Optional[SharedMemoryManager] = None) -> "SharedMemoryArray":
-        size = np.prod(shape) * np.dtype(dtype).itemsize
-        if smm:
-            shared_mem = smm.SharedMemory(size=size)
-        else:
-            shared_mem = shared_memory.SharedMemory(size=size)
-        return cls(shared_mem, shape, dtype)
+        size = max(int(np.prod(shape)) * np.dtype(dtype).itemsize, 1)  # Shared memory size must be positive
+        return cls(_create_shared_memory(size, smm), shape, dtype)
 
     def load(self) -> np.ndarray:
         return np.ndarray(self.shape, dtype=self.dtype, buffer=self.shared_mem.buf)
@@ -264,6 +1950,62 @@ class SharedMemoryArray(SharedMemoryContainer):
         return cls(shared_mem, metadata['shape'], metadata['dtype'])
 
 
+class SharedMemoryDataFrame(SharedMemoryContainer):
+    """A DataFrame stored as an Arrow IPC stream in a shared memory segment.
+
+    Unlike ``PyArrowDataFrame``, nothing is written to disk. Loading reads the stream in place, so numeric columns
+    without nulls are read-only NumPy views of the shared memory rather than copies, while other columns are converted
+    as by ``pa.Table.to_pandas``. As with ``SharedMemoryArray``, the shared memory can't be closed while a loaded
+    DataFrame still refers to it.
+    """
+    def __init__(self, shared_mem: shared_memory.SharedMemory, size: int):
+        self.shared_mem = shared_mem
+        self.size = size
+
+    @staticmethod
+    def _write(sink, table: pa.Table) -> None:
+        with ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+
+    @classmethod
+    def create(cls, df: pd.DataFrame, smm: Optional[SharedMemoryManager] = None) -> "SharedMemoryDataFrame":
+        return cls._create_table(pa.Table.from_pandas(df), smm)
+
+    @classmethod
+    def _create_table(cls, table: pa.Table, smm: Optional[SharedMemoryManager] = None) -> "SharedMemoryDataFrame":
+        size_counter = pa.MockOutputStream()
+        cls._write(size_counter, table)
+        size = size_counter.size()
+        shared_mem = _create_shared_memory(size, smm)
+        with pa.FixedSizeBufferWriter(pa.py_buffer(shared_mem.buf)) as sink:
+            cls._write(sink, table)
+        return cls(shared_mem, size)
+
+    def load_arrow(self) -> pa.Table:
+        """Load the data as an Arrow table backed by the shared memory."""
+        return ipc.open_stream(pa.py_buffer(self.shared_mem.buf).slice(0, self.size)).read_all()
+
+    def load(self) -> pd.DataFrame:
+        return self.load_arrow().to_pandas(split_blocks=True)  # One block per column avoids copies to consolidate
+
+    def close(self) -> "SharedMemoryDataFrame":
+        self.shared_mem.close()
+        return self
+
+    def unlink(self) -> "SharedMemoryDataFrame":
+        self.shared_mem.unlink()
+        return self
+
+    @property
+    def metadata(self) -> dict:
+        return {'name': self.shared_mem.name, 'size': self.size}
+
+    @classmethod
+    def from_metadata(cls, metadata: dict) -> "SharedMemoryDataFrame":
+        shared_mem = shared_memory.SharedMemory(name=metadata['name'])
+        return cls(shared_mem, metadata['size'])
+
+
 class SharedMemoryList(SharedMemoryContainer):
     def __init__(self, shared_mem: shared_memory.ShareableList):
         self.shared_mem = shared_mem
@@ -273,7 +2015,7 @@ class SharedMemoryList(SharedMemoryContainer):
         if smm:
             shared_mem = smm.ShareableList(array)
         else:
-            shared_mem = shared_memory.ShareableList(array)
+            shared_mem = shared_memory.ShareableList(array, name=_segment_name())
         return cls(shared_mem)
 
     def load(self) -> list:
@@ -297,17 +2039,275 @@ class SharedMemoryList(SharedMemoryContainer):
         return cls(shared_mem)
 
 
+def _as_array(column: pa.ChunkedArray) -> pa.Array:
+    """Get a chunked array as an array, without copying it if it has a single chunk."""
+    return column.chunk(0) if column.num_chunks == 1 else column.combine_chunks()
+
+
+class ArrowSequence(Sequence):
+    """A read-only list of the values of an Arrow array, each converted to a Python object when accessed.
+
+    Indexing is O(1), using the array's offsets for variable-length values, and slices with a step of 1 are views of
+    the same data, without any copy.
+    """
+    _ITER_BATCH_SIZE = 1024
+
+    def __init__(self, array: pa.Array):
+        self.array = array
+
+    def __len__(self) -> int:
+        return len(self.array)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self.array))
+            if step == 1:
+                return type(self)(self.array.slice(start, max(stop - start, 0)))
+            return type(self)(self.array.take(pa.array(range(start, stop, step), type=pa.int64())))
+        index = operator.index(index)
+        if index < 0:
+            index += len(self.array)
+        if not 0 <= index < len(self.array):
+            raise IndexError("ArrowSequence index out of range")
+        return self.array[index].as_py()
+
+    def __iter__(self):
+        for start in range(0, len(self.array), self._ITER_BATCH_SIZE):
+            yield from self.array.slice(start, self._ITER_BATCH_SIZE).to_pylist()
+
+    def to_pylist(self) -> list:
+        return self.array.to_pylist()
+
+    def __repr__(self):
+        return f"{type(self).__name__}(length={len(self)}, type={self.array.type})"
+
+
+class SharedMemoryArrowList(SharedMemoryDataFrame):
+    """A list of strings, bytes, numbers, or (nested) lists of these, stored as an Arrow array in shared memory.
+
+    Unlike ``SharedMemoryList``, items may be of any size, and nothing is pickled: ``load`` returns an
+    ``ArrowSequence`` reading the offsets and data buffers of the array in place, so that each process attached to
+    the list shares a single copy of it.
+    """
+    @classmethod
+    def create(cls, items: Union[list, pa.Array], smm: Optional[SharedMemoryManager] = None,
+               type: Optional[pa.DataType] = None) -> "SharedMemoryArrowList":
+        """Store a list of items, or an Arrow array. The Arrow ``type`` is inferred from the items unless given;
+        large string, binary or list types are needed for more than 2 GB of data.
+        """
+        if isinstance(items, pa.ChunkedArray):
+            items = items.combine_chunks()
+        elif not isinstance(items, pa.Array):
+            items = pa.array(items, type=type)
+        return cls._create_table(pa.table({'values': items}), smm)
+
+    def load_arrow(self) -> pa.Array:
+        """Load the list as an Arrow array backed by the shared memory."""
+        return _as_array(super().load_arrow().column(0))
+
+    def load(self) -> ArrowSequence:
+        return ArrowSequence(self.load_arrow())
+
+
+_MISSING = object()
+
+
+class ArrowMapping(Mapping):
+    """A read-only mapping of the keys and values of an Arrow table, sorted by key (or by key hash), so that keys are
+    looked up by binary search.
+
+    Integer and float keys are searched directly; other keys, such as strings, by a 64-bit hash, checking the keys
+    themselves for equality. ``lookup`` and ``contains`` look up many keys at once, returning NumPy arrays.
+    """
+    def __init__(self, table: pa.Table):
+        self.table = table
+        self._keys = _as_array(table.column('key'))
+        self._values = _as_array(table.column('value'))
+        self._hashed = 'hash' in table.column_names
+        self._sorted = (_as_array(table.column('hash')) if self._hashed else self._keys).to_numpy()  # Zero-copy
+        self._numeric_values = None
+        if (pa.types.is_integer(self._values.type) or pa.types.is_floating(self._values.type)) \
+                and self._values.null_count == 0:
+            self._numeric_values = self._values.to_numpy()
+
+    @staticmethod
+    def _objects(keys) -> np.ndarray:
+        """Get a 1-d object array of keys (even if they're tuples, which ``np.asarray`` would make a 2-d array of)."""
+        return np.fromiter(keys, dtype=object, count=len(keys))
+
+    @staticmethod
+    def _hash(keys) -> np.ndarray:
+        return pd.util.hash_array(ArrowMapping._objects(keys))
+
+    def _query(self, keys) -> tuple[np.ndarray, Optional[np.ndarray], Optional[pa.Array]]:
+        """Get the values of keys to search for (keys themselves, or their hashes), which of them are of a type that
+        can be in the table (or None if all are), so that other keys are treated as missing rather than raising, and
+        (if hashed) the keys as an Arrow array of the table's key type, with nulls in place of the others.
+        """
+        if not self._hashed:
+            try:
+                query = np.asarray(keys)
+            except ValueError:  # Of sequences of different lengths
+                query = None
+            if query is not None and query.ndim == 1 and query.dtype.kind in "biuf":
+                return query, None, None
+            objects = self._objects(keys)
+            valid = np.array([isinstance(key, (int, float, np.integer, np.floating, np.bool_)) for key in objects],
+                             dtype=bool)
+            return np.asarray(np.where(valid, objects, 0).tolist()), valid, None
+        objects = self._objects(keys)
+        valid = None
+        try:
+            arrow_keys = pa.array(objects, type=self._keys.type)
+        except (pa.ArrowInvalid, pa.ArrowTypeError, ValueError):
+            valid = np.array([self._is_key_type(key) for key in objects], dtype=bool)
+            objects = np.where(valid, objects, None)
+            arrow_keys = pa.array(objects, type=self._keys.type)
+        return self._hash(objects), valid, arrow_keys
+
+    def _is_key_type(self, key) -> bool:
+        try:
+            pa.scalar(key, type=self._keys.type)
+        except (pa.ArrowInvalid, pa.ArrowTypeError, ValueError):
+            return False
+        return True
+
+    def _positions(self, keys) -> tuple[np.ndarray, np.ndarray]:
+        """Get the positions of keys in the table, and whether each was found (if not, its position is arbitrary)."""
+        keys = list(keys) if not isinstance(keys, (np.ndarray, pd.Series, pd.Index)) else np.asarray(keys)
+        if len(self._sorted) == 0 or len(keys) == 0:
+            return np.zeros(len(keys), dtype=np.int64), np.zeros(len(keys), dtype=bool)
+        query, valid, arrow_keys = self._query(keys)
+        left = np.searchsorted(self._sorted, query)
+        positions = np.minimum(left, len(self._sorted) - 1)
+        if not self._hashed:
+            found = self._sorted[positions] == query
+            return positions, found if valid is None else found & valid
+        found = np.asarray(pc.fill_null(pc.equal(self._keys.take(pa.array(positions)), arrow_keys), False))
+        found = found & (self._sorted[positions] == query)
+        # Keys whose hash collides with others' must be compared to each key with that hash
+        right = np.searchsorted(self._sorted, query, side='right')
+        candidates = ~found & (right - left > 1)
+        for i in np.flatnonzero(candidates if valid is None else candidates & valid):
+            for j in range(left[i] + 1, right[i]):
+                if self._keys[j].as_py() == keys[i]:
+                    positions[i], found[i] = j, True
+                    break
+        return positions, found
+
+    def lookup(self, keys, default=_MISSING) -> np.ndarray:
+        """Look up the values of an array (or other sequence) of keys, filling in ``default`` for any missing keys,
+        or raising a ``KeyError`` if no default is given.
+        """
+        positions, found = self._positions(keys)
+        if not found.all() and default is _MISSING:
+            raise KeyError(list(self._objects(keys)[~found][:10]))
+        if self._numeric_values is not None:
+            values = self._numeric_values[positions]
+        elif len(self._keys) == 0:
+            values = np.empty(len(positions), dtype=object)
+        else:
+            values = self._values.take(pa.array(positions)).to_numpy(zero_copy_only=False)
+        if found.all():
+            return values
+        return np.where(found, values, default)
+
+    def contains(self, keys) -> np.ndarray:
+        """Check whether each of an array (or other sequence) of keys is in the mapping."""
+        return self._positions(keys)[1]
+
+    def __getitem__(self, key):
+        positions, found = self._positions([key])
+        if not found[0]:
+            raise KeyError(key)
+        return self._values[int(positions[0])].as_py()
+
+    def __contains__(self, key) -> bool:
+        return bool(self._positions([key])[1][0])
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def __iter__(self):
+        """Iterate over the keys, in the order in which they're stored."""
+        return iter(ArrowSequence(self._keys))
+
+    def __repr__(self):
+        return f"{type(self).__name__}(length={len(self)}, key={self._keys.type}, value={self._values.type})"
+
+
+class SharedMemoryDict(SharedMemoryDataFrame):
+    """A read-only dictionary stored in shared memory, as an Arrow table of its keys and values sorted by key, so
+    that processes attached to it share a single copy of it.
+
+    ``load`` returns an ``ArrowMapping``, which looks keys up by binary search, including many at once with
+    ``lookup``. Keys must all be of one type, such as integers or strings; values may be of any type that Arrow can
+    store, such as numbers, strings, or lists of these.
+    """
+    @classmethod
+    def create(cls, data: Union[Mapping, pd.Series], smm: Optional[SharedMemoryManager] = None) -> "SharedMemoryDict":
+        """Store a dictionary, or a Series indexed by its keys."""
+        if isinstance(data, pd.Series):
+            if not data.index.is_unique:
+                raise ValueError("Series index has duplicate keys")
+            keys, values = pa.Array.from_pandas(data.index), pa.Array.from_pandas(data)
+        else:
+            keys, values = pa.array(list(data.keys())), pa.array(list(data.values()))
+        columns = {'key': keys, 'value': values}
+        if pa.types.is_integer(keys.type) or pa.types.is_floating(keys.type):
+            order = np.argsort(keys.to_numpy(zero_copy_only=False), kind='stable')
+        else:
+            hashes = ArrowMapping._hash(keys.to_pylist())
+            order = np.argsort(hashes, kind='stable')
+            columns['hash'] = pa.array(hashes[order])
+        columns['key'], columns['value'] = keys.take(pa.array(order)), values.take(pa.array(order))
+        return cls._create_table(pa.table(columns), smm)
+
+    def load(self) -> ArrowMapping:
+        return ArrowMapping(self.load_arrow())
+
+
+@dataclass
+class IOStats:
+    """Size and duration of writing or reading a PyArrow container file."""
+    file_bytes: int  # Size of the file
+    data_bytes: int  # Size of the (uncompressed) Arrow data written or read
+    seconds: float
+
+    @property
+    def throughput(self) -> float:
+        """Bytes of data written or read per second."""
+        return self.data_bytes / max(self.seconds, 1e-9)
+
+    @property
+    def compression_ratio(self) -> float:
+        return self.data_bytes / max(self.file_bytes, 1)
+
+    def __str__(self):
+        return (f"{self.data_bytes / 1e6:.1f} MB of data ({self.file_bytes / 1e6:.1f} MB file) "
+                f"in {self.seconds:.3f} s "
+                f"({self.throughput / 1e6:.1f} MB/s)")
+
+
 class PyArrowData(SharedMemoryContainer):
-    """Abstract base class for PyArrow data containers."""
+    """Abstract base class for PyArrow data containers.
+
+    After a container is created, ``write_stats`` gives the size of its file and the time taken to write it, and after
+    each load, ``read_stats`` gives the time taken to read it, as ``IOStats``.
+    """
+    _extension = ".arrow"
+
     def __init__(self, path: str):
         self.path = path
+        self.write_stats: Optional[IOStats] = None
+        self.read_stats: Optional[IOStats] = None
 
-    @staticmethod
-    def _check_path(path: Optional[str] = None, dir: Optional[str] = None, overwrite=False):
+    @classmethod
+    def _check_path(cls, path: Optional[str] = None, dir: Optional[str] = None, overwrite=False):
         if path is None:
-            path = get_hash_string(time.time_ns(), length=8) + ".arrow"
+            path = get_hash_string(time.time_ns(), length=8) + cls._extension
         elif not os.path.splitext(path)[1]:
-            path += ".arrow"
+            path += cls._extension
 
         if dir is not None:
             path = os.path.join(dir, path)
@@ -334,6 +2334,9 @@ class PyArrowData(SharedMemoryContainer):
         """Load the data from the file."""
         pass
 
+    def _io_stats(self, start: float, data_bytes: int) -> IOStats:
+        return IOStats(os.path.getsize(self.path), data_bytes, time.perf_counter() - start)
+
     def close(self) -> "PyArrowData":
         return self
 
@@ -352,38 +2355,310 @@ class PyArrowData(SharedMemoryContainer):
         return cls(path)
 
 
+def _ipc_options(compression: Optional[str] = None) -> ipc.IpcWriteOptions:
+    if compression not in (None, "lz4", "zstd"):
+        raise ValueError(f"Unsupported IPC compression {compression!r}; use None, 'lz4' or 'zstd'")
+    return ipc.IpcWriteOptions(compression=compression)
+
+
 class PyArrowDataFrame(PyArrowData):
+    """A DataFrame stored in an Arrow IPC file, which is memory-mapped to load it.
+
+    ``load`` and ``load_arrow`` can read a subset of the data: only the record batches overlapping a ``rows`` slice
+    are read, a ``filter`` (a ``pyarrow.compute.Expression``, such as ``pc.field("a") > 0``) selects rows by value,
+    and, when loading into pandas, only the selected ``columns`` (along with any index) are converted and copied.
+
+    Data larger than memory can be written in parts with ``writer``, and read back in parts with ``iter_batches``.
+
+    With ``compression="lz4"`` or ``"zstd"``, the record batches are compressed, making the file smaller and quicker
+    to write to and read from slow (e.g. network-attached) storage, at the cost of decompressing each batch, into
+    memory, when it is read, instead of using the memory-mapped file directly.
+    """
+    _POSITION_COLUMN = "__row_position__"
+
     @classmethod
     def create(
-            cls, df: pd.DataFrame, path: Optional[str] = None, dir: Optional[str] = None, overwrite: bool = False
+            cls, df: pd.DataFrame, path: Optional[str] = None, dir: Optional[str] = None, overwrite: bool = False,
+            compression: Optional[str] = None,
     ) -> "PyArrowDataFrame":
         path = cls._check_path(path, dir, overwrite)
+        start = time.perf_counter()
         table = pa.Table.from_pandas(df)
         with pa.OSFile(path, 'wb') as sink:
-            with ipc.new_file(sink, table.schema) as writer:
+            with ipc.new_file(sink, table.schema, options=_ipc_options(compression)) as writer:
                 writer.write_table(table)
-        return cls(path)
+        container = cls(path)
+        container.write_stats = container._io_stats(start, table.nbytes)
+        return container
 
-    def load(self) -> pd.DataFrame:
+    @classmethod
+    def writer(cls, path: Optional[str] = None, dir: Optional[str] = None, overwrite: bool = False,
+               schema: Optional[pa.Schema] = None, preserve_index: bool = False,
+               compression: Optional[str] = None) -> "PyArrowDataFrameWriter":
+        """Open a file to write a DataFrame to in parts; see ``PyArrowDataFrameWriter``."""
+        return PyArrowDataFrameWriter(cls._check_path(path, dir, overwrite), schema=schema,
+                                      preserve_index=preserve_index, compression=compression)
+
+    @property
+    def schema(self) -> pa.Schema:
+        with pa.memory_map(self.path, 'rb') as source:
+            return ipc.RecordBatchFileReader(source).schema
+
+    def _select(self, table: pa.Table, columns=None, filter=None, start=0, step=1, positions=False) -> pa.Table:
+        """Select from a table read from rows ``start::step`` of the file, adding a column of row positions in the
+        file if ``positions``.
+        """
+        if positions:
+            table = table.append_column(
+                self._POSITION_COLUMN, pa.array(np.arange(start, start + table.num_rows * step, step)))
+        if filter is not None:
+            table = table.filter(filter)
+        if columns is not None:
+            table = table.select(list(columns) + ([self._POSITION_COLUMN] if positions else []))
+        return table
+
+    def _read(self, columns=None, rows: Optional[slice] = None, filter=None, positions=False) -> pa.Table:
+        with pa.memory_map(self.path, 'rb') as source:
+            reader = ipc.RecordBatchFileReader(source)
+            batches = [reader.get_batch(i) for i in range(reader.num_record_batches)]  # Not copied
+            schema = reader.schema
+        start, step = 0, 1
+        if rows is not None:
+            start, stop, step = rows.indices(sum(batch.num_rows for batch in batches))
+            if step < 1:
+                raise ValueError("rows must be a slice with a positive step")
+            selected = []
+            offset = 0
+            for batch in batches:
+                first, last = max(start - offset, 0), min(stop - offset, batch.num_rows)
+                if first < last:
+                    selected.append(batch.slice(first, last - first))
+                offset += batch.num_rows
+            batches = selected
+        table = pa.Table.from_batches(batches, schema=schema)
+        if step > 1:
+            table = table.take(np.arange(0, table.num_rows, step))
+        return self._select(table, columns, filter, start, step, positions)
+
+    def _pandas_selection(self, columns=None):
+        """Add any stored index columns to a selection of columns, and get the metadata of any RangeIndex, which is
+        stored as metadata alone, so that its labels must be recovered from the positions of the rows.
+        """
+        index_columns = (self.schema.pandas_metadata or {}).get('index_columns', [])
+        if columns is not None:
+            columns = list(columns) + [c for c in index_columns if isinstance(c, str) and c not in columns]
+        range_index = next((c for c in index_columns if isinstance(c, dict) and c['kind'] == 'range'), None)
+        return columns, range_index
+
+    def _to_pandas(self, table: pa.Table, range_index: Optional[dict]) -> pd.DataFrame:
+        df = table.to_pandas()
+        if range_index is not None:
+            positions = df.pop(self._POSITION_COLUMN).to_numpy()
+            df.index = pd.Index(range_index['start'] + range_index['step'] * positions, name=range_index['name'])
+        return df
+
+    def load_arrow(self, columns=None, rows: Optional[slice] = None, filter=None) -> pa.Table:
+        """Load the selected data as an Arrow table backed by the memory-mapped file (unless it is compressed)."""
+        start = time.perf_counter()
+        table = self._read(columns, rows, filter)
+        self.read_stats = self._io_stats(start, table.nbytes)
+        return table
+
+    def load(self, columns=None, rows: Optional[slice] = None, filter=None) -> pd.DataFrame:
+        """Load the selected data as a DataFrame, keeping the index labels of the selected rows."""
+        start = time.perf_counter()
+        if columns is None and rows is None and filter is None:
+            table = self._read()
+            df = table.to_pandas()
+        else:
+            columns, range_index = self._pandas_selection(columns)
+            table = self._read(columns, rows, filter, positions=range_index is not None)
+            df = self._to_pandas(table, range_index)
+        self.read_stats = self._io_stats(start, table.nbytes)
+        return df
+
+    def iter_batches(self, columns=None, filter=None, batch_size: Optional[int] = None):
+        """Iterate over the data as DataFrames, one per record batch in the file (or per ``batch_size`` rows of it),
+        each read from the memory-mapped file when reached. ``columns`` and ``filter`` select data as for ``load``.
+        """
+        columns, range_index = self._pandas_selection(columns)
         with pa.memory_map(self.path, 'rb') as source:
-            return ipc.RecordBatchFileReader(source).read_pandas()
+            reader = ipc.RecordBatchFileReader(source)
+            offset = 0
+            for i in range(reader.num_record_batches):
+                batch = reader.get_batch(i)
+                step = batch_size or max(batch.num_rows, 1)
+                for start in range(0, batch.num_rows, step):
+                    table = pa.Table.from_batches([batch.slice(start, step)])
+                    table = self._select(table, columns, filter, offset + start, positions=range_index is not None)
+                    yield self._to_pandas(table, range_index)
+                offset += batch.num_rows
+
+
+class PyArrowDataFrameWriter:
+    """Writer of a DataFrame to an Arrow IPC file in parts, each written as it is produced, so that the whole never
+    needs to be in memory.
+
+    Use as a context manager, created by ``PyArrowDataFrame.writer``, and call ``write`` with each part (a DataFrame,
+    or an Arrow table or record batch). The first part sets the schema, unless one is given. Indexes are dropped,
+    unless ``preserve_index``, in which case they are stored as columns. Each part is compressed if ``compression``
+    is "lz4" or "zstd". Once closed, ``container`` is the ``PyArrowDataFrame`` for the file, with the total size and
+    time of the writes in its ``write_stats``. For example, to save the results of a map as they stream in::
+
+        with PyArrowDataFrame.writer(dir="results") as writer:
+            for df in iparmap(make_part, inputs):
+                writer.write(df)
+        parts = writer.container
+    """
+    def __init__(self, path: str, schema: Optional[pa.Schema] = None, preserve_index: bool = False,
+                 compression: Optional[str] = None):
+        self.path = path
+        self.schema = schema
+        self.preserve_index = preserve_index
+        self.container = None
+        self.n_rows = 0
+        self._options = _ipc_options(compression)
+        self._data_bytes = 0
+        self._seconds = 0.0
+        self._sink = pa.OSFile(path, 'wb')
+        self._writer = None
+
+    def __enter__(self) -> "PyArrowDataFrameWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, data: Union[pd.DataFrame, pa.Table, pa.RecordBatch]) -> None:
+        start = time.perf_counter()
+        if isinstance(data, pd.DataFrame):
+            data = pa.Table.from_pandas(data, schema=self.schema, preserve_index=self.preserve_index)
+        if self._writer is None:
+            if self.schema is None:
+                self.schema = data.schema
+            self._writer = ipc.new_file(self._sink, self.schema, options=self._options)
+        if isinstance(data, pa.RecordBatch):
+            self._writer.write_batch(data)
+        else:
+            self._writer.write_table(data)
+        self.n_rows += data.num_rows
+        self._data_bytes += data.nbytes
+        self._seconds += time.perf_counter() - start
+
+    def close(self) -> PyArrowDataFrame:
+        if self.container is None:
+            start = time.perf_counter()
+            try:
+                if self._writer is None:
+                    if self.schema is None:
+                        raise ValueError("No data was written, and no schema was given")
+                    self._writer = ipc.new_file(self._sink, self.schema, options=self._options)
+                self._writer.close()
+            finally:
+                self._sink.close()
+            self.container = PyArrowDataFrame(self.path)
+            self.container.write_stats = IOStats(
+                os.path.getsize(self.path), self._data_bytes, self._seconds + time.perf_counter() - start)
+        return self.container
 
 
 class PyArrowArray(PyArrowDataFrame):
+    """A NumPy array of any shape and dtype stored in an Arrow IPC file, which is memory-mapped to load it.
+
+    The array is stored as a single flat column, with its shape and dtype in the schema metadata, so that ``load``
+    returns a read-only view of the memory-mapped file, without any copy. Integer and float arrays are stored as
+    Arrow arrays of the same type; arrays of other dtypes (such as bool, complex, datetime, or structured dtypes) as
+    their raw bytes. Files written as DataFrames with a column per array column, by earlier versions, still load.
+    With ``compression``, ``load`` returns a read-only array of the decompressed data instead.
+    """
     @classmethod
     def create(
-            cls, array: np.ndarray, path: Optional[str] = None, dir: Optional[str] = None, overwrite: bool = False
+            cls, array: np.ndarray, path: Optional[str] = None, dir: Optional[str] = None, overwrite: bool = False,
+            compression: Optional[str] = None,
     ) -> "PyArrowArray":
-        if array.ndim > 2:
-            raise NotImplementedError("Only arrays with <=2 dimensions are supported.")
-        if array.ndim == 1:
-            array = array[:, np.newaxis]
-        df = pd.DataFrame({str(i): array[:, i] for i in range(array.shape[1])})
-        return super().create(df, path=path, dir=dir, overwrite=overwrite)
+        if array.dtype.hasobject:
+            raise TypeError("Arrays of Python objects can't be stored in a PyArrowArray")
+        path = cls._check_path(path, dir, overwrite)
+        start = time.perf_counter()
+        flat = np.ascontiguousarray(array).reshape(-1)
+        if flat.dtype.kind in 'iuf' and flat.dtype.isnative:
+            values = pa.array(flat)
+        else:
+            values = pa.array(flat.view(np.uint8))
+        metadata = {'shape': json.dumps(array.shape), 'dtype': json.dumps(np.lib.format.dtype_to_descr(array.dtype))}
+        schema = pa.schema([pa.field('values', values.type)], metadata=metadata)
+        with pa.OSFile(path, 'wb') as sink:
+            with ipc.new_file(sink, schema, options=_ipc_options(compression)) as writer:
+                writer.write_batch(pa.record_batch([values], schema=schema))
+        container = cls(path)
+        container.write_stats = container._io_stats(start, values.nbytes)
+        return container
 
     def load(self) -> np.ndarray:
-        df = super().load()
-        return df.values
+        start = time.perf_counter()
+        with pa.memory_map(self.path, 'rb') as source:
+            reader = ipc.RecordBatchFileReader(source)
+            metadata = reader.schema.metadata or {}
+            if b'shape' not in metadata:
+                return super().load().values
+            values = reader.get_batch(0).column(0)
+        shape = tuple(json.loads(metadata[b'shape']))
+        dtype = np.lib.format.descr_to_dtype(json.loads(metadata[b'dtype']))
+        buffer = values.buffers()[1]
+        if buffer is None:  # No elements
+            array = np.empty(shape, dtype=dtype)
+        else:
+            array = np.frombuffer(buffer, dtype=dtype, count=math.prod(shape)).reshape(shape)
+        self.read_stats = self._io_stats(start, array.nbytes)
+        return array
+
+
+class ParquetDataFrame(PyArrowData):
+    """A DataFrame stored in a compressed Parquet file.
+
+    Parquet files are typically several times smaller than Arrow IPC files, even compressed ones, so that they are
+    quicker to write to and read from slow storage, but they must always be decoded into memory to be loaded. As with
+    a ``PyArrowDataFrame``, ``load`` and ``load_arrow`` can read just the selected ``columns``, and the rows matching
+    a ``filter``, which here skips whole row groups where the file's statistics show that no rows can match. The index
+    is stored as a column, so that the labels of the selected rows are kept.
+    """
+    _extension = ".parquet"
+
+    @classmethod
+    def create(
+            cls, df: pd.DataFrame, path: Optional[str] = None, dir: Optional[str] = None, overwrite: bool = False,
+            compression: Optional[str] = "zstd", row_group_size: Optional[int] = None,
+    ) -> "ParquetDataFrame":
+        path = cls._check_path(path, dir, overwrite)
+        start = time.perf_counter()
+        table = pa.Table.from_pandas(df, preserve_index=True)
+        pq.write_table(table, path, compression=compression or "none", row_group_size=row_group_size)
+        container = cls(path)
+        container.write_stats = container._io_stats(start, table.nbytes)
+        return container
+
+    @property
+    def schema(self) -> pa.Schema:
+        return pq.read_schema(self.path)
+
+    def _read(self, columns=None, filter=None) -> pa.Table:
+        start = time.perf_counter()
+        table = pq.read_table(self.path, columns=None if columns is None else list(columns), filters=filter,
+                              use_pandas_metadata=True)
+        self.read_stats = self._io_stats(start, table.nbytes)
+        return table
+
+    def load_arrow(self, columns=None, filter=None) -> pa.Table:
+        """Load the selected data as an Arrow table."""
+        return self._read(columns, filter)
+
+    def load(self, columns=None, filter=None) -> pd.DataFrame:
+        """Load the selected data as a DataFrame."""
+        start = time.perf_counter()
+        table = self._read(columns, filter)
+        df = table.to_pandas()
+        self.read_stats = self._io_stats(start, table.nbytes)
+        return df
 
 
 class SharedDataDict(SharedMemoryContainer):
@@ -411,19 +2686,319 @@ class SharedDataDict(SharedMemoryContainer):
     def metadata(self) -> dict:
         metadata = {}
         for k, v in self.data.items():
-            metadata[k] = {'class': v.__class__.__name__, 'meta': v.metadata}
+            metadata[k] = {'class': _container_name(type(v)), 'meta': v.metadata}
         return metadata
 
     @classmethod
     def from_metadata(cls, metadata: dict) -> "SharedDataDict":
         data = {}
         for name, info in metadata.items():
-            type_ = eval(info['class'])
+            type_ = _container_type(info['class'])
             meta = info['meta']
             data[name] = type_.from_metadata(meta)
         return cls(data)
 
 
+def _release(container: SharedMemoryContainer) -> None:
+    """Close and unlink a container, whether or not values loaded from it are still referenced."""
+    try:
+        container.close()
+    except BufferError:
+        pass  # A loaded value still refers to the shared memory, which is kept until that is released
+    try:
+        container.unlink()
+    except FileNotFoundError:
+        pass
+
+
+class SharedDataSession:
+    """Owner of shared memory containers, which closes and unlinks all of them when it ends.
+
+    Use as a context manager, creating containers with ``create`` (or adding them with ``add``). The containers are
+    released when the ``with`` block exits, at interpreter exit if it never does, or, if entered in the main thread,
+    on SIGTERM or SIGHUP, before the signal's previous handler runs. For example::
+
+        with SharedDataSession() as session:
+            data = session.create(SharedDataDict, {
+                "weights": session.create(SharedMemoryArray, weights),
+                "table": session.create(SharedMemoryDataFrame, df),
+            })
+            results = parmap(partial(fit, metadata=data.metadata), items)
+
+    Segments left behind by processes killed before they could clean up can be found with ``find_leaked_segments``.
+    """
+    _SIGNALS = tuple(getattr(signal, name) for name in ("SIGTERM", "SIGHUP") if hasattr(signal, name))
+
+    def __init__(self, handle_signals: bool = True):
+        self.handle_signals = handle_signals
+        self.containers: list[SharedMemoryContainer] = []
+        self._previous_handlers = {}
+        self._lock = RLock()
+
+    def create(self, cls: type, *args, **kwargs) -> SharedMemoryContainer:
+        """Create a container with ``cls.create(*args, **kwargs)``, owned by the session."""
+        return self.add(cls.create(*args, **kwargs))
+
+    def add(self, container: SharedMemoryContainer) -> SharedMemoryContainer:
+        with self._lock:
+            self.containers.append(container)
+        return container
+
+    def __enter__(self) -> "SharedDataSession":
+        atexit.register(self.close)
+        if self.handle_signals and current_thread() is main_thread():
+            for signum in self._SIGNALS:
+                self._previous_handlers[signum] = signal.signal(signum, self._handle_signal)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _handle_signal(self, signum, frame):
+        previous = self._previous_handlers.get(signum)
+        self.close()
+        if callable(previous):
+            previous(signum, frame)
+        elif previous != signal.SIG_IGN:
+            os.kill(os.getpid(), signum)  # Now with the default handler, restored by close
+
+    def close(self) -> None:
+        """Release all the session's containers, in the reverse order of their creation."""
+        with self._lock:
+            containers, self.containers = self.containers, []
+            for signum, previous in self._previous_handlers.items():
+                if signal.getsignal(signum) == self._handle_signal:
+                    signal.signal(signum, previous if previous is not None else signal.SIG_DFL)
+            self._previous_handlers = {}
+            atexit.unregister(self.close)
+            for container in reversed(containers):
+                _release(container)
+
+
+@dataclass
+class LeakedSegment:
+    """A shared memory segment created by a container in a process that is no longer running."""
+    name: str
+    pid: int
+    size: int
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass  # Running, as another user
+    return True
+
+
+def _mapped_segments() -> set[str]:
+    """Names of the shared memory segments mapped by the running processes whose memory maps can be read."""
+    names = set()
+    prefix = os.path.join(_SHM_DIR, "")
+    for pid in os.listdir("/proc") if os.path.isdir("/proc") else []:
+        if not pid.isdigit():
+            continue
+        try:
+            with open(f"/proc/{pid}/maps") as f:
+                for line in f:
+                    start = line.find(prefix)
+                    if start >= 0:
+                        names.add(line[start + len(prefix):].split()[0])
+        except OSError:
+            continue  # Exited since listed, or another user's process
+    return names
+
+
+def find_leaked_segments() -> list[LeakedSegment]:
+    """Find the shared memory segments created by containers in processes that have since died without unlinking
+    them (for example, when killed by the OOM killer or a scheduler). Segments created through a
+    ``SharedMemoryManager`` are owned by its process, and aren't included.
+
+    A segment can outlive its creator legitimately, e.g. one created by a pool worker and passed to the parent process
+    when the worker exits (on pool shutdown, or with ``max_tasks_per_child``), so segments still mapped by a running
+    process (as listed in ``/proc/<pid>/maps``) aren't included either. Segments held only by name, not yet attached
+    to, or mapped by processes of other users (whose maps can't be read), can't be told apart from leaked ones.
+
+    Processes are identified by PID, so only segments created in the same PID namespace (i.e. container) can be
+    told apart from those of running processes.
+    """
+    if not os.path.isdir(_SHM_DIR):
+        return []
+    leaked = []
+    mapped = None
+    for name in sorted(os.listdir(_SHM_DIR)):
+        if not name.startswith(_SEGMENT_PREFIX):
+            continue
+        pid = name[len(_SEGMENT_PREFIX):].split('_')[0]
+        if not pid.isdigit() or _pid_alive(int(pid)):
+            continue
+        if mapped is None:
+            mapped = _mapped_segments()
+        if name in mapped:
+            continue
+        try:
+            size = os.path.getsize(os.path.join(_SHM_DIR, name))
+        except FileNotFoundError:
+            continue  # Removed since listed
+        leaked.append(LeakedSegment(name, int(pid), size))
+    return leaked
+
+
+def unlink_leaked_segments() -> list[LeakedSegment]:
+    """Remove the segments found by ``find_leaked_segments``, returning those removed.
+
+    Only call this when no other process can still be about to attach to a segment by name, since segments not
+    currently mapped by any process are removed (see ``find_leaked_segments``).
+    """
+    removed = []
+    for segment in find_leaked_segments():
+        try:
+            os.unlink(os.path.join(_SHM_DIR, segment.name))
+        except FileNotFoundError:
+            continue
+        removed.append(segment)
+    return removed
+
+
+# -----------------------
+# Sharing large arguments with worker processes
+
+
+class _SharedRef:
+    """Placeholder for a value placed in a shared memory container, sent to workers in place of the value."""
+    __slots__ = ('key', 'cls', 'metadata')
+
+    def __init__(self, key: str, cls: type, metadata: dict):
+        self.key = key
+        self.cls = cls
+        self.metadata = metadata
+
+
+# Per-process cache of loaded shared values, keyed by reference key, holding (container, value) pairs
+_shared_values: dict[str, tuple[SharedMemoryContainer, object]] = {}
+_shared_values_lock = Lock()
+
+
+def _load_shared(ref: _SharedRef):
+    """Load the value for a shared reference, attaching to its container only once per process."""
+    with _shared_values_lock:
+        if ref.key not in _shared_values:
+            # Release values from previous sessions, whose containers are no longer needed
+            session = ref.key.split(':')[0]
+            for key in [k for k in _shared_values if not k.startswith(session + ':')]:
+                container, _ = _shared_values.pop(key)
+                try:
+                    container.close()
+                except BufferError:
+                    pass  # The value is still referenced somewhere; leave it for garbage collection
+            container = ref.cls.from_metadata(ref.metadata)
+            _shared_values[ref.key] = (container, container.load())
+        return _shared_values[ref.key][1]
+
+
+def _resolve_shared(value):
+    """Replace a shared reference, or shared references among the elements of a tuple or list, with their values."""
+    if isinstance(value, _SharedRef):
+        return _load_shared(value)
+    elif isinstance(value, (tuple, list)) and any(isinstance(v, _SharedRef) for v in value):
+        return type(value)(_resolve_shared(v) for v in value)
+    return value
+
+
+class _SharedArgsFunction:
+    """Wrap a function to resolve shared references among its arguments (and partial arguments) before calling it."""
+    def __init__(self, func):
+        self.func = func
+
+    def __call__(self, *args, **kwargs):
+        func = self.func
+        if isinstance(func, partial):
+            args = func.args + args
+            kwargs = {**func.keywords, **kwargs}
+            func = func.func
+        args = [_resolve_shared(arg) for arg in args]
+        kwargs = {k: _resolve_shared(v) for k, v in kwargs.items()}
+        return func(*args, **kwargs)
+
+
+class _ArgSharer:
+    """Place large NumPy arrays and DataFrames passed to parmap into shared memory, for the duration of a map call.
+
+    Arrays go into ``SharedMemoryArray`` containers, and DataFrames into ``SharedMemoryDataFrame`` containers, managed
+    by a ``SharedMemoryManager`` and removed by ``close``. Each distinct object is shared once, however many items it
+    appears in.
+    """
+    def __init__(self, threshold: int):
+        self.threshold = threshold
+        self._session = get_hash_string(time.time_ns(), length=8)
+        self._shared = {}  # id(value) -> (reference, value); holding the value keeps its id from being reused
+        self._smm = None
+
+    def __enter__(self) -> "_ArgSharer":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _get_smm(self) -> SharedMemoryManager:
+        if self._smm is None:
+            self._smm = SharedMemoryManager()
+            self._smm.start()
+        return self._smm
+
+    def _create(self, value) -> Optional[SharedMemoryContainer]:
+        if isinstance(value, np.ndarray):
+            if value.dtype.hasobject or value.nbytes < max(self.threshold, 1):
+                return None
+            return SharedMemoryArray.create(value, smm=self._get_smm())
+        elif isinstance(value, pd.DataFrame):
+            if value.memory_usage(index=True).sum() < self.threshold:
+                return None
+            return SharedMemoryDataFrame.create(value, smm=self._get_smm())
+        return None
+
+    def share_value(self, value):
+        """Get a shared reference for a large array or DataFrame, or for those among the elements of a tuple or list;
+        return other values unchanged.
+        """
+        if isinstance(value, (tuple, list)):
+            shared = [self.share_value(v) if isinstance(v, (np.ndarray, pd.DataFrame)) else v for v in value]
+            if any(isinstance(v, _SharedRef) for v in shared):
+                return type(value)(shared)
+            return value
+        if id(value) in self._shared:
+            return self._shared[id(value)][0]
+        container = self._create(value)
+        if container is None:
+            return value
+        ref = _SharedRef(f"{self._session}:{len(self._shared)}", type(container), container.metadata)
+        self._shared[id(value)] = (ref, value)
+        return ref
+
+    def share_func(self, func) -> _SharedArgsFunction:
+        """Share the large arguments bound to a partial function, and wrap it to resolve shared arguments."""
+        if isinstance(func, partial):
+            func = partial(func.func, *[self.share_value(arg) for arg in func.args],
+                           **{k: self.share_value(v) for k, v in func.keywords.items()})
+        return _SharedArgsFunction(func)
+
+    def close(self) -> None:
+        if self._smm is not None:
+            self._smm.shutdown()
+            self._smm = None
+        self._shared.clear()
+
+
+def _arg_sharer(share, mode):
+    """Get an _ArgSharer for the share argument of a map call, or a null context if not sharing."""
+    if share is None or share is False or mode == "thread":
+        return nullcontext()
+    threshold = _DEFAULT_SHARE_THRESHOLD if share is True else int(share)
+    return _ArgSharer(threshold)
+
+
 # -----------------------
 # Example usage:
 
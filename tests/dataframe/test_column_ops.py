@@ -1,7 +1,10 @@
+import operator
+
 import numpy as np
 import pandas as pd
 import pytest
 
+from superleaf.dataframe import column_ops
 from superleaf.dataframe.column_ops import Col, Values
 
 
@@ -54,3 +57,241 @@ def test_col_ops(df: pd.DataFrame):
     # Test Values operator on series
     s = df["col1"]
     assert _iseq(((Values() < 1) | (Values() >= 3))(s), (s < 1) | (s >= 3))
+
+
+class _Negated(Col):
+    def __call__(self, df: pd.DataFrame) -> pd.Series:
+        return -df[self._name]
+
+
+class _Doubled(Col):
+    def __call__(self, df: pd.DataFrame) -> pd.Series:
+        return super().__call__(df) * 2
+
+
+def test_col_ops_shared_subexpressions(df: pd.DataFrame):
+    calls = []
+
+    def double(x):
+        calls.append(x)
+        return 2 * x
+
+    doubled = Col("col1").map(double)
+    assert _iseq(((doubled > 3) | (doubled < -3))(df), (df["col1"] * 2 > 3) | (df["col1"] * 2 < -3))
+    assert len(calls) == len(df)
+
+    # Structurally identical operations are evaluated once, even if constructed separately
+    calls.clear()
+    assert _iseq(((Col("col1").map(double) + 1) * Col("col1").map(double))(df), (2 * df["col1"] + 1) * 2 * df["col1"])
+    assert len(calls) == len(df)
+
+    # A cache shared between evaluations of several operations
+    calls.clear()
+    cache = {}
+    (doubled > 3).evaluate(df, cache)
+    (doubled < -3).evaluate(df, cache)
+    assert len(calls) == len(df)
+    (doubled > 3).evaluate(df.iloc[:2], cache)
+    assert len(calls) == len(df) + 2
+
+    # Operations that define their own __call__ are evaluated as before
+    assert _iseq((_Negated("col1") + Col("col1"))(df), [0] * len(df))
+    assert _iseq((_Negated("col1") == Col("col1"))(df), df["col1"] == 0)
+    assert _iseq(_Doubled("col1")(df), df["col1"] * 2)
+    assert _iseq((_Doubled("col1") - Col("col1"))(df), df["col1"])
+
+    # Literals that are equal but give different results aren't shared
+    assert ((Col("col1") / 0.0) > (Col("col1") / -0.0))(df.iloc[1:]).all()
+    assert column_ops._literal_key(0.0) != column_ops._literal_key(-0.0)
+    assert column_ops._literal_key((1, 0.0)) != column_ops._literal_key((1.0, -0.0))
+
+
+@pytest.mark.parametrize("dtype", [object, "string", "string[pyarrow]"])
+def test_col_ops_str_predicates(dtype):
+    if dtype == "string[pyarrow]":
+        pytest.importorskip("pyarrow")
+    s = pd.Series(["one", "two", None, "three", "nine"], dtype=dtype, name="s")
+    df = pd.DataFrame({"s": s})
+
+    def expected(f):
+        return df["s"].map(f).tolist()
+
+    result = Col("s").startswith("t")(df)
+    assert result.dtype == bool and result.name == "s"
+    assert result.tolist() == expected(lambda x: str(x).startswith("t"))
+    assert Col("s").endswith("e")(df).tolist() == expected(lambda x: str(x).endswith("e"))
+    # Missing values are tested through their string representation, as for any other object
+    assert (Col("s").startswith_one_of(["tw", "N", "n"])(df).tolist()
+            == expected(lambda x: any(str(x).startswith(p) for p in ["tw", "N", "n"])))
+    assert (Col("s").endswith_one_of(("e", "o", "a"))(df).tolist()
+            == expected(lambda x: any(str(x).endswith(p) for p in ["e", "o", "a"])))
+    assert not Col("s").startswith_one_of([])(df).any()
+    assert Col("s").contains("e")(df.dropna()).tolist() == [True, False, True, True]
+    with pytest.raises(TypeError):
+        Col("s").contains("e")(df)
+
+
+def test_col_ops_str_predicates_non_string():
+    df = pd.DataFrame({"n": [1, 12, 21], "l": [["a"], ["b", "o"], []], "m": ["one", 1, "two"]})
+    assert Col("n").startswith(1)(df).tolist() == [True, True, False]
+    assert Col("n").endswith_one_of([1, 2])(df).tolist() == [True, True, True]
+    assert Col("l").contains("o")(df).tolist() == [False, True, False]
+    assert Col("m").startswith_one_of(["o", "1"])(df).tolist() == [True, True, False]
+    assert (Col("l").contains("o") | Col("l").contains("a"))(df).tolist() == [True, True, False]
+
+
+def test_col_ops_isin_col():
+    df = pd.DataFrame({
+        "x": [1.0, 2.0, np.nan, 4.0],
+        "n": [1, 3, 5, 4],
+        "lists": [[1], (0, 2), [np.nan], {4, 5}],
+        "arrays": [np.array([0, 1]), np.array([2.5]), np.array([np.nan]), np.array([], dtype=int)],
+        "s": ["a", "b", "c", "d"],
+        "strs": ["abc", "x", "c", "cd"],
+    })
+
+    def expected(left, right):
+        return [x in y for x, y in zip(df[left], df[right])]
+
+    assert Col("x").isin(Col("n"))(df).tolist() == [True, False, False, True]
+    for left, right in [("x", "lists"), ("x", "arrays"), ("n", "arrays"), ("s", "strs"), ("s", "lists")]:
+        result = Col(left).isin(Col(right))(df)
+        assert result.dtype == bool
+        assert result.tolist() == expected(left, right)
+    assert Col("s").isin(Col("s"))(df).name == "s"
+
+    # Nullable numeric columns are compared as their NumPy counterparts, with missing values never matching
+    df["N"] = pd.array([1, 3, None, 4], dtype="Int64")
+    assert Col("x").isin(Col("N"))(df).tolist() == [True, False, False, True]
+    assert Col("N").isin(Col("N"))(df).tolist() == [True, True, False, True]
+    assert Col("x").astype("Float64").isin(Col("n"))(df).tolist() == Col("x").isin(Col("n"))(df).tolist()
+
+
+_COMPILABLE_OPS = [
+    (Col("col1") * 2 > 3) | (Col("col1") * 2 < -3),
+    ((Col("col1") + Col("col2")) / Col("col2")) ** 2 - Col("col3"),
+    ~(Col("col3") > 0) & (Col("col1") != Col("col2")),
+    Col("col1") * Col("col2") - 1,
+    (Col("col1").map(lambda x: x % 3) + 1 >= 2) & (Col("col4") == "two"),
+    Col("col1").astype(float) ** Col("col2"),
+    (Col("col1") * 2).map(lambda x: x + 1),
+    Col("col1").isin([0, 1]) | (Col("col1") > 3),
+]
+
+
+@pytest.mark.parametrize("op", _COMPILABLE_OPS)
+def test_col_ops_compile(df: pd.DataFrame, op, monkeypatch):
+    numexpr_evaluate = pytest.importorskip("numexpr").evaluate
+    expressions = []
+
+    def evaluate(expression, **kwargs):
+        expressions.append(expression)
+        return numexpr_evaluate(expression, **kwargs)
+
+    monkeypatch.setattr(column_ops.numexpr, "evaluate", evaluate)
+    pd.testing.assert_series_equal(op.compile(min_rows=0)(df), op(df), check_names=False)
+    assert len(expressions) == 1
+    pd.testing.assert_series_equal(op.compile()(df), op(df))  # Too few rows to compile
+
+
+def test_col_ops_compile_float32():
+    pytest.importorskip("numexpr")
+    df = pd.DataFrame({"x": np.full(20000, 0.1, dtype=np.float32), "g": np.arange(20000, dtype=np.float32),
+                       "i": np.arange(20000, dtype=np.int32)})
+    for op in [Col("x") == 0.1, Col("x") <= 0.1, Col("g") * 2.5, Col("g") ** 2, Col("i") * 2, Col("i") + 2.5,
+               (Col("g") * 0.1 > 10.1) & (Col("i") < 100), Col("i") / 0.0, Col("i") / -0.0, Col("i") / 3.0,
+               Col("i") / 0.1, Col("g") / 0.0, Col("x") / 3.0]:
+        with np.errstate(divide="ignore", invalid="ignore"):
+            pd.testing.assert_series_equal(op.compile(min_rows=0)(df), op(df), check_names=False, check_exact=True)
+    assert (Col("x") == 0.1).compile(min_rows=0)(df).all()
+
+    # Compiled results are cached apart from the interpreted ones
+    op = Col("g") * 2.5
+    cache = {}
+    assert op.compile(min_rows=0).evaluate(df, cache).name is None
+    assert op.evaluate(df, cache).name == "g"
+
+
+def test_col_ops_compile_mixed_dtypes(monkeypatch):
+    numexpr_evaluate = pytest.importorskip("numexpr").evaluate
+    expressions = []
+
+    def evaluate(expression, **kwargs):
+        expressions.append(expression)
+        return numexpr_evaluate(expression, **kwargs)
+
+    monkeypatch.setattr(column_ops.numexpr, "evaluate", evaluate)
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({"i32": rng.integers(-50, 50, 1000).astype(np.int32),
+                       "i64": rng.integers(-2 ** 40, 2 ** 40, 1000),
+                       "f32": rng.normal(size=1000).astype(np.float32) * 10,
+                       "f64": rng.normal(size=1000) * 10})
+    df.loc[::7, "f64"] = np.nan
+    df.loc[::11, "f32"] = 0.0
+    df.loc[::13, "f64"] = -0.0
+    operands = [Col(name) for name in df] + [0, 2, -3, 2 ** 31 + 1, 0.0, -0.0, 0.1, 3.0, 0.5, np.nan]
+    for left in operands[:len(df.columns)]:
+        for right in operands:
+            for fun in [operator.add, operator.sub, operator.mul, operator.truediv, operator.pow, operator.eq,
+                        operator.lt]:
+                op = fun(left, right)
+                try:
+                    with np.errstate(all="ignore"):
+                        expected = op(df)
+                except (ValueError, OverflowError) as e:
+                    with pytest.raises(type(e)):
+                        op.compile(min_rows=0)(df)
+                    continue
+                with np.errstate(all="ignore"):
+                    result = op.compile(min_rows=0)(df)
+                # Powers other than NumPy's special cases are computed with a different pow implementation
+                pd.testing.assert_series_equal(result, expected, check_names=False,
+                                               check_exact=not isinstance(op, column_ops._PowOp))
+    assert len(expressions) > 200
+
+
+def test_col_ops_compile_errors_and_fallback(df: pd.DataFrame, monkeypatch):
+    with pytest.raises(ValueError):
+        (Col("col1") ** Col("col2")).compile(min_rows=0)(df)
+    monkeypatch.setattr(column_ops, "numexpr", None)
+    op = (Col("col1") * 2 > 3) | (Col("col1") * 2 < -3)
+    pd.testing.assert_series_equal(op.compile(min_rows=0)(df), op(df))
+
+
+def test_col_ops_short_circuit():
+    df = pd.DataFrame({"x": np.arange(1000), "s": ["abc", "bcd"] * 500})
+    calls = []
+
+    def slow(v):
+        calls.append(v)
+        return v.startswith("a")
+
+    matched = Col("s").map(slow)
+    ops = [(Col("x") < 10) & matched,
+           (Col("x") >= 10) | matched,
+           ((Col("x") < 100) & Col("s").startswith("a")) & matched,
+           (Col("x") < 100) & ((Col("x") > 5) | matched),
+           ~((Col("x") < 10) & matched)]
+    for op, n_calls in zip(ops, [10, 10, 50, 6, 10]):
+        expected = op(df)
+        calls.clear()
+        result = op.short_circuit()(df)
+        assert len(calls) == n_calls
+        pd.testing.assert_series_equal(result, expected, check_names=False)
+
+    # Every row decided by the left operand
+    calls.clear()
+    assert not ((Col("x") < 0) & matched).short_circuit()(df).any()
+    assert not calls
+
+    # Cheap right operands, or mostly undecided rows, aren't worth subsetting
+    calls.clear()
+    assert _iseq(((Col("x") < 990) & matched).short_circuit()(df), ((Col("x") < 990) & matched)(df))
+    assert len(calls) == 2 * len(df)
+    assert ((Col("x") < 10) & (Col("x") > 5)).short_circuit()(df).name is None
+    assert ((Col("x") < 10) & Col("s").isna()).short_circuit()(df).sum() == 0
+
+    # On a Series
+    s = df["x"]
+    op = (Values() < 10) & Values().map(lambda v: v % 2 == 1)
+    assert _iseq(op.short_circuit()(s), op(s))
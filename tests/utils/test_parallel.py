@@ -0,0 +1,854 @@
+import asyncio
+import itertools
+import json
+import mmap
+import os
+import queue
+import signal
+import subprocess
+import sys
+import time
+from functools import partial
+
+import numpy as np
+import pandas as pd
+import pytest
+
+# The parallel utilities need the optional "parallel" dependencies
+pytest.importorskip("multiprocess")
+pytest.importorskip("tqdm")
+pa = pytest.importorskip("pyarrow")
+
+import pyarrow.compute as pc  # noqa: E402
+
+from superleaf.utils import parallel  # noqa: E402
+from superleaf.utils.parallel import (  # noqa: E402
+    ParallelPool, ParallelStats, ParquetDataFrame, PyArrowArray, PyArrowDataFrame, SharedDataDict, SharedDataSession,
+    SharedMemoryArray, SharedMemoryArrowList, SharedMemoryDataFrame, SharedMemoryDict,
+    TaskError, _ArgSharer, _Checkpoint,
+    _ProgressReporter, _SharedRef, _TaskSample, _resolve_shared, aparmap, iparmap, parmap,
+)
+
+
+def _square(x):
+    return x * x
+
+
+def _mul(x, y):
+    return x * y
+
+
+def _pair(x):
+    return [x, x]
+
+
+def _sleep_inverse(x):
+    time.sleep(0.01 * (5 - x % 5))
+    return x
+
+
+@pytest.mark.parametrize("mode", ["thread", "process"])
+def test_parmap(mode):
+    xs = list(range(20))
+    assert parmap(_sleep_inverse, xs, mode=mode, n_workers=2) == xs
+    assert parmap(_mul, list(zip(xs, xs)), star=True, mode=mode, n_workers=2) == [x * x for x in xs]
+
+
+@pytest.mark.parametrize("mode", ["thread", "process", "notebook"])
+def test_iparmap(mode):
+    xs = list(range(20))
+    results = iparmap(_sleep_inverse, iter(xs), mode=mode, n_workers=3, max_in_flight=4)
+    assert not isinstance(results, list)
+    assert list(results) == xs
+    assert sorted(iparmap(_sleep_inverse, xs, mode=mode, n_workers=3, ordered=False)) == xs
+    assert list(iparmap(_mul, zip(xs, xs), star=True, mode=mode, n_workers=3, chunksize=4)) == [x * x for x in xs]
+
+
+def test_iparmap_lazy():
+    consumed = []
+
+    def gen():
+        for i in itertools.count():
+            consumed.append(i)
+            yield i
+
+    results = iparmap(_square, gen(), mode="thread", n_workers=2, max_in_flight=3)
+    assert [next(results) for _ in range(5)] == [x * x for x in range(5)]
+    results.close()
+    assert len(consumed) < 10
+
+
+@pytest.mark.parametrize("chunksize", [1, 3, "auto"])
+def test_parmap_dynamic_chunks(chunksize):
+    xs = list(range(30))
+    assert list(parmap(_sleep_inverse, xs, mode="process", n_workers=3, chunksize=chunksize)) == xs
+    assert list(iparmap(_sleep_inverse, xs, mode="thread", n_workers=3, chunksize=chunksize)) == xs
+
+
+def test_progress_reporter():
+    q = queue.Queue()
+    reporter = _ProgressReporter(q, "key", batch_size=10, interval=60)
+    for _ in range(25):
+        reporter.update()
+    assert q.qsize() == 2
+    reporter.flush()
+    counts = [q.get() for _ in range(q.qsize())]
+    assert counts == [("key", 10), ("key", 10), ("key", 5)]
+
+
+_worker_state = {}
+
+
+def _init_state(value):
+    _worker_state["value"] = value
+
+
+def _add_state(x):
+    return x + _worker_state["value"]
+
+
+@pytest.mark.parametrize("mode", ["thread", "process", "notebook"])
+def test_parallel_pool(mode):
+    xs = list(range(20))
+    with ParallelPool(2, mode=mode, nthreads_per_process=1 if mode == "thread" else 2,
+                      initializer=_init_state, initargs=(100,)) as pool:
+        assert pool.map(_add_state, xs) == [x + 100 for x in xs]
+        assert pool.map(_add_state, xs, chunksize=3) == [x + 100 for x in xs]
+        assert list(pool.imap(_add_state, iter(xs))) == [x + 100 for x in xs]
+        assert pool.starmap(_mul, zip(xs, xs)) == [x * x for x in xs]
+        assert pool.submit(_mul, 3, y=4).result() == 12
+        assert parmap(_square, xs, pool=pool) == [x * x for x in xs]
+
+
+def test_mapped_with_pool():
+    from superleaf.sequences import flat_map, mapped
+
+    with ParallelPool(2) as pool:
+        assert mapped(_square, range(10), pool=pool) == [x * x for x in range(10)]
+        assert flat_map(_pair, range(3), pool=pool) == [0, 0, 1, 1, 2, 2]
+
+
+def _weighted_sum(i, weights, df=None):
+    total = float(weights[i].sum())
+    if df is not None:
+        total += float(df["a"].iloc[i])
+    return total
+
+
+def test_shared_memory_dataframe():
+    df = pd.DataFrame({"x": np.arange(1000.), "n": np.arange(1000), "s": ["a", "b"] * 500},
+                      index=pd.RangeIndex(10, 1010, name="i"))
+    container = SharedMemoryDataFrame.create(df)
+    attached = SharedMemoryDataFrame.from_metadata(container.metadata)
+    try:
+        loaded = attached.load()
+        pd.testing.assert_frame_equal(loaded, df, check_dtype=False)
+        assert loaded["x"].dtype == np.float64 and loaded["n"].dtype == np.int64
+        # Numeric columns are views of the shared memory
+        shared_bytes = np.frombuffer(attached.shared_mem.buf, dtype=np.uint8)
+        assert np.shares_memory(loaded["x"].to_numpy(), shared_bytes)
+        assert np.shares_memory(loaded["n"].to_numpy(), shared_bytes)
+        assert attached.load_arrow().num_rows == 1000
+        del loaded, shared_bytes
+    finally:
+        attached.close()
+        container.close().unlink()
+
+
+def _item_length(i, metadata):
+    return len(SharedMemoryArrowList.from_metadata(metadata).load()[i])
+
+
+@pytest.mark.parametrize("items", [
+    ["a", "bc", None, "déf"] * 100,
+    [b"\x00\x01", b"", b"xyz"],
+    [[1, 2], [], None, [3]],
+    [[["a"], ["b", "c"]], [[]]],
+])
+def test_shared_memory_arrow_list(items):
+    with SharedDataSession() as session:
+        container = session.create(SharedMemoryArrowList, items)
+        attached = SharedMemoryArrowList.from_metadata(container.metadata)
+        loaded = attached.load()
+        assert len(loaded) == len(items) and list(loaded) == items
+        assert loaded[1] == items[1] and loaded[-1] == items[-1]
+        assert loaded[1:3].to_pylist() == items[1:3] and loaded[::2].to_pylist() == items[::2]
+        assert np.shares_memory(np.frombuffer(loaded[1:].array.buffers()[-1], np.uint8),
+                                np.frombuffer(attached.shared_mem.buf, np.uint8))
+        with pytest.raises(IndexError):
+            loaded[len(items)]
+        del loaded
+        attached.close()
+
+
+def test_shared_memory_arrow_list_parmap():
+    words = [str(i) * (i % 7) for i in range(1000)]
+    with SharedDataSession() as session:
+        container = session.create(SharedMemoryArrowList, words)
+        lengths = parmap(partial(_item_length, metadata=container.metadata), range(0, 1000, 10), n_workers=2)
+    assert lengths == [len(words[i]) for i in range(0, 1000, 10)]
+
+
+def _lookup_sum(keys, metadata):
+    return int(SharedMemoryDict.from_metadata(metadata).load().lookup(keys).sum())
+
+
+def test_shared_memory_dict(monkeypatch):
+    words = {f"w{i}": i * 2 for i in range(1000)}
+    with SharedDataSession() as session:
+        container = session.create(SharedMemoryDict, words)
+        attached = SharedMemoryDict.from_metadata(container.metadata)
+        mapping = attached.load()
+        assert len(mapping) == 1000 and dict(mapping) == words
+        assert mapping["w7"] == 14 and "w7" in mapping and "x" not in mapping
+        assert np.array_equal(mapping.lookup(np.array(["w999", "w0"])), [1998, 0])
+        assert np.array_equal(mapping.lookup(["w1", "x"], default=-1), [2, -1])
+        assert np.array_equal(mapping.contains(["w1", "x"]), [True, False])
+        with pytest.raises(KeyError):
+            mapping.lookup(["x"])
+        # Keys of other types are missing
+        assert 5 not in mapping and ("w7",) not in mapping and mapping.get(5) is None and mapping.get(("w7",)) is None
+        assert np.array_equal(mapping.lookup(["w1", 5, ("w1",), None], default=-1), [2, -1, -1, -1])
+        with pytest.raises(KeyError):
+            mapping[("w7",)]
+        del mapping
+        attached.close()
+
+        mapping = session.create(SharedMemoryDict, pd.Series(["a", None, "c"], index=[30, 10, 20])).load()
+        assert list(mapping) == [10, 20, 30] and mapping[10] is None
+        assert list(mapping.lookup(np.array([20, 30, 5]), default="?")) == ["c", "a", "?"]
+        assert list(mapping.lookup([20, "x", (20,), 30.0], default="?")) == ["c", "?", "?", "a"]
+        assert "x" not in mapping and (20,) not in mapping and mapping.get("x", "?") == "?"
+        with pytest.raises(ValueError):
+            session.create(SharedMemoryDict, pd.Series([1, 2], index=[1, 1]))
+        assert len(session.create(SharedMemoryDict, {}).load().lookup([1], default=0)) == 1
+
+        keys = [[f"w{i}" for i in range(j, 1000, 100)] for j in range(10)]
+        sums = parmap(partial(_lookup_sum, metadata=container.metadata), keys, n_workers=2)
+        assert sums == [sum(words[k] for k in ks) for ks in keys]
+
+        # Keys with colliding hashes are told apart
+        monkeypatch.setattr(parallel.ArrowMapping, "_hash", staticmethod(lambda keys: np.zeros(len(keys), np.uint64)))
+        mapping = session.create(SharedMemoryDict, {"a": 1, "b": 2, "c": 3}).load()
+        assert np.array_equal(mapping.lookup(["c", "a", "b", "z"], default=0), [3, 1, 2, 0]) and mapping["b"] == 2
+        del mapping
+
+
+class _DoubledArray(SharedMemoryArray):
+    def load(self):
+        return 2 * super().load()
+
+
+def test_shared_data_dict_registry():
+    with SharedDataSession() as session:
+        data = session.create(SharedDataDict, {
+            "a": session.create(SharedMemoryArray, np.arange(5)),
+            "b": session.create(_DoubledArray, np.ones(3)),
+        })
+        metadata = data.metadata
+        assert metadata["a"]["class"] == "SharedMemoryArray"
+        attached = SharedDataDict.from_metadata(metadata)
+        loaded = attached.load()
+        assert np.array_equal(loaded["a"], np.arange(5)) and np.array_equal(loaded["b"], [2., 2., 2.])
+        del loaded
+        attached.close()
+    with pytest.raises(ValueError):
+        SharedDataDict.from_metadata({"x": {"class": "os.system", "meta": {}}})
+
+
+def _shm_exists(name):
+    return os.path.exists(os.path.join("/dev/shm", name))
+
+
+def test_shared_data_session():
+    handler = signal.getsignal(signal.SIGTERM)
+    with SharedDataSession() as session:
+        array = session.create(SharedMemoryArray, np.arange(10))
+        loaded = array.load()  # Still referenced when the session ends
+        name = array.shared_mem.name
+        assert name.startswith(f"superleaf_{os.getpid()}_") and _shm_exists(name)
+        assert parallel.find_leaked_segments() == []
+    assert not _shm_exists(name) and session.containers == []
+    assert signal.getsignal(signal.SIGTERM) == handler
+    del loaded
+
+
+_SESSION_SCRIPT = """
+import time
+import numpy as np
+from superleaf.utils.parallel import SharedDataSession, SharedMemoryArray
+with SharedDataSession() as session:
+    print(session.create(SharedMemoryArray, np.arange(10)).shared_mem.name, flush=True)
+    time.sleep(30)
+"""
+
+
+def test_shared_data_session_signal():
+    proc = subprocess.Popen([sys.executable, "-c", _SESSION_SCRIPT], stdout=subprocess.PIPE, text=True,
+                            env={**os.environ, "PYTHONPATH": os.path.join(os.path.dirname(__file__), "../../src")})
+    name = proc.stdout.readline().strip()
+    assert _shm_exists(name)
+    proc.send_signal(signal.SIGTERM)
+    assert proc.wait(timeout=10) == -signal.SIGTERM
+    assert not _shm_exists(name)
+
+
+_LEAK_SCRIPT = """
+import numpy as np
+from multiprocessing import resource_tracker
+from superleaf.utils.parallel import SharedMemoryArray
+array = SharedMemoryArray.create(np.arange(10))
+resource_tracker.unregister(array.shared_mem._name, "shared_memory")  # As if the tracker were killed too
+print(array.shared_mem.name)
+"""
+
+
+def test_find_leaked_segments():
+    result = subprocess.run([sys.executable, "-c", _LEAK_SCRIPT], capture_output=True, text=True, check=True,
+                            env={**os.environ, "PYTHONPATH": os.path.join(os.path.dirname(__file__), "../../src")})
+    name = result.stdout.strip()
+    assert _shm_exists(name)
+    # A segment still mapped by a running process, such as one handed over by an exited worker, is in use
+    with open(os.path.join("/dev/shm", name), "r+b") as f, mmap.mmap(f.fileno(), 0):
+        assert name not in [segment.name for segment in parallel.find_leaked_segments()]
+        assert name not in [segment.name for segment in parallel.unlink_leaked_segments()]
+    leaked = [segment for segment in parallel.find_leaked_segments() if segment.name == name]
+    assert len(leaked) == 1 and leaked[0].size >= 80
+    assert name in [segment.name for segment in parallel.unlink_leaked_segments()]
+    assert not _shm_exists(name)
+
+
+def test_pyarrow_dataframe_selective_load(tmp_path):
+    df = pd.DataFrame({"a": np.arange(100.), "b": np.arange(100), "c": [str(i) for i in range(100)]},
+                      index=pd.RangeIndex(1000, 1200, 2))
+    container = PyArrowDataFrame.create(df, dir=str(tmp_path))
+    pd.testing.assert_frame_equal(container.load(), df)
+    pd.testing.assert_frame_equal(container.load(columns=["c", "a"], rows=slice(10, 40, 3)),
+                                  df[["c", "a"]].iloc[10:40:3])
+    pd.testing.assert_frame_equal(container.load(rows=slice(-5, None), filter=pc.field("b") > 96),
+                                  df.iloc[-5:].query("b > 96"))
+    table = container.load_arrow(columns=["b"], filter=pc.field("a") >= 90)
+    assert table.column_names == ["b"] and table.column("b").to_pylist() == list(range(90, 100))
+    with pytest.raises(ValueError):
+        container.load(rows=slice(None, None, -1))
+
+    # Only the record batches overlapping the selected rows are read from files written in several batches
+    path = str(tmp_path / "batches.arrow")
+    indexed = df.set_index("c")
+    table = pa.Table.from_pandas(indexed)
+    with pa.OSFile(path, "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        for batch in table.to_batches(max_chunksize=7):
+            writer.write_batch(batch)
+    pd.testing.assert_frame_equal(PyArrowDataFrame(path).load(columns=["b"], rows=slice(5, 30)),
+                                  indexed[["b"]].iloc[5:30])
+
+
+def _part(i):
+    return pd.DataFrame({"i": np.full(3, i), "x": np.arange(3.) + 3 * i})
+
+
+def test_pyarrow_dataframe_writer(tmp_path):
+    with PyArrowDataFrame.writer(dir=str(tmp_path)) as writer:
+        for df in iparmap(_part, range(10), mode="thread", n_workers=2):
+            writer.write(df)
+    expected = pd.concat([_part(i) for i in range(10)], ignore_index=True)
+    container = writer.container
+    assert writer.n_rows == 30
+    pd.testing.assert_frame_equal(container.load(), expected)
+    pd.testing.assert_frame_equal(container.load(rows=slice(4, 11)), expected.iloc[4:11].reset_index(drop=True))
+
+    batches = list(container.iter_batches(columns=["x"], batch_size=2))
+    assert [len(batch) for batch in batches] == [2, 1] * 10
+    pd.testing.assert_frame_equal(pd.concat(batches, ignore_index=True), expected[["x"]])
+
+    # Indexes of files written in one batch are kept, including RangeIndex labels
+    df = pd.DataFrame({"a": np.arange(10)}, index=pd.RangeIndex(0, 20, 2))
+    batches = list(PyArrowDataFrame.create(df, dir=str(tmp_path)).iter_batches(batch_size=4, filter=pc.field("a") > 1))
+    pd.testing.assert_frame_equal(pd.concat(batches), df.iloc[2:], check_index_type=False)
+
+    with pytest.raises(ValueError):
+        with PyArrowDataFrame.writer(dir=str(tmp_path)):
+            pass
+
+
+@pytest.mark.parametrize("array", [
+    np.arange(120.).reshape(2, 3, 4, 5),
+    np.arange(30, dtype=np.int16)[::3],
+    np.arange(6, dtype=np.float32).reshape(2, 3).T,
+    np.array([[True, False], [False, True]]),
+    np.arange(4, dtype=np.complex64),
+    np.array(["2020-01-01", "2021-06-30"], dtype="datetime64[D]"),
+    np.zeros(3, dtype=[("a", "<i4"), ("b", "<f8")]),
+    np.arange(6, dtype=">i4"),
+    np.zeros((0, 3)),
+    np.array(1.5),
+])
+def test_pyarrow_array(tmp_path, array):
+    loaded = PyArrowArray.create(array, dir=str(tmp_path)).load()
+    assert loaded.shape == array.shape and loaded.dtype == array.dtype
+    assert np.array_equal(loaded, array)
+    # A view of the memory-mapped file
+    assert not loaded.flags.writeable and not loaded.flags.owndata
+
+
+def test_pyarrow_array_legacy_format(tmp_path):
+    legacy = PyArrowDataFrame.create(pd.DataFrame({"0": [1., 2.], "1": [3., 4.]}), dir=str(tmp_path))
+    assert np.array_equal(PyArrowArray(legacy.path).load(), [[1., 3.], [2., 4.]])
+
+
+@pytest.mark.parametrize("compression", ["lz4", "zstd"])
+def test_pyarrow_compression(tmp_path, compression):
+    df = pd.DataFrame({"a": np.arange(10000) % 7, "b": np.repeat(["x", "y"], 5000)})
+    plain = PyArrowDataFrame.create(df, dir=str(tmp_path))
+    compressed = PyArrowDataFrame.create(df, dir=str(tmp_path), compression=compression)
+    assert compressed.write_stats.file_bytes < plain.write_stats.file_bytes
+    assert compressed.write_stats.data_bytes == plain.write_stats.data_bytes
+    assert compressed.write_stats.compression_ratio > 1
+    pd.testing.assert_frame_equal(compressed.load(), df)
+    pd.testing.assert_frame_equal(compressed.load(rows=slice(10, 20)), df.iloc[10:20])
+    assert compressed.read_stats.data_bytes > 0 and compressed.read_stats.throughput > 0
+    with PyArrowDataFrame.writer(dir=str(tmp_path), compression=compression) as writer:
+        writer.write(df.iloc[:5000])
+        writer.write(df.iloc[5000:])
+    assert writer.container.write_stats.data_bytes == plain.write_stats.data_bytes
+    pd.testing.assert_frame_equal(writer.container.load(), df)
+    array = np.arange(12.).reshape(3, 4)
+    assert np.array_equal(PyArrowArray.create(array, dir=str(tmp_path), compression=compression).load(), array)
+    with pytest.raises(ValueError):
+        PyArrowDataFrame.create(df, dir=str(tmp_path), compression="gzip")
+
+
+def test_parquet_dataframe(tmp_path):
+    df = pd.DataFrame({"a": np.arange(100), "b": np.arange(100.) / 2}, index=pd.RangeIndex(10, 110, name="i"))
+    container = ParquetDataFrame.create(df, path="df", dir=str(tmp_path), row_group_size=10)
+    assert container.path.endswith(".parquet")
+    assert container.write_stats.file_bytes == os.path.getsize(container.path)
+    pd.testing.assert_frame_equal(container.load(), df, check_index_type=False)
+    assert container.schema.names[:2] == ["a", "b"]
+    pd.testing.assert_frame_equal(container.load(columns=["b"], filter=pc.field("a") >= 95), df.loc[105:, ["b"]],
+                                  check_index_type=False)
+    assert container.read_stats.data_bytes > 0
+    assert container.load_arrow(columns=["a"]).column_names[0] == "a"
+    with pytest.raises(FileExistsError):
+        ParquetDataFrame.create(df, path="df", dir=str(tmp_path))
+
+
+def test_arg_sharer():
+    arr = np.ones((100, 10))
+    small = np.ones(3)
+    with _ArgSharer(threshold=1000) as sharer:
+        ref = sharer.share_value(arr)
+        assert isinstance(ref, _SharedRef)
+        assert sharer.share_value(arr) is ref
+        assert sharer.share_value(small) is small
+        item = sharer.share_value((1, arr))
+        assert item[0] == 1 and item[1] is ref
+        assert np.array_equal(_resolve_shared(item)[1], arr)
+
+
+@pytest.mark.parametrize("mode", ["thread", "process"])
+def test_parmap_share(mode):
+    weights = np.arange(200.).reshape(20, 10)
+    df = pd.DataFrame({"a": np.arange(20.)})
+    expected = [float(weights[i].sum() + i) for i in range(20)]
+    items = [(i, weights, df) for i in range(20)]
+    assert parmap(_weighted_sum, items, star=True, mode=mode, n_workers=2, share=100) == expected
+    func = partial(_weighted_sum, weights=weights, df=df)
+    assert list(iparmap(func, range(20), mode=mode, n_workers=2, share=100)) == expected
+
+
+def _row(i):
+    return np.full(3, i, dtype=np.int32)
+
+
+@pytest.mark.parametrize("mode", ["thread", "process", "notebook"])
+@pytest.mark.parametrize("n_workers", [1, 2])
+def test_parmap_out(mode, n_workers):
+    expected = np.repeat(np.arange(10, dtype=np.int32)[:, np.newaxis], 3, axis=1)
+    result = parmap(_row, range(10), mode=mode, n_workers=n_workers, result_shape=3, result_dtype=np.int32)
+    assert result.dtype == np.int32
+    assert np.array_equal(result, expected)
+
+    out = np.zeros((10, 3))
+    assert parmap(_row, range(10), mode=mode, n_workers=n_workers, out=out, chunksize=2) is out
+    assert np.array_equal(out, expected)
+
+    shared = SharedMemoryArray.create_empty((10, 3), np.int64)
+    try:
+        parmap(_row, range(10), mode=mode, n_workers=n_workers, out=shared)
+        assert np.array_equal(shared.load(), expected)
+    finally:
+        shared.close().unlink()
+
+    with pytest.raises(ValueError):
+        parmap(_row, range(10), mode=mode, n_workers=n_workers, out=np.zeros((5, 3)))
+
+    segments = set(os.listdir("/dev/shm"))
+    result = parmap(_row, [], mode=mode, n_workers=n_workers, result_shape=3)
+    assert result.shape == (0, 3)
+    assert set(os.listdir("/dev/shm")) <= segments
+
+
+def _batch_square(xs):
+    assert isinstance(xs, (list, np.ndarray, pd.Series))
+    return np.asarray(xs) ** 2
+
+
+def _batch_add(xs, ys):
+    assert isinstance(xs, list) and isinstance(ys, list)
+    return [x + y for x, y in zip(xs, ys)]
+
+
+def _batch_row_sums(df):
+    assert isinstance(df, pd.DataFrame)
+    return df.sum(axis=1).to_numpy()
+
+
+@pytest.mark.parametrize("mode", ["thread", "process"])
+@pytest.mark.parametrize("n_workers", [1, 2])
+def test_parmap_batched(mode, n_workers):
+    xs = list(range(25))
+    expected = [x * x for x in xs]
+    assert parmap(_batch_square, xs, mode=mode, n_workers=n_workers, batched=True) == expected
+    assert parmap(_batch_square, np.array(xs), mode=mode, n_workers=n_workers, batch_size=4, chunksize=2) == expected
+    assert parmap(_batch_square, pd.Series(xs), mode=mode, n_workers=n_workers, batch_size=7, chunksize="auto") \
+        == expected
+    assert parmap(_batch_add, list(zip(xs, xs)), star=True, mode=mode, n_workers=n_workers, batch_size=3) \
+        == [2 * x for x in xs]
+    df = pd.DataFrame({"a": xs, "b": xs})
+    assert parmap(_batch_row_sums, df, mode=mode, n_workers=n_workers, batch_size=5) == [2 * x for x in xs]
+    result = parmap(_batch_square, xs, mode=mode, n_workers=n_workers, batch_size=4, result_shape=(),
+                    result_dtype=int)
+    assert np.array_equal(result, expected)
+    assert list(iparmap(_batch_square, iter(xs), mode=mode, n_workers=n_workers, batch_size=4)) == expected
+    with pytest.raises(ValueError):
+        parmap(_pair, xs, mode=mode, n_workers=n_workers, batch_size=4)
+
+
+class _ConcurrencyCounter:
+    def __init__(self):
+        self.current = 0
+        self.max = 0
+
+    async def __call__(self, x, delay=0.01):
+        if delay is None:
+            raise KeyError(x)
+        self.current += 1
+        self.max = max(self.max, self.current)
+        await asyncio.sleep(delay * (5 - x % 5))
+        self.current -= 1
+        return x * x
+
+
+def test_parmap_async():
+    xs = list(range(30))
+    counter = _ConcurrencyCounter()
+    assert parmap(counter, xs, mode="async", n_workers=4) == [x * x for x in xs]
+    assert counter.max == 4
+    assert parmap(counter, [(x, 0.001) for x in xs], star=True, mode="async", n_workers=-1) == [x * x for x in xs]
+    assert counter.max == 30
+    counter = _ConcurrencyCounter()
+    assert parmap(counter, [(x, 0.001) for x in xs], star=True, mode="async", n_workers="auto") == [x * x for x in xs]
+    assert counter.max == min(30, 16 * parallel._available_cpus())
+    with pytest.raises(KeyError):
+        parmap(counter, [(x, None if x == 13 else 0.001) for x in xs], star=True, mode="async", n_workers=4)
+
+
+def test_aparmap():
+    async def main():
+        counter = _ConcurrencyCounter()
+        results = await aparmap(counter, iter(range(20)), n_workers=3)
+        # Running from sync code within a running event loop uses a separate loop
+        assert parmap(counter, range(5), mode="async", n_workers=2) == [x * x for x in range(5)]
+        return results, counter.max
+
+    results, max_concurrency = asyncio.run(main())
+    assert results == [x * x for x in range(20)]
+    assert max_concurrency == 3
+
+
+def _fail_some(x):
+    if x % 7 == 3:
+        raise ValueError(f"bad item {x}")
+    return x * x
+
+
+def _batch_fail_some(xs):
+    return [_fail_some(x) for x in xs]
+
+
+def _hang_on_5(x):
+    time.sleep(5 if x == 5 else 0.01)
+    return x
+
+
+@pytest.mark.parametrize("mode, n_workers", [("thread", 1), ("thread", 3), ("process", 3)])
+def test_parmap_on_error(mode, n_workers):
+    xs = list(range(20))
+    expected = [None if x % 7 == 3 else x * x for x in xs]
+    with pytest.raises(ValueError, match="bad item"):
+        parmap(_fail_some, xs, mode=mode, n_workers=n_workers)
+
+    results, errors = parmap(_fail_some, xs, mode=mode, n_workers=n_workers, on_error="collect")
+    assert results == expected
+    assert [e.index for e in errors] == [3, 10, 17]
+    assert all(isinstance(e, TaskError) and e.error_type == "ValueError" and e.attempts == 1 for e in errors)
+    assert errors[0].message == "bad item 3" and "_fail_some" in errors[0].traceback
+
+    succeeded = [r for r in expected if r is not None]
+    assert parmap(_fail_some, xs, mode=mode, n_workers=n_workers, on_error="skip") == succeeded
+    assert list(iparmap(_fail_some, xs, mode=mode, n_workers=n_workers, on_error="skip")) == succeeded
+
+    # A failing batch fails every item in it
+    results, errors = parmap(_batch_fail_some, xs, mode=mode, n_workers=n_workers, batch_size=4, on_error="collect")
+    failed = [0, 1, 2, 3, 8, 9, 10, 11, 16, 17, 18, 19]
+    assert results == [None if x in failed else x * x for x in xs]
+    assert [e.index for e in errors] == failed
+
+    out, errors = parmap(_fail_some, xs, mode=mode, n_workers=n_workers, result_shape=(), result_dtype=int,
+                         on_error="collect")
+    assert [out[i] for i in range(20) if i % 7 != 3] == succeeded
+    assert len(errors) == 3
+    with pytest.raises(ValueError):
+        parmap(_fail_some, xs, mode=mode, n_workers=n_workers, result_shape=(), on_error="skip")
+
+
+class _Flaky:
+    def __init__(self, n_failures):
+        self.n_failures = n_failures
+        self.attempts = {}
+
+    def __call__(self, x):
+        self.attempts[x] = self.attempts.get(x, 0) + 1
+        if self.attempts[x] <= self.n_failures:
+            raise RuntimeError("try again")
+        return x
+
+
+def test_parmap_retries():
+    flaky = _Flaky(2)
+    assert parmap(flaky, range(10), mode="thread", n_workers=2, retries=2, retry_delay=0.001) == list(range(10))
+    assert set(flaky.attempts.values()) == {3}
+    results, errors = parmap(_Flaky(2), range(10), mode="thread", n_workers=2, retries=1, retry_delay=0.001,
+                             on_error="collect")
+    assert results == [None] * 10
+    assert {e.attempts for e in errors} == {2}
+
+
+@pytest.mark.parametrize("mode", ["thread", "process"])
+def test_parmap_timeout(mode):
+    start = time.monotonic()
+    results, errors = parmap(_hang_on_5, range(12), mode=mode, n_workers=3, timeout=0.5, retries=1,
+                             on_error="collect")
+    assert results == [None if x == 5 else x for x in range(12)]
+    assert [(e.index, e.error_type, e.attempts) for e in errors] == [(5, "TimeoutError", 2)]
+    assert time.monotonic() - start < 4
+    with pytest.raises(TimeoutError):
+        parmap(_hang_on_5, range(12), mode=mode, n_workers=3, timeout=0.5)
+    with ParallelPool(3, mode=mode) as pool:
+        assert pool.map(_hang_on_5, range(12), timeout=0.5, on_error="skip") == [x for x in range(12) if x != 5]
+        # The pool is still usable after its workers were killed
+        assert pool.map(_square, range(12)) == [x * x for x in range(12)]
+
+
+def test_parmap_async_errors():
+    async def fail_or_hang(x):
+        await asyncio.sleep(5 if x == 5 else 0.001)
+        return _fail_some(x)
+
+    results, errors = parmap(fail_or_hang, range(12), mode="async", n_workers=4, timeout=0.5, on_error="collect")
+    assert results == [None if x in (3, 5, 10) else x * x for x in range(12)]
+    assert [(e.index, e.error_type) for e in errors] == [(3, "ValueError"), (5, "TimeoutError"), (10, "ValueError")]
+
+
+def _square_unless_failing(x):
+    if x >= 10 and os.environ.get("SUPERLEAF_TEST_FAIL"):
+        raise RuntimeError("failing")
+    return x * x
+
+
+def _batch_square_unless_failing(xs):
+    return [_square_unless_failing(x) for x in xs]
+
+
+@pytest.mark.parametrize("mode, n_workers, batched",
+                         [("thread", 1, False), ("process", 2, False), ("process", 2, True)])
+def test_parmap_checkpoint(tmp_path, monkeypatch, mode, n_workers, batched):
+    if batched:
+        func, xs, batch_size = _batch_square_unless_failing, np.arange(20), 5
+    else:
+        func, xs, batch_size = _square_unless_failing, list(range(20)), None
+    kwargs = dict(mode=mode, n_workers=n_workers, batch_size=batch_size, checkpoint_dir=str(tmp_path))
+    monkeypatch.setenv("SUPERLEAF_TEST_FAIL", "1")
+    with pytest.raises(RuntimeError):
+        parmap(func, xs, **kwargs)
+    assert set(_Checkpoint(str(tmp_path), func, xs, batched).pending) >= set(range(10, 20))
+    # Failed items aren't saved, so they are rerun
+    results, errors = parmap(func, xs, on_error="collect", **kwargs)
+    assert results == [x * x for x in range(10)] + [None] * 10
+    assert _Checkpoint(str(tmp_path), func, xs, batched).pending == list(range(10, 20))
+
+    monkeypatch.delenv("SUPERLEAF_TEST_FAIL")
+    assert parmap(func, xs, **kwargs) == [x * x for x in range(20)]
+    # Everything is now complete, so nothing is rerun (and nothing fails)
+    monkeypatch.setenv("SUPERLEAF_TEST_FAIL", "1")
+    assert parmap(func, xs, **kwargs) == [x * x for x in range(20)]
+    # Different inputs are checkpointed separately
+    with pytest.raises(RuntimeError):
+        parmap(func, xs[::-1], **kwargs)
+
+
+_CHECKPOINT_SCRIPT = """
+import sys
+from superleaf.utils.parallel import parmap
+calls = []
+def record(s):
+    calls.append(s)
+    return len(s)
+func, key = (record, None) if sys.argv[2] == "function" else (lambda s: record(s), "sets")
+results = parmap(func, [{"a", "b", str(i)} for i in range(5)], n_workers=1, checkpoint_dir=sys.argv[1],
+                 checkpoint_key=key)
+print(results, len(calls))
+"""
+
+
+@pytest.mark.parametrize("func", ["function", "lambda"])
+def test_parmap_checkpoint_across_runs(tmp_path, func):
+    outputs = []
+    for seed in ("1", "2"):  # Sets of strings iterate in a different order with each hash seed
+        result = subprocess.run(
+            [sys.executable, "-c", _CHECKPOINT_SCRIPT, str(tmp_path), func], capture_output=True, text=True,
+            check=True, env={**os.environ, "PYTHONHASHSEED": seed,
+                             "PYTHONPATH": os.path.join(os.path.dirname(__file__), "../../src")})
+        outputs.append(result.stdout.strip())
+    assert outputs == ["[3, 3, 3, 3, 3] 5", "[3, 3, 3, 3, 3] 0"]
+    assert len(os.listdir(tmp_path)) == 1
+
+
+def test_parmap_checkpoint_unpicklable(tmp_path):
+    with pytest.raises(ValueError, match="checkpoint_key"):
+        parmap(lambda x: x, [1, 2], n_workers=1, checkpoint_dir=str(tmp_path))
+    with pytest.raises(ValueError, match="checkpoint_key"):
+        parmap(_square, [1, queue.Queue()], n_workers=1, checkpoint_dir=str(tmp_path))
+    assert parmap(lambda x: x, [1, 2], n_workers=1, checkpoint_dir=str(tmp_path), checkpoint_key="job") == [1, 2]
+    # The key alone identifies the call, so the results saved under it are reused
+    assert parmap(_square, [1, 2], n_workers=1, checkpoint_dir=str(tmp_path), checkpoint_key="job") == [1, 2]
+
+
+@pytest.mark.parametrize("files, expected", [
+    ({"cpu.max": "max 100000"}, None),
+    ({"cpu.max": "50000 100000"}, 1),
+    ({"cpu.max": "250000 100000"}, 3),
+    ({"cpu/cpu.cfs_quota_us": "150000", "cpu/cpu.cfs_period_us": "100000"}, 2),
+    ({"cpu/cpu.cfs_quota_us": "-1", "cpu/cpu.cfs_period_us": "100000"}, None),
+])
+def test_available_cpus(tmp_path, monkeypatch, files, expected):
+    for name, content in files.items():
+        (tmp_path / name).parent.mkdir(exist_ok=True)
+        (tmp_path / name).write_text(content + "\n")
+    monkeypatch.setattr(parallel, "_CGROUP_ROOT", str(tmp_path))
+    n_affinity = len(os.sched_getaffinity(0))
+    assert parallel._available_cpus() == (n_affinity if expected is None else min(n_affinity, expected))
+
+
+def test_auto_workers(monkeypatch):
+    monkeypatch.setattr(parallel, "_available_cpus", lambda: 8)
+    monkeypatch.setattr(parallel, "_available_memory", lambda: 10 << 30)
+    cpu_bound = _TaskSample(latency=0.1, cpu_fraction=0.95, memory=1 << 20)
+    io_bound = _TaskSample(latency=0.1, cpu_fraction=0.1, memory=1 << 20)
+    assert parallel._auto_workers("process") == (8, 1)
+    assert parallel._auto_workers("process", sample=cpu_bound, total=1000) == (8, 1)
+    assert parallel._auto_workers("process", sample=io_bound, total=1000) == (8, 10)
+    assert parallel._auto_workers("process", nthreads_per_process=2, sample=io_bound, total=1000) == (8, 2)
+    assert parallel._auto_workers("thread", sample=io_bound) == (80, 1)
+    # Limited by memory, at 8 GB for tasks of 2 GB each, or 5 GB for 1 GB each with 100 MB per process
+    assert parallel._auto_workers("thread", sample=_TaskSample(0.1, 0.1, 2 << 30)) == (4, 1)
+    assert parallel._auto_workers("process", sample=_TaskSample(0.1, 0.95, 1 << 30)) == (7, 1)
+    # Too little work to be worth starting more processes
+    assert parallel._auto_workers("process", sample=cpu_bound, total=3) == (3, 1)
+
+
+def _native_thread_env(_):
+    return os.environ.get("OMP_NUM_THREADS")
+
+
+@pytest.mark.parametrize("mode", ["thread", "process"])
+def test_parmap_auto_workers(mode):
+    xs = list(range(20))
+    assert parmap(_sleep_inverse, xs, mode=mode, n_workers="auto") == xs
+    assert list(iparmap(_square, xs, mode=mode, n_workers="auto")) == [x * x for x in xs]
+    with ParallelPool("auto", mode=mode) as pool:
+        assert pool.n_workers == parallel._available_cpus()
+
+
+def _logged_square(path, x):
+    with open(path, "a") as f:
+        f.write(f"{x}\n")
+    return x * x
+
+
+@pytest.mark.parametrize("mode", ["thread", "process"])
+def test_parmap_auto_workers_runs_items_once(tmp_path, mode):
+    log = tmp_path / "calls.log"
+    xs = list(range(10))
+    assert parmap(partial(_logged_square, str(log)), xs, mode=mode, n_workers="auto") == [x * x for x in xs]
+    assert sorted(map(int, log.read_text().split())) == xs
+
+    # Items completed by an earlier run (saved under the same key) aren't sampled again
+    log.unlink()
+    func = partial(_logged_square, str(log))
+    kwargs = dict(mode=mode, checkpoint_dir=str(tmp_path / "checkpoints"), checkpoint_key="squares")
+    assert parmap(func, xs[:5], n_workers=1, **kwargs) == [x * x for x in xs[:5]]
+    log.unlink()
+    assert parmap(func, xs, n_workers="auto", **kwargs) == [x * x for x in xs]
+    assert sorted(map(int, log.read_text().split())) == xs[5:]
+    log.unlink()
+    assert parmap(func, xs, n_workers="auto", **kwargs) == [x * x for x in xs]
+    assert not log.exists()
+
+    # Items aren't sampled outside the pool's timeouts
+    start = time.time()
+    results, errors = parmap(_hang_on_5, [5] + xs[:5], mode=mode, n_workers="auto", timeout=0.5, on_error="collect")
+    assert time.time() - start < 4
+    assert results == [None] + xs[:5]
+    assert [(e.index, e.error_type) for e in errors] == [(0, "TimeoutError")]
+
+
+def test_parallel_pool_native_threads():
+    with ParallelPool(2, native_threads=3) as pool:
+        assert pool.map(_native_thread_env, range(4)) == ["3"] * 4
+
+
+@pytest.mark.parametrize("mode,kwargs", [
+    ("thread", {}),
+    ("process", {}),
+    ("process", {"chunksize": 5}),
+    ("process", {"timeout": 10}),
+    ("notebook", {"chunksize": 5}),
+])
+def test_parmap_stats(tmp_path, mode, kwargs):
+    stats = ParallelStats()
+    assert parmap(_square, range(40), mode=mode, n_workers=2, stats=stats, **kwargs) == [i * i for i in range(40)]
+    assert stats.n_items == 40 and stats.mode == mode and stats.wall_seconds > 0
+    assert sum(worker['items'] for worker in stats.workers.values()) == 40
+    assert all(0 <= worker['idle'] <= stats.wall_seconds for worker in stats.workers.values())
+    for chunk in stats.chunks:
+        assert chunk.submitted <= chunk.started <= chunk.finished <= chunk.received
+        assert (chunk.args_bytes > 0) == (mode != "thread") and (chunk.result_bytes > 0) == (mode != "thread")
+    assert sum(rate for _, rate in stats.throughput()) > 0
+    summary = stats.to_dict()
+    assert summary['n_items'] == 40 and len(summary['chunks']) == len(stats.chunks)
+    json.dumps(summary)
+    stats.to_chrome_trace(str(tmp_path / "trace.json"))
+    with open(tmp_path / "trace.json") as f:
+        events = json.load(f)['traceEvents']
+    assert sum(event['ph'] == 'X' for event in events) == len(stats.chunks)
+
+
+def test_parmap_stats_summary(capsys):
+    parmap(_square, range(10), mode="thread", n_workers=2, stats=True)
+    assert "10 items in" in capsys.readouterr().out
+    parmap(_square, range(10), n_workers=1, stats=True)
+    assert "with 1 serial worker," in capsys.readouterr().out
+    with pytest.raises(ValueError):
+        parmap(_square, range(10), mode="async", stats=True)